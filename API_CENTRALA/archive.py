@@ -0,0 +1,193 @@
+# archive.py
+# -*- coding: utf-8 -*-
+
+import heapq
+import json
+import logging
+import os
+import threading
+import zlib
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+from urllib.parse import quote, unquote
+
+import config
+
+log = logging.getLogger(__name__)
+
+# --- Format Archiwum ---
+# ARCHIVE_DIR/<barrier_id>/<RRRR-MM>.seg - segment: dopisywane bloki (zlib z JSON listy wierszy)
+# ARCHIVE_DIR/<barrier_id>/<RRRR-MM>.idx - indeks bloków: jedna linia JSON na blok
+#   {"offset", "length", "count", "first_id", "last_id", "first_ts", "last_ts", "failures"}
+# Wiersze zapisywane są jako listy w kolejności COLUMNS (zwięźlej niż słowniki).
+
+COLUMNS = ("id", "barrier_id", "event_type", "trigger_method", "event_timestamp",
+           "user_id", "success", "details", "failed_action", "received_at")
+_ID = COLUMNS.index("id")
+_SUCCESS = COLUMNS.index("success")
+_RECEIVED_AT = COLUMNS.index("received_at")
+
+# Cache indeksów: ścieżka .idx -> (rozmiar pliku, lista wpisów)
+_index_cache: Dict[str, Tuple[int, List[Dict]]] = {}
+_index_lock = threading.Lock()
+
+
+def _barrier_dir(barrier_id: str) -> str:
+    # quote() zamienia znaki spoza [A-Za-z0-9_.-] (np. '/'), więc nazwa katalogu jest bezpieczna i odwracalna
+    return os.path.join(config.ARCHIVE_DIR, quote(barrier_id, safe=""))
+
+def archived_barrier_ids() -> List[str]:
+    """Lista szlabanów, które mają jakiekolwiek segmenty archiwum."""
+    if not os.path.isdir(config.ARCHIVE_DIR):
+        return []
+    return [unquote(name) for name in os.listdir(config.ARCHIVE_DIR) if os.path.isdir(os.path.join(config.ARCHIVE_DIR, name))]
+
+# --- Zapis ---
+
+def append_block(barrier_id: str, month: str, rows: Sequence[Sequence]) -> int:
+    """Dopisuje blok wierszy (posortowanych rosnąco po id) do segmentu szlabanu/miesiąca.
+
+    Najpierw zapisywane (i synchronizowane na dysk) są dane, potem wpis indeksu, więc
+    po awarii w połowie blok bez wpisu w indeksie jest po prostu niewidoczny.
+    Zwraca liczbę bajtów skompresowanego bloku.
+    """
+    directory = _barrier_dir(barrier_id)
+    os.makedirs(directory, exist_ok=True)
+    segment_path = os.path.join(directory, f"{month}.seg")
+    index_path = os.path.join(directory, f"{month}.idx")
+
+    payload = zlib.compress(json.dumps([list(row) for row in rows], separators=(",", ":")).encode("utf-8"), config.ARCHIVE_COMPRESSION_LEVEL)
+    with open(segment_path, "ab") as segment:
+        offset = segment.tell()
+        segment.write(payload)
+        segment.flush()
+        os.fsync(segment.fileno())
+
+    entry = {
+        "offset": offset,
+        "length": len(payload),
+        "count": len(rows),
+        "first_id": rows[0][_ID],
+        "last_id": rows[-1][_ID],
+        "first_ts": rows[0][_RECEIVED_AT],
+        "last_ts": rows[-1][_RECEIVED_AT],
+        "failures": sum(1 for row in rows if not row[_SUCCESS]),
+    }
+    with open(index_path, "a", encoding="utf-8") as index:
+        index.write(json.dumps(entry, separators=(",", ":")) + "\n")
+        index.flush()
+        os.fsync(index.fileno())
+    return len(payload)
+
+# --- Odczyt ---
+
+def _load_index(index_path: str) -> List[Dict]:
+    """Wczytuje indeks segmentu (z cache, dopóki plik nie urośnie)."""
+    size = os.path.getsize(index_path)
+    with _index_lock:
+        cached = _index_cache.get(index_path)
+        if cached and cached[0] == size:
+            return cached[1]
+    entries = []
+    with open(index_path, "r", encoding="utf-8") as index:
+        for line in index:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                log.warning(f"Archive: Skipping corrupted index line in {index_path}.")
+                continue
+            entry["segment"] = index_path[:-4] + ".seg"
+            entries.append(entry)
+    with _index_lock:
+        _index_cache[index_path] = (size, entries)
+    return entries
+
+def _barrier_blocks(barrier_id: str) -> List[Dict]:
+    """Wszystkie bloki szlabanu (ze wszystkich miesięcy), posortowane rosnąco po first_id."""
+    directory = _barrier_dir(barrier_id)
+    if not os.path.isdir(directory):
+        return []
+    blocks = []
+    for name in os.listdir(directory):
+        if name.endswith(".idx"):
+            blocks.extend(_load_index(os.path.join(directory, name)))
+    blocks.sort(key=lambda entry: entry["first_id"])
+    return blocks
+
+def _read_block(entry: Dict) -> List[list]:
+    with open(entry["segment"], "rb") as segment:
+        segment.seek(entry["offset"])
+        payload = segment.read(entry["length"])
+    return json.loads(zlib.decompress(payload))
+
+def _iter_barrier_rows(barrier_id: str, before_id: Optional[int], after_id: Optional[int],
+                       only_failures: bool, descending: bool) -> Iterator[list]:
+    """Wiersze jednego szlabanu w kolejności id; czyta tylko bloki przecinające zakres (indeks)."""
+    blocks = [
+        entry for entry in _barrier_blocks(barrier_id)
+        if (before_id is None or entry["first_id"] < before_id)
+        and (after_id is None or entry["last_id"] > after_id)
+        and (not only_failures or entry.get("failures", 1))
+    ]
+    if descending:
+        blocks.reverse()
+    last_id = None
+    for entry in blocks:
+        rows = _read_block(entry)
+        if descending:
+            rows.reverse()
+        for row in rows:
+            row_id = row[_ID]
+            if before_id is not None and row_id >= before_id:
+                continue
+            if after_id is not None and row_id <= after_id:
+                continue
+            if only_failures and row[_SUCCESS]:
+                continue
+            # Pomijamy duplikaty (blok zapisany ponownie po przerwanym przebiegu retencji)
+            if last_id is not None and (row_id >= last_id if descending else row_id <= last_id):
+                continue
+            last_id = row_id
+            yield row
+
+def iter_events(barrier_ids: Optional[List[str]] = None, before_id: Optional[int] = None, after_id: Optional[int] = None,
+                only_failures: bool = False, descending: bool = True) -> Iterator[Dict]:
+    """Zdarzenia z archiwum jako słowniki (jak kolumny tabeli), w globalnej kolejności id.
+
+    Strumienie poszczególnych szlabanów są scalane leniwie (heapq.merge), więc w pamięci
+    jest naraz najwyżej jeden zdekompresowany blok na szlaban.
+    """
+    if barrier_ids is None:
+        barrier_ids = archived_barrier_ids()
+    streams = [_iter_barrier_rows(barrier_id, before_id, after_id, only_failures, descending) for barrier_id in barrier_ids]
+    merged = heapq.merge(*streams, key=lambda row: row[_ID], reverse=descending)
+    for row in merged:
+        yield dict(zip(COLUMNS, row))
+
+def max_archived_id() -> Optional[int]:
+    """Największe zarchiwizowane id (wszystkie starsze niż dowolne id w tabeli)."""
+    best = None
+    for barrier_id in archived_barrier_ids():
+        blocks = _barrier_blocks(barrier_id)
+        if blocks:
+            last = max(entry["last_id"] for entry in blocks)
+            best = last if best is None else max(best, last)
+    return best
+
+def stats() -> Dict:
+    """Rozmiar archiwum do monitoringu."""
+    segments = 0
+    total_bytes = 0
+    rows = 0
+    for barrier_id in archived_barrier_ids():
+        directory = _barrier_dir(barrier_id)
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if name.endswith(".seg"):
+                segments += 1
+                total_bytes += os.path.getsize(path)
+            elif name.endswith(".idx"):
+                rows += sum(entry["count"] for entry in _load_index(path))
+    return {"segments": segments, "bytes": total_bytes, "rows": rows}
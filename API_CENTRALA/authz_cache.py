@@ -0,0 +1,169 @@
+# authz_cache.py
+# -*- coding: utf-8 -*-
+
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+import db
+import db_async
+
+log = logging.getLogger(__name__)
+
+
+class AuthorizationCache:
+    """Procesowy cache danych autoryzacyjnych: user_id -> {barrier_id: poziom} oraz barrier_id -> URL kontrolera.
+
+    Wczytywany w lifespan i aktualizowany na bieżąco przy zapisach admina w tym procesie.
+    Zmiany z innych procesów (inne workery) wykrywa `check_consistency`: najpierw tani
+    `PRAGMA data_version` na dedykowanym połączeniu, a dopiero gdy baza się zmieniła -
+    licznik generacji utrzymywany triggerami (zapis zdarzeń nie wymusza przeładowania).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._permissions: Dict[int, Dict[str, str]] = {}
+        self._controller_urls: Dict[str, str] = {}
+        self._generation: Optional[int] = None
+        self._watch_conn: Optional[sqlite3.Connection] = None
+        self._data_version: Optional[int] = None
+        self._invalidation_callbacks = []
+        self.loaded = False
+
+        # Statystyki
+        self.reloads = 0
+        self.checks = 0
+        self.last_reload_ms = 0.0
+
+    # --- Wczytywanie i spójność ---
+
+    def load(self) -> bool:
+        """Wczytuje pełny obraz uprawnień i URL-i z bazy (synchronicznie - wywoływać w executorze DB)."""
+        started = time.perf_counter()
+        snapshot = db.load_authorization_snapshot()
+        if snapshot is None:
+            log.error("Authz Cache: Failed to load snapshot, falling back to DB lookups.")
+            return False
+        permissions_rows, urls, generation = snapshot
+        permissions: Dict[int, Dict[str, str]] = {}
+        for user_id, barrier_id, level in permissions_rows:
+            permissions.setdefault(user_id, {})[barrier_id] = level
+
+        with self._lock:
+            self._permissions = permissions
+            self._controller_urls = urls
+            self._generation = generation
+            self.loaded = True
+            self.reloads += 1
+            self.last_reload_ms = round((time.perf_counter() - started) * 1000, 3)
+        log.info(f"Authz Cache: Loaded {len(permissions_rows)} permissions, {len(urls)} barriers (generation {generation}) in {self.last_reload_ms} ms.")
+        return True
+
+    def add_invalidation_callback(self, callback):
+        """Rejestruje funkcję wywoływaną po wykryciu zmian z innego procesu (np. czyszczenie innych cache)."""
+        if callback not in self._invalidation_callbacks: # Lifespan może startować wielokrotnie (testy)
+            self._invalidation_callbacks.append(callback)
+
+    def check_consistency(self) -> bool:
+        """Przeładowuje cache, jeśli dane autoryzacyjne zmieniły się w bazie. Zwraca True po przeładowaniu."""
+        self.checks += 1
+        try:
+            if self._watch_conn is None:
+                self._watch_conn = db.open_dedicated_connection()
+            data_version = self._watch_conn.execute("PRAGMA data_version").fetchone()[0]
+            if data_version == self._data_version:
+                return False # Nikt nic nie zatwierdził od ostatniego sprawdzenia
+            self._data_version = data_version
+            generation = db.get_authz_generation(self._watch_conn)
+        except sqlite3.Error as e:
+            log.error(f"Authz Cache: Consistency check failed: {e}")
+            self._close_watch_connection()
+            return False
+
+        if generation == self._generation:
+            return False # Zmieniły się tylko inne tabele (np. zdarzenia)
+        log.info(f"Authz Cache: Generation changed ({self._generation} -> {generation}), reloading.")
+        reloaded = self.load()
+        if reloaded:
+            for callback in self._invalidation_callbacks:
+                try:
+                    callback()
+                except Exception:
+                    log.exception("Authz Cache: Invalidation callback failed.")
+        return reloaded
+
+    async def watch(self, interval: float):
+        """Pętla tła (lifespan): okresowo sprawdza spójność z bazą."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await db_async.run(self.check_consistency)
+            except Exception:
+                log.exception("Authz Cache: Unexpected error in watcher.")
+
+    def _close_watch_connection(self):
+        if self._watch_conn is not None:
+            try:
+                self._watch_conn.close()
+            except sqlite3.Error:
+                pass
+            self._watch_conn = None
+            self._data_version = None
+
+    def close(self):
+        """Zamyka dedykowane połączenie obserwujące (przy zamykaniu serwera)."""
+        self._close_watch_connection()
+
+    # --- Odczyty (O(1), bez bazy) ---
+
+    def get_permission_level(self, user_id: int, barrier_id: str) -> Optional[str]:
+        return self._permissions.get(user_id, {}).get(barrier_id)
+
+    def get_authorized_barrier_ids(self, user_id: int) -> List[str]:
+        return list(self._permissions.get(user_id, {}))
+
+    def get_controller_url(self, barrier_id: str) -> Optional[str]:
+        return self._controller_urls.get(barrier_id)
+
+    def get_controller_urls(self) -> Dict[str, str]:
+        """Kopia {barrier_id: controller_url} wszystkich szlabanów."""
+        return dict(self._controller_urls)
+
+    def get_authorized_barriers_details(self, user_id: int) -> List[Dict]:
+        """Odpowiednik db.get_user_authorized_barriers_details z pamięci."""
+        return [
+            {"barrier_id": barrier_id, "controller_url": self._controller_urls[barrier_id], "permission_level": level}
+            for barrier_id, level in self._permissions.get(user_id, {}).items()
+            if barrier_id in self._controller_urls
+        ]
+
+    # --- Aktualizacje po zapisach admina w tym procesie ---
+    # Pojedyncze przypisania do dict są atomowe (GIL), więc odczyty nie potrzebują blokady;
+    # blokada chroni tylko przed wyścigiem z równoległym load().
+
+    def set_barrier(self, barrier_id: str, controller_url: str):
+        with self._lock:
+            self._controller_urls[barrier_id] = controller_url
+
+    def set_permission(self, user_id: int, barrier_id: str, permission_level: str):
+        with self._lock:
+            self._permissions.setdefault(user_id, {})[barrier_id] = permission_level
+
+    def stats(self) -> Dict:
+        """Zwraca statystyki cache do monitoringu."""
+        return {
+            "loaded": self.loaded,
+            "users": len(self._permissions),
+            "barriers": len(self._controller_urls),
+            "generation": self._generation,
+            "reloads": self.reloads,
+            "checks": self.checks,
+            "last_reload_ms": self.last_reload_ms,
+        }
+
+
+# Globalny cache procesu (wczytywany w lifespan)
+cache = AuthorizationCache()
@@ -0,0 +1,156 @@
+# barrier_state.py
+# -*- coding: utf-8 -*-
+
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Optional, Tuple
+
+import config
+import models
+import timestamps
+
+log = logging.getLogger(__name__)
+
+# Zdarzenia kontrolera, które zmieniają stan szlabanu: pole -> nowa wartość
+# (statusy jak w Barrier.status() na kontrolerze). barrier_failure i inne niczego nie zmieniają.
+EVENT_STATE_CHANGES: Dict[str, Dict] = {
+    "barrier_opened": {"barrier_status": "Otwarty"},
+    "barrier_closed": {"barrier_status": "Zamkniety"},
+    "service_mode_started": {"service_mode": True},
+    "service_mode_ended": {"service_mode": False},
+    "system_startup": {"service_mode": False}, # Kontroler startuje zawsze bez trybu serwisowego
+}
+
+
+class BarrierState:
+    """Ostatni znany stan jednego szlabanu i skąd pochodzi."""
+
+    __slots__ = ("barrier_status", "service_mode", "source", "updated_at", "updated_mono",
+                 "last_event_id", "last_event_type", "last_event_time")
+
+    def __init__(self):
+        self.barrier_status: Optional[str] = None # "Otwarty" / "Zamkniety" / "W ruchu"
+        self.service_mode: Optional[bool] = None
+        self.source: Optional[str] = None # "probe" (GET /status) albo "event"
+        self.updated_at: Optional[str] = None
+        self.updated_mono = 0.0
+        self.last_event_id: Optional[int] = None
+        self.last_event_type: Optional[str] = None
+        self.last_event_time: Optional[datetime] = None # Czas zdarzenia z kontrolera (lokalny, bez strefy)
+
+    def _touch(self, source: str):
+        self.source = source
+        self.updated_at = datetime.now().isoformat()
+        self.updated_mono = time.monotonic()
+
+
+class BarrierStateCache:
+    """Stan szlabanów w pamięci procesu - odczyt bez łączenia się z kontrolerami.
+
+    Zasilany z dwóch źródeł: sond /status monitora kontrolerów (pełny, aktualny odczyt)
+    i zdarzeń zapisanych przez centralę (barrier_opened, service_mode_started, ...),
+    które aktualizują stan między sondami. Zdarzenia starsze niż ostatnio zastosowane
+    albo spóźnione o więcej niż BARRIER_STATE_EVENT_MAX_DELAY (np. wysłane z bufora
+    po zaniku sieci) nie nadpisują stanu. Każda odpowiedź podaje wiek wartości.
+    Wywoływane wyłącznie z pętli zdarzeń - bez blokad.
+    """
+
+    def __init__(self, max_age: float, event_max_delay: float):
+        self.max_age = max_age
+        self.event_max_delay = timedelta(seconds=event_max_delay)
+        self._states: Dict[str, BarrierState] = {}
+
+        # Statystyki
+        self.probe_updates = 0
+        self.event_updates = 0
+        self.events_ignored = 0
+
+    def _get(self, barrier_id: str) -> BarrierState:
+        state = self._states.get(barrier_id)
+        if state is None:
+            state = self._states[barrier_id] = BarrierState()
+        return state
+
+    # --- Aktualizacje ---
+
+    def apply_status(self, barrier_id: str, status: Dict):
+        """Wynik sondy GET {controller_url}/status: {"barrier_status": ..., "service_mode": ...}."""
+        state = self._get(barrier_id)
+        if "barrier_status" in status:
+            state.barrier_status = status["barrier_status"]
+        if "service_mode" in status:
+            state.service_mode = bool(status["service_mode"])
+        state._touch("probe")
+        self.probe_updates += 1
+
+    def apply_events(self, rows: Iterable[Tuple[models.BarrierEventDBInput, str, int]]):
+        """Zdarzenia po commicie (callback writera zdarzeń): (zdarzenie, czas odebrania, ID), w kolejności ID."""
+        for event, received_at, event_id in rows:
+            changes = EVENT_STATE_CHANGES.get(event.event_type)
+            if changes is None or not event.success:
+                continue
+            event_time = timestamps.to_local_naive(timestamps.parse_event_time(event.timestamp, received_at))
+            state = self._get(event.barrier_id)
+            if ((state.last_event_time is not None and event_time < state.last_event_time)
+                    or datetime.fromisoformat(received_at) - event_time > self.event_max_delay):
+                self.events_ignored += 1
+                continue
+            for field, value in changes.items():
+                setattr(state, field, value)
+            state.last_event_id = event_id
+            state.last_event_type = event.event_type
+            state.last_event_time = event_time
+            state._touch("event")
+            self.event_updates += 1
+
+    def retain(self, barrier_ids: Iterable[str]):
+        """Usuwa stan szlabanów, których nie ma już w bazie."""
+        for removed in set(self._states) - set(barrier_ids):
+            del self._states[removed]
+
+    # --- Odczyty ---
+
+    def get(self, barrier_id: str) -> Optional[BarrierState]:
+        return self._states.get(barrier_id)
+
+    def age(self, barrier_id: str) -> Optional[float]:
+        """Sekundy od ostatniej aktualizacji (None - stan nieznany)."""
+        state = self._states.get(barrier_id)
+        if state is None or state.source is None:
+            return None
+        return time.monotonic() - state.updated_mono
+
+    def to_dict(self, barrier_id: str, controller_reachable: Optional[bool] = None) -> Dict:
+        """Stan szlabanu do odpowiedzi API (pola None, gdy jeszcze nic o nim nie wiadomo)."""
+        state = self._states.get(barrier_id) or BarrierState()
+        age = self.age(barrier_id)
+        return {
+            "barrier_id": barrier_id,
+            "barrier_status": state.barrier_status,
+            "service_mode": state.service_mode,
+            "source": state.source,
+            "updated_at": state.updated_at,
+            "age_s": round(age, 3) if age is not None else None,
+            "stale": age is None or age > self.max_age,
+            "controller_reachable": controller_reachable,
+            "last_event_id": state.last_event_id,
+            "last_event_type": state.last_event_type,
+        }
+
+    def stats(self) -> Dict:
+        """Zwraca statystyki cache stanu do monitoringu."""
+        ages = [age for age in (self.age(barrier_id) for barrier_id in self._states) if age is not None]
+        return {
+            "barriers": len(self._states),
+            "known": len(ages),
+            "stale": len(self._states) - sum(1 for age in ages if age <= self.max_age),
+            "oldest_age_s": round(max(ages), 1) if ages else None,
+            "probe_updates": self.probe_updates,
+            "event_updates": self.event_updates,
+            "events_ignored": self.events_ignored,
+        }
+
+
+# Globalny cache procesu (zasilany przez health.monitor i writer zdarzeń)
+cache = BarrierStateCache(config.BARRIER_STATE_MAX_AGE, config.BARRIER_STATE_EVENT_MAX_DELAY)
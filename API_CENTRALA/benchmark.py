@@ -0,0 +1,539 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""Benchmarki wydajności Centrali ESZP.
+
+Każdy scenariusz tworzy tymczasową bazę danych, uruchamia serwer centrali
+(uvicorn) oraz atrapę kontrolera szlabanu w osobnych wątkach i mierzy
+czasy odpowiedzi przez prawdziwe HTTP. Uruchomienie (z katalogu API_CENTRALA):
+
+    python benchmark.py --list
+    python benchmark.py open-under-load --events 200000 --load-clients 16 --requests 200
+    python benchmark.py filtered-events --events 10000000 --barriers 500
+    python benchmark.py multi-barrier-feed --events 10000000 --barriers 1000
+    python benchmark.py auth-throughput --load-clients 8 --duration 10
+    python benchmark.py command-authz --users 10000 --barriers 500 --load-clients 16 --requests 500
+    python benchmark.py command-latency --load-clients 8 --requests 500
+    python benchmark.py write-lock-stall --load-clients 8 --requests 300 --lock-hold 1.0
+
+Skrypt nie zmienia pliku eszp.db.
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import random
+import shutil
+import socket
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+import httpx
+import uvicorn
+from fastapi import FastAPI
+
+import config
+import db
+import db_async
+import timestamps
+
+log = logging.getLogger("benchmark")
+
+ADMIN_HEADERS = {config.API_KEY_NAME: config.ADMIN_API_KEY}
+BENCH_USER = ("bench_user", "bench_password")
+
+# --- Infrastruktura ---
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def _start_server(app, port: int) -> uvicorn.Server:
+    """Uruchamia aplikację ASGI w wątku (własna pętla zdarzeń) i czeka na gotowość."""
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", lifespan="on"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+def _stop_server(server: uvicorn.Server):
+    server.should_exit = True
+    time.sleep(0.3)
+
+# Centrala działa w osobnym procesie (własny GIL), z bazą podmienioną na tymczasową
+# (kolejne argumenty NAZWA=wartość nadpisują ustawienia z config.py, np. CREDENTIAL_CACHE_ENABLED=False)
+_CENTRAL_BOOTSTRAP = """
+import ast, logging, sys, uvicorn
+import config
+config.DATABASE_FILE = sys.argv[1]
+config.LOG_LEVEL = logging.WARNING
+for override in sys.argv[3:]:
+    name, value = override.split("=", 1)
+    setattr(config, name, ast.literal_eval(value))
+uvicorn.run("central_server_fastapi:app", host="127.0.0.1", port=int(sys.argv[2]), log_level="warning")
+"""
+
+def _start_central(database: str, port: int, overrides: Optional[Dict] = None) -> subprocess.Popen:
+    """Uruchamia centralę w podprocesie i czeka, aż zacznie odpowiadać."""
+    settings = [f"{name}={value!r}" for name, value in (overrides or {}).items()]
+    process = subprocess.Popen([sys.executable, "-c", _CENTRAL_BOOTSTRAP, database, str(port), *settings],
+                               cwd=os.path.dirname(os.path.abspath(__file__)))
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("Central server process exited during startup.")
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/docs", timeout=1)
+            return process
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("Central server did not start in time.")
+
+def make_fake_controller(delay: float = 0.0) -> FastAPI:
+    """Atrapa API Flask z Raspberry Pi (odpowiada jak kontroler, opcjonalnie z opóźnieniem)."""
+    fake = FastAPI()
+
+    async def _reply(message: str, code: int = 202):
+        if delay:
+            await asyncio.sleep(delay)
+        return {"status": "ok", "message": message}
+
+    # Każdy szlaban ma własny prefiks ścieżki (controller_url musi być unikalny)
+    @fake.get("/{controller}/status")
+    async def status_endpoint(controller: str):
+        return {"barrier_status": "Zamkniety", "service_mode": False}
+
+    for action in ("open", "close", "service/start", "service/end"):
+        async def action_endpoint(controller: str, action: str = action):
+            return await _reply(f"{action} initiated.")
+        fake.add_api_route(f"/{{controller}}/{action}", action_endpoint, methods=["POST"], status_code=202)
+    return fake
+
+def seed_events(database: str, count: int, barrier_ids: List[str], failure_rate: float = 0.02, days: int = 30):
+    """Wstawia `count` syntetycznych zdarzeń bezpośrednio do bazy (szybciej niż przez API)."""
+    now = datetime.now()
+    span = days * 86400
+    sql = f"""INSERT INTO {config.TABLE_BARRIER_EVENTS}
+              (barrier_id, event_type, trigger_method, event_timestamp, user_id, success, details, failed_action, received_at,
+               event_ts_us, received_ts_us)
+              VALUES (?,?,?,?,?,?,?,?,?,?,?)"""
+    conn = sqlite3.connect(database)
+    batch = []
+    for i in range(count):
+        moment = now - timedelta(seconds=span * (count - i) / count)
+        ts = moment.isoformat()
+        ts_us = timestamps.to_epoch_us(moment)
+        success = random.random() >= failure_rate
+        batch.append((random.choice(barrier_ids), "barrier_opened" if i % 2 else "barrier_closed", random.choice(("api", "radio", "auto")),
+                      ts, str(random.randint(1, 50)), 1 if success else 0, None, None if success else "open", ts, ts_us, ts_us))
+        if len(batch) >= 50000:
+            conn.executemany(sql, batch)
+            batch.clear()
+    if batch:
+        conn.executemany(sql, batch)
+    conn.commit()
+    conn.execute("ANALYZE")
+    conn.close()
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    """Zwraca p50/p95/p99/max w milisekundach."""
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000
+    return {"n": len(ordered), "p50_ms": round(pick(0.50), 2), "p95_ms": round(pick(0.95), 2),
+            "p99_ms": round(pick(0.99), 2), "max_ms": round(ordered[-1] * 1000, 2),
+            "mean_ms": round(statistics.fmean(ordered) * 1000, 2)}
+
+class Environment:
+    """Tymczasowa baza + uruchomiona centrala + atrapa kontrolera."""
+
+    def __init__(self, barriers: int = 1, controller_delay: float = 0.0, overrides: Optional[Dict] = None):
+        self.tmpdir = tempfile.mkdtemp(prefix="eszp-bench-")
+        self.database = os.path.join(self.tmpdir, "bench.db")
+
+        self.controller_port = _free_port()
+        self.controller = _start_server(make_fake_controller(controller_delay), self.controller_port)
+        self.port = _free_port()
+        self.central = _start_central(self.database, self.port, overrides)
+        self.base_url = f"http://127.0.0.1:{self.port}"
+        self.barrier_ids = [f"bench_barrier_{i}" for i in range(barriers)]
+
+    async def provision(self, client: httpx.AsyncClient):
+        """Tworzy użytkownika testowego, szlabany i uprawnienia technika."""
+        r = await client.post("/api/users", json={"username": BENCH_USER[0], "password": BENCH_USER[1]}, headers=ADMIN_HEADERS)
+        r.raise_for_status()
+        for i, barrier_id in enumerate(self.barrier_ids):
+            url = f"http://127.0.0.1:{self.controller_port}/c{i}"
+            r = await client.post("/api/barriers", json={"barrier_id": barrier_id, "controller_url": url}, headers=ADMIN_HEADERS)
+            r.raise_for_status()
+            r = await client.post("/api/permissions", json={"username": BENCH_USER[0], "barrier_id": barrier_id, "permission_level": "technician"}, headers=ADMIN_HEADERS)
+            r.raise_for_status()
+
+    def close(self):
+        self.central.terminate()
+        try:
+            self.central.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.central.kill()
+        _stop_server(self.controller)
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+# --- Scenariusze ---
+
+async def scenario_open_under_load(args) -> Dict:
+    """p99 czasu /api/barriers/{id}/open przy równoległym obciążeniu /api/events?limit=1000."""
+    env = Environment(barriers=1, overrides={"RATE_LIMIT_ENABLED": False}) # Mierzymy opóźnienie, nie limity
+    try:
+        async with httpx.AsyncClient(base_url=env.base_url, timeout=60) as client:
+            await env.provision(client)
+            seed_events(env.database, args.events, env.barrier_ids)
+
+            stop = asyncio.Event()
+            load_requests = 0
+
+            async def load_worker():
+                nonlocal load_requests
+                async with httpx.AsyncClient(base_url=env.base_url, timeout=60) as load_client:
+                    while not stop.is_set():
+                        await load_client.get("/api/events", params={"limit": 1000}, headers=ADMIN_HEADERS)
+                        load_requests += 1
+
+            workers = [asyncio.create_task(load_worker()) for _ in range(args.load_clients)]
+            await asyncio.sleep(0.5) # Rozgrzewka obciążenia
+            latencies = []
+            started = time.perf_counter()
+            for _ in range(args.requests):
+                t0 = time.perf_counter()
+                r = await client.post(f"/api/barriers/{env.barrier_ids[0]}/open", auth=BENCH_USER)
+                latencies.append(time.perf_counter() - t0)
+                if r.status_code >= 500:
+                    log.warning(f"Open failed: {r.status_code} {r.text[:200]}")
+            elapsed = time.perf_counter() - started
+            stop.set()
+            await asyncio.gather(*workers)
+        return {"open_latency": percentiles(latencies), "load_requests_per_s": round(load_requests / elapsed, 1)}
+    finally:
+        env.close()
+
+async def scenario_filtered_events(args) -> Dict:
+    """Czasy zapytań z filtrami (np. awarie 50 szlabanów z 24h) na bazie z --events zdarzeniami z roku."""
+    tmpdir = tempfile.mkdtemp(prefix="eszp-bench-")
+    config.DATABASE_FILE = os.path.join(tmpdir, "bench.db")
+    config.ARCHIVE_DIR = os.path.join(tmpdir, "archive")
+    try:
+        db.init_db()
+        barrier_ids = [f"bench_barrier_{i}" for i in range(args.barriers)]
+        started = time.perf_counter()
+        seed_events(config.DATABASE_FILE, args.events, barrier_ids, days=365)
+        seed_seconds = round(time.perf_counter() - started, 1)
+
+        now = datetime.now()
+        day_ago = timestamps.to_epoch_us(now - timedelta(days=1))
+        hour_ago = timestamps.to_epoch_us(now - timedelta(hours=1))
+        sample = lambda n: random.sample(barrier_ids, min(n, len(barrier_ids)))
+        queries = {
+            "failures_50_barriers_24h": lambda: dict(barrier_ids=sample(50), only_failures=True, filters=db.EventFilters(since_us=day_ago)),
+            "events_50_barriers_24h": lambda: dict(barrier_ids=sample(50), filters=db.EventFilters(since_us=day_ago)),
+            "radio_opens_1_barrier": lambda: dict(barrier_ids=sample(1), filters=db.EventFilters(event_type="barrier_opened", trigger_method="radio")),
+            "one_user_all_barriers": lambda: dict(filters=db.EventFilters(user_id=str(random.randint(1, 50)))),
+            "all_barriers_last_hour": lambda: dict(filters=db.EventFilters(since_us=hour_ago)),
+        }
+        result: Dict = {"seed_seconds": seed_seconds}
+        for name, make_kwargs in queries.items():
+            latencies = []
+            rows = 0
+            for _ in range(args.requests):
+                kwargs = make_kwargs()
+                t0 = time.perf_counter()
+                events = db.get_events_from_db(limit=config.MAX_EVENT_LIMIT, **kwargs)
+                latencies.append(time.perf_counter() - t0)
+                rows += len(events)
+            source = db._build_events_query(kwargs.get("barrier_ids"), kwargs.get("only_failures", False), None, None, kwargs["filters"])[0]
+            result[name] = {**percentiles(latencies), "avg_rows": round(rows / args.requests, 1), "source": source}
+        return result
+    finally:
+        db.close_pool()
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+async def scenario_multi_barrier_feed(args) -> Dict:
+    """Strony /api/my/events i /api/my/failures dla list 10..--barriers szlabanów: plan IN, skan i wybór planera."""
+    tmpdir = tempfile.mkdtemp(prefix="eszp-bench-")
+    config.DATABASE_FILE = os.path.join(tmpdir, "bench.db")
+    config.ARCHIVE_DIR = os.path.join(tmpdir, "archive")
+    try:
+        db.init_db()
+        barrier_ids = [f"bench_barrier_{i}" for i in range(args.barriers)]
+        with db.get_db() as conn: # Planer liczy szlabany w tabeli
+            conn.executemany(f"INSERT INTO {config.TABLE_BARRIERS} (barrier_id, controller_url) VALUES (?, ?)",
+                             [(barrier_id, f"http://127.0.0.1/c{i}") for i, barrier_id in enumerate(barrier_ids)])
+            conn.commit()
+        started = time.perf_counter()
+        seed_events(config.DATABASE_FILE, args.events, barrier_ids)
+        result: Dict = {"seed_seconds": round(time.perf_counter() - started, 1)}
+
+        plan_setting = config.EVENT_FEED_PLAN
+        try:
+            for selected in sorted({n for n in (10, 30, 100, 300, args.barriers) if n <= args.barriers}):
+                for only_failures in (False, True):
+                    samples = [random.sample(barrier_ids, selected) for _ in range(args.requests)]
+                    entry: Dict = {}
+                    pages = {}
+                    for plan in ("index", "scan", "auto"):
+                        config.EVENT_FEED_PLAN = plan
+                        latencies = []
+                        for sample in samples:
+                            t0 = time.perf_counter()
+                            events = db.get_events_from_db(barrier_ids=sample, only_failures=only_failures)
+                            latencies.append(time.perf_counter() - t0)
+                        pages[plan] = [event["id"] for event in events]
+                        entry[plan] = percentiles(latencies)["p50_ms"]
+                    with db.get_db() as conn:
+                        entry["auto_plan"] = "scan" if db._use_feed_scan(conn, samples[-1], only_failures, None, None, None,
+                                                                         config.DEFAULT_EVENT_LIMIT) else "index"
+                    entry["same_page"] = pages["index"] == pages["scan"] == pages["auto"]
+                    result[f"{'failures' if only_failures else 'events'}_{selected}_barriers_p50_ms"] = entry
+        finally:
+            config.EVENT_FEED_PLAN = plan_setting
+        return result
+    finally:
+        db.close_pool()
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+async def scenario_auth_throughput(args) -> Dict:
+    """Uwierzytelnione żądania/s (Basic Auth, GET /api/my/barriers) bez cache poświadczeń i z nim."""
+    result: Dict = {}
+    for label, enabled in (("cache_off", False), ("cache_on", True)):
+        env = Environment(barriers=1, overrides={"CREDENTIAL_CACHE_ENABLED": enabled})
+        try:
+            async with httpx.AsyncClient(base_url=env.base_url, timeout=60) as client:
+                await env.provision(client)
+                latencies, shed = [], []
+                deadline = time.perf_counter() + args.duration
+
+                async def poller():
+                    async with httpx.AsyncClient(base_url=env.base_url, timeout=60, auth=BENCH_USER) as poll_client:
+                        while time.perf_counter() < deadline:
+                            t0 = time.perf_counter()
+                            r = await poll_client.get("/api/my/barriers")
+                            if r.status_code == 200:
+                                latencies.append(time.perf_counter() - t0)
+                            elif r.status_code == 503: # Przepełniona kolejka bcrypt - żądanie odrzucone
+                                shed.append(time.perf_counter() - t0)
+                            else:
+                                log.warning(f"Poll failed: {r.status_code} {r.text[:200]}")
+
+                started = time.perf_counter()
+                await asyncio.gather(*(poller() for _ in range(args.load_clients)))
+                elapsed = time.perf_counter() - started
+                metrics = (await client.get("/api/metrics", headers=ADMIN_HEADERS)).json()
+            cache_stats, hasher_stats = metrics["credential_cache"], metrics["password_hasher"]
+            result[label] = {"requests_per_s": round(len(latencies) / elapsed, 1), "latency": percentiles(latencies),
+                             "cache_hits": cache_stats["hits"], "cache_misses": cache_stats["misses"],
+                             "shed_503": len(shed), "bcrypt_p95_ms": hasher_stats["p95_latency_ms"]}
+        finally:
+            env.close()
+    return result
+
+async def scenario_command_authz(args) -> Dict:
+    """Czas danych autoryzacyjnych polecenia: 3 osobne zapytania (użytkownik, uprawnienie, URL) vs jeden JOIN."""
+    tmpdir = tempfile.mkdtemp(prefix="eszp-bench-")
+    config.DATABASE_FILE = os.path.join(tmpdir, "bench.db")
+    try:
+        db.init_db()
+        users = [f"bench_user_{i}" for i in range(args.users)]
+        barrier_ids = [f"bench_barrier_{i}" for i in range(args.barriers)]
+        conn = sqlite3.connect(config.DATABASE_FILE)
+        conn.executemany(f"INSERT INTO {config.TABLE_USERS} (username, hashed_password) VALUES (?, 'x')", ((u,) for u in users))
+        conn.executemany(f"INSERT INTO {config.TABLE_BARRIERS} (barrier_id, controller_url) VALUES (?, ?)",
+                         ((b, f"http://127.0.0.1/{b}") for b in barrier_ids))
+        conn.executemany(f"INSERT OR IGNORE INTO {config.TABLE_PERMISSIONS} (user_id, barrier_id, permission_level) VALUES (?, ?, 'operator')",
+                         ((random.randint(1, len(users)), random.choice(barrier_ids)) for _ in range(len(users) * 5)))
+        conn.commit()
+        conn.execute("ANALYZE")
+        conn.close()
+        db_async.start_executor()
+
+        async def separate(username: str, barrier_id: str):
+            user = await db_async.get_user_by_username(username)
+            await db_async.get_db_permission_level(user['id'], barrier_id)
+            await db_async.get_barrier_controller_url(barrier_id)
+
+        async def joined(username: str, barrier_id: str):
+            await db_async.get_command_authorization(username, [barrier_id])
+
+        result: Dict = {}
+        for name, lookup in (("before_3_queries", separate), ("after_1_join", joined)):
+            latencies = []
+
+            async def client_loop(count: int):
+                for _ in range(count):
+                    t0 = time.perf_counter()
+                    await lookup(random.choice(users), random.choice(barrier_ids))
+                    latencies.append(time.perf_counter() - t0)
+
+            started = time.perf_counter()
+            await asyncio.gather(*(client_loop(args.requests) for _ in range(args.load_clients)))
+            elapsed = time.perf_counter() - started
+            result[name] = {**percentiles(latencies), "lookups_per_s": round(len(latencies) / elapsed, 1)}
+        return result
+    finally:
+        db_async.shutdown_executor()
+        db.close_pool()
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+async def scenario_command_latency(args) -> Dict:
+    """Czas polecenia do atrapy kontrolera: nowy klient HTTP na polecenie vs wspólny klient keep-alive, oraz /open end-to-end."""
+    import controller_client
+    result: Dict = {}
+    controller_port = _free_port()
+    controller = _start_server(make_fake_controller(), controller_port)
+    urls = [f"http://127.0.0.1:{controller_port}/c{i % 8}/open" for i in range(args.requests)]
+    try:
+        async def per_request(url: str):
+            async with httpx.AsyncClient(timeout=config.BARRIER_COMMAND_TIMEOUT) as fresh:
+                await fresh.post(url)
+
+        shared = controller_client.ControllerClient(config.BARRIER_COMMAND_TIMEOUT, config.CONTROLLER_MAX_CONNECTIONS,
+                                                    args.load_clients, config.CONTROLLER_KEEPALIVE_EXPIRY)
+        shared.start()
+        for name, send in (("new_client_per_command", per_request), ("shared_keepalive_client", shared.post)):
+            for concurrency in (1, args.load_clients):
+                latencies = []
+
+                async def sender(chunk: List[str]):
+                    for url in chunk:
+                        t0 = time.perf_counter()
+                        await send(url)
+                        latencies.append(time.perf_counter() - t0)
+
+                started = time.perf_counter()
+                await asyncio.gather(*(sender(urls[i::concurrency]) for i in range(concurrency)))
+                elapsed = time.perf_counter() - started
+                result[f"{name}_x{concurrency}"] = {**percentiles(latencies), "commands_per_s": round(len(latencies) / elapsed, 1)}
+        result["shared_client_peak_in_flight"] = shared.stats()["peak_in_flight"]
+        await shared.close()
+    finally:
+        _stop_server(controller)
+
+    # End-to-end przez centralę (token zamiast Basic Auth, bez limitów) - wspólny klient w lifespan
+    env = Environment(barriers=1, overrides={"RATE_LIMIT_ENABLED": False})
+    try:
+        async with httpx.AsyncClient(base_url=env.base_url, timeout=60) as client:
+            await env.provision(client)
+            token = (await client.post("/api/auth/token", auth=BENCH_USER)).json()["access_token"]
+            headers = {"Authorization": f"Bearer {token}"}
+            latencies = []
+            for _ in range(args.requests):
+                t0 = time.perf_counter()
+                r = await client.post(f"/api/barriers/{env.barrier_ids[0]}/open", headers=headers)
+                latencies.append(time.perf_counter() - t0)
+                if r.status_code >= 500:
+                    log.warning(f"Open failed: {r.status_code} {r.text[:200]}")
+            stats = (await client.get("/api/metrics", headers=ADMIN_HEADERS)).json()["controller_client"]
+        result["end_to_end_open"] = percentiles(latencies)
+        result["central_controller_client"] = {key: stats[key] for key in ("requests", "errors", "avg_latency_ms", "peak_in_flight")}
+    finally:
+        env.close()
+    return result
+
+async def scenario_write_lock_stall(args) -> Dict:
+    """p99 odczytu /api/events, gdy inny proces co chwilę trzyma blokadę zapisu SQLite (executor DB vs zapytania w pętli)."""
+    result: Dict = {}
+    for label, workers in (("inline", 0), ("executor", config.DB_EXECUTOR_WORKERS)):
+        env = Environment(barriers=1, overrides={"RATE_LIMIT_ENABLED": False, "DB_EXECUTOR_WORKERS": workers})
+        try:
+            async with httpx.AsyncClient(base_url=env.base_url, timeout=60) as client:
+                await env.provision(client)
+                stop = threading.Event()
+
+                def lock_holder():
+                    # Jak skrypt konserwacyjny lub drugi proces: BEGIN IMMEDIATE na args.lock_hold s, potem przerwa
+                    conn = sqlite3.connect(env.database, isolation_level=None)
+                    while not stop.is_set():
+                        conn.execute("BEGIN IMMEDIATE")
+                        stop.wait(args.lock_hold)
+                        conn.execute("COMMIT")
+                        stop.wait(args.lock_hold)
+                    conn.close()
+
+                holder = threading.Thread(target=lock_holder, daemon=True)
+                holder.start()
+                event = {"barrier_id": env.barrier_ids[0], "event_type": "barrier_opened", "trigger_method": "radio",
+                         "timestamp": datetime.now().isoformat(), "success": True}
+                accepted = 0
+                load_stop = asyncio.Event()
+
+                async def load_worker():
+                    nonlocal accepted
+                    async with httpx.AsyncClient(base_url=env.base_url, timeout=60) as load_client:
+                        while not load_stop.is_set():
+                            r = await load_client.post("/barrier/event", json=event)
+                            accepted += r.status_code < 300
+                            await asyncio.sleep(0.01)
+
+                workers_tasks = [asyncio.create_task(load_worker()) for _ in range(args.load_clients)]
+                await asyncio.sleep(0.5)
+                latencies = []
+                started = time.perf_counter()
+                for _ in range(args.requests):
+                    t0 = time.perf_counter()
+                    await client.get("/api/events", params={"limit": 50}, headers=ADMIN_HEADERS)
+                    latencies.append(time.perf_counter() - t0)
+                    await asyncio.sleep(0.01)
+                elapsed = time.perf_counter() - started
+                load_stop.set()
+                await asyncio.gather(*workers_tasks)
+                stop.set()
+                holder.join()
+            result[f"{label}_read_latency"] = percentiles(latencies)
+            result[f"{label}_events_accepted_per_s"] = round(accepted / elapsed, 1)
+        finally:
+            env.close()
+    return result
+
+SCENARIOS: Dict[str, Callable] = {
+    "open-under-load": scenario_open_under_load,
+    "filtered-events": scenario_filtered_events,
+    "multi-barrier-feed": scenario_multi_barrier_feed,
+    "auth-throughput": scenario_auth_throughput,
+    "command-authz": scenario_command_authz,
+    "command-latency": scenario_command_latency,
+    "write-lock-stall": scenario_write_lock_stall,
+}
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarki Centrali ESZP")
+    parser.add_argument("scenario", nargs="?", choices=sorted(SCENARIOS))
+    parser.add_argument("--list", action="store_true", help="Wypisz dostępne scenariusze")
+    parser.add_argument("--events", type=int, default=200000, help="Liczba zdarzeń w bazie testowej")
+    parser.add_argument("--load-clients", type=int, default=16, help="Liczba równoległych klientów obciążających")
+    parser.add_argument("--requests", type=int, default=200, help="Liczba mierzonych żądań")
+    parser.add_argument("--barriers", type=int, default=500, help="Liczba szlabanów w bazie testowej (filtered-events, multi-barrier-feed, command-authz)")
+    parser.add_argument("--users", type=int, default=10000, help="Liczba użytkowników w bazie testowej (command-authz)")
+    parser.add_argument("--lock-hold", type=float, default=1.0, help="Sekundy trzymania blokady zapisu przez obcy proces (write-lock-stall)")
+    parser.add_argument("--duration", type=float, default=10.0, help="Czas pomiaru w sekundach (auth-throughput)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s [%(levelname)s] %(name)s: %(message)s')
+    if args.list or not args.scenario:
+        for name, func in sorted(SCENARIOS.items()):
+            print(f"{name:24s} {func.__doc__}")
+        return
+    result = asyncio.run(SCENARIOS[args.scenario](args))
+    print(f"[{args.scenario}]")
+    for key, value in result.items():
+        print(f"  {key}: {value}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+# broker.py
+# -*- coding: utf-8 -*-
+
+import asyncio
+import json
+import logging
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import config
+import ingest
+
+log = logging.getLogger(__name__)
+
+# Zdarzenie w kolejce subskrybenta: (id, barrier_id, JSON) - serializowane raz dla wszystkich odbiorców
+BrokerEvent = Tuple[int, str, str]
+
+
+class BrokerFull(Exception):
+    """Osiągnięto limit subskrybentów - nowy strumień należy odrzucić (503)."""
+
+
+class Subscription:
+    """Jeden odbiorca strumienia zdarzeń (połączenie SSE) z filtrem szlabanów i ograniczoną kolejką."""
+
+    __slots__ = ("barrier_ids", "queue", "overflowed", "active")
+
+    def __init__(self, barrier_ids: Optional[Set[str]], queue_size: int):
+        self.barrier_ids = barrier_ids # None - wszystkie szlabany (admin)
+        self.queue: "asyncio.Queue[Optional[BrokerEvent]]" = asyncio.Queue(maxsize=queue_size)
+        self.overflowed = False
+        self.active = True # False po unsubscribe
+
+    async def get(self, timeout: float) -> Optional[BrokerEvent]:
+        """Następne zdarzenie; None - koniec strumienia (przepełnienie albo zamknięcie brokera).
+
+        asyncio.TimeoutError, gdy przez `timeout` sekund nic nie przyszło (czas na keep-alive).
+        """
+        return await asyncio.wait_for(self.queue.get(), timeout=timeout)
+
+
+class EventBroker:
+    """Rozsyłanie zapisanych zdarzeń do strumieni SSE w obrębie procesu (pub/sub).
+
+    Zasilany callbackiem writera zdarzeń (po commicie), więc odbiorca dostaje tylko zdarzenia
+    trwale zapisane, z ich ID. Odbiorcy są indeksowani po ID szlabanu - publikacja kosztuje
+    tyle, ilu jest zainteresowanych. Kolejka odbiorcy jest ograniczona: kto nie nadąża,
+    zostaje odłączony (znacznik końca zamiast zdarzeń) i wznawia od Last-Event-ID z bazy,
+    więc niczego nie traci, a wolny klient nie zajmuje pamięci serwera.
+    """
+
+    def __init__(self, queue_size: int, max_subscribers: int):
+        self.queue_size = max(1, int(queue_size))
+        self.max_subscribers = max(1, int(max_subscribers))
+        self._by_barrier: Dict[str, Set[Subscription]] = {}
+        self._unfiltered: Set[Subscription] = set()
+        self._count = 0
+
+        # Statystyki
+        self.published = 0
+        self.delivered = 0
+        self.overflows = 0
+        self.rejected = 0
+
+    def check_capacity(self):
+        """BrokerFull, gdy nie ma miejsca na nowego odbiorcę (przed odpowiedzią - żeby zwrócić 503)."""
+        if self._count >= self.max_subscribers:
+            self.rejected += 1
+            raise BrokerFull()
+
+    def subscribe(self, barrier_ids: Optional[Iterable[str]]) -> Subscription:
+        """Nowy odbiorca zdarzeń wskazanych szlabanów (None - wszystkich). BrokerFull po przekroczeniu limitu."""
+        self.check_capacity()
+        subscription = Subscription(set(barrier_ids) if barrier_ids is not None else None, self.queue_size)
+        if subscription.barrier_ids is None:
+            self._unfiltered.add(subscription)
+        else:
+            for barrier_id in subscription.barrier_ids:
+                self._by_barrier.setdefault(barrier_id, set()).add(subscription)
+        self._count += 1
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        """Usuwa odbiorcę (idempotentne)."""
+        if not subscription.active:
+            return
+        subscription.active = False
+        if subscription.barrier_ids is None:
+            self._unfiltered.discard(subscription)
+        else:
+            for barrier_id in subscription.barrier_ids:
+                subscribers = self._by_barrier.get(barrier_id)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._by_barrier[barrier_id]
+        self._count -= 1
+
+    def _end(self, subscription: Subscription):
+        """Opróżnia kolejkę i wstawia znacznik końca (konsument zamknie strumień)."""
+        while not subscription.queue.empty():
+            subscription.queue.get_nowait()
+        subscription.queue.put_nowait(None)
+
+    def publish(self, rows: List[ingest.CommittedEvent]):
+        """Callback writera zdarzeń: rozsyła zapisane zdarzenia do zainteresowanych odbiorców."""
+        for event, received_at, event_id in rows:
+            self.published += 1
+            subscribers = self._by_barrier.get(event.barrier_id)
+            if not subscribers and not self._unfiltered:
+                continue
+            # Kształt jak w odpowiedziach /api/events (db.EVENT_COLUMNS)
+            data = json.dumps({"id": event_id, **event.model_dump(), "received_at": received_at}, ensure_ascii=False)
+            item = (event_id, event.barrier_id, data)
+            for subscription in (*(subscribers or ()), *self._unfiltered):
+                if subscription.overflowed:
+                    continue
+                try:
+                    subscription.queue.put_nowait(item)
+                    self.delivered += 1
+                except asyncio.QueueFull:
+                    subscription.overflowed = True
+                    self.overflows += 1
+                    self._end(subscription)
+                    log.warning(f"Broker: Subscriber too slow ({self.queue_size} events queued) - disconnecting.")
+
+    def close(self):
+        """Kończy wszystkie strumienie (zamykanie serwera)."""
+        for subscription in {*self._unfiltered, *(s for subs in self._by_barrier.values() for s in subs)}:
+            self._end(subscription)
+
+    def stats(self) -> Dict:
+        """Zwraca statystyki brokera do monitoringu."""
+        return {
+            "subscribers": self._count,
+            "max_subscribers": self.max_subscribers,
+            "watched_barriers": len(self._by_barrier),
+            "unfiltered_subscribers": len(self._unfiltered),
+            "published": self.published,
+            "delivered": self.delivered,
+            "overflows": self.overflows,
+            "rejected": self.rejected,
+        }
+
+
+# Globalny broker procesu (zasilany przez writer zdarzeń)
+event_broker = EventBroker(config.SSE_QUEUE_SIZE, config.SSE_MAX_SUBSCRIBERS)
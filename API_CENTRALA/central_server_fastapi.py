@@ -1,19 +1,38 @@
 #!/usr/bin/python3
 # -*- coding: utf-8 -*-
 
+import asyncio
+import contextlib
 import logging
 import sqlite3 # Wciąż potrzebne dla type hint w zależnościach
 from datetime import datetime
 from typing import List, Optional
 from contextlib import asynccontextmanager
 
-from fastapi import FastAPI, HTTPException, status, Depends
+from fastapi import FastAPI, HTTPException, Request, status, Depends, Header, Query, Security
+from fastapi.responses import JSONResponse
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBasicCredentials
 
 # Importuj z nowych plików
 import config
 import models # Importuje wszystkie modele
 import db     # Importuje wszystkie funkcje DB
+import db_async # Asynchroniczne odpowiedniki funkcji DB (dedykowany executor)
 import core   # Importuje funkcje core/security/dependencies
+import ingest # Group-commit writer zdarzeń
+import authz_cache # Cache uprawnień i URL-i kontrolerów
+import retention # Archiwizacja starych zdarzeń (tło)
+import credential_cache # Cache zweryfikowanych danych Basic Auth
+import tokens # Tokeny dostępu (bearer)
+import passwords # Pula procesów bcrypt
+import ratelimit # Limity poleceń dla szlabanów
+import controller_client # Wspólny klient HTTP do kontrolerów
+import health # Monitor dostępności kontrolerów
+import command_gate # Kolejka poleceń per szlaban
+import commands # Polecenia asynchroniczne
+import broker # Strumienie zdarzeń (SSE)
+import barrier_state # Stan szlabanów w pamięci
+import recent_events # Ostatnie zdarzenia szlabanów w pamięci
 
 # --- Konfiguracja Logowania ---
 logging.basicConfig(level=config.LOG_LEVEL, format='%(asctime)s [%(levelname)s] %(name)s: %(message)s')
@@ -25,9 +44,51 @@ logging.getLogger('uvicorn.access').setLevel(logging.WARNING)
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     log.info("Server startup...")
-    db.init_db() # Uruchom inicjalizację bazy przy starcie
+    db_async.start_executor()
+    passwords.hasher.start() # Procesy dla bcrypt (logowanie, tworzenie użytkowników, import)
+    controller_client.client.start() # Połączenia keep-alive do kontrolerów szlabanów
+    await db_async.init_db() # Uruchom inicjalizację bazy przy starcie
+    await db_async.run(authz_cache.cache.load) # Uprawnienia i URL-e kontrolerów do pamięci
+    authz_cache.cache.add_invalidation_callback(credential_cache.cache.clear) # Zmiana użytkowników w innym procesie
+    ingest.event_writer.add_commit_callback(barrier_state.cache.apply_events) # Zdarzenia aktualizują stan szlabanów
+    ingest.event_writer.add_commit_callback(commands.dispatcher.on_events) # ...i kończą polecenia asynchroniczne
+    ingest.event_writer.add_commit_callback(broker.event_broker.publish) # ...i trafiają do strumieni SSE
+    if config.RECENT_EVENTS_ENABLED: # Ostatnie zdarzenia szlabanów w pamięci (przed startem writera)
+        await db_async.run(recent_events.cache.load)
+        ingest.event_writer.add_commit_callback(recent_events.cache.on_events)
+    token_key = await db_async.get_server_secret("token_signing_key")
+    if token_key:
+        tokens.manager.set_key(token_key)
+    else:
+        log.error("Token signing key not available - /api/auth/token and bearer auth are disabled.")
+    await db_async.run(tokens.manager.load) # Generacje tokenów i odwołania z bazy
+    authz_watcher = asyncio.create_task(authz_cache.cache.watch(config.AUTHZ_CACHE_CHECK_INTERVAL))
+    tokens_watcher = asyncio.create_task(tokens.manager.watch(config.AUTHZ_CACHE_CHECK_INTERVAL)) # Odwołania w innym procesie
+    await ingest.event_writer.start()
+    commands.dispatcher.start()
+    background_tasks = [authz_watcher, tokens_watcher]
+    if config.RECENT_EVENTS_ENABLED: # Zdarzenia zapisane przez inne procesy
+        background_tasks.append(asyncio.create_task(recent_events.cache.watch(config.RECENT_EVENTS_SYNC_INTERVAL)))
+    if config.CONTROLLER_HEALTH_ENABLED: # Sondy /status kontrolerów
+        background_tasks.append(asyncio.create_task(health.monitor.run_forever()))
+    if config.RETENTION_ENABLED: # Przenoszenie starych zdarzeń do archiwum
+        background_tasks.append(asyncio.create_task(retention.manager.run_forever(config.RETENTION_INTERVAL, config.RETENTION_STARTUP_DELAY)))
     yield
     log.info("Server shutdown...")
+    for task in background_tasks:
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+    broker.event_broker.close() # Zakończ otwarte strumienie SSE
+    await commands.dispatcher.stop()
+    await ingest.event_writer.stop() # Zapisz oczekujące zdarzenia przed zamknięciem puli
+    await controller_client.client.close()
+    db_async.shutdown_executor()
+    passwords.hasher.shutdown()
+    authz_cache.cache.close()
+    tokens.manager.close()
+    recent_events.cache.close()
+    db.close_pool() # Zamknij długo żyjące połączenia SQLite
 
 # --- Aplikacja FastAPI ---
 app = FastAPI(
@@ -40,39 +101,90 @@ app = FastAPI(
 # --- Endpointy API ---
 
 # == Grupa: Events ==
-@app.post("/barrier/event", status_code=status.HTTP_200_OK, tags=["Events"])
+@app.post("/barrier/event", status_code=status.HTTP_200_OK, tags=["Events"],
+          responses={
+              status.HTTP_200_OK: {"description": "Zdarzenie zapisane (INGEST_WRITE_BEHIND=False): status, received_at, event_id."},
+              status.HTTP_202_ACCEPTED: {"description": "Zdarzenie przyjęte do zapisu w tle (INGEST_WRITE_BEHIND=True): status, received_at."},
+              status.HTTP_503_SERVICE_UNAVAILABLE: {"description": "Kolejka zapisu przepełniona - ponów po czasie z nagłówka Retry-After."},
+          })
 async def receive_barrier_event_endpoint(event_data: models.BarrierEventDBInput):
-    """Odbiera zdarzenie od kontrolera szlabanu i zapisuje do bazy."""
+    """Odbiera zdarzenie od kontrolera szlabanu i zapisuje do bazy.
+
+    Przy INGEST_WRITE_BEHIND odpowiada 202 od razu po przyjęciu do kolejki (zapis w tle);
+    przy przepełnionej kolejce 503 z Retry-After.
+    """
     received_time = datetime.now().isoformat()
-    if db.add_event_to_db(event_data, received_time):
-        return {"status": "received_ok", "received_at": received_time}
+    try:
+        if config.INGEST_WRITE_BEHIND and ingest.event_writer.enqueue([event_data], received_time):
+            return JSONResponse(status_code=status.HTTP_202_ACCEPTED, content={"status": "queued", "received_at": received_time})
+        event_ids = await ingest.event_writer.submit([event_data], received_time)
+    except ingest.IngestQueueFull as e:
+        raise core.ingest_overloaded(e)
+    if event_ids:
+        return {"status": "received_ok", "received_at": received_time, "event_id": event_ids[0]}
     else:
-        # Logowanie błędu odbywa się w db.add_event_to_db
+        # Logowanie błędu odbywa się w db.add_events_to_db
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed to save event data.")
+
+@app.post("/barrier/events", status_code=status.HTTP_200_OK, tags=["Events"])
+async def receive_barrier_events_bulk_endpoint(events_data: List[models.BarrierEventDBInput]):
+    """Odbiera paczkę zdarzeń od kontrolera; odpowiedź potwierdza trwały zapis każdego z nich."""
+    if not events_data:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Event list is empty.")
+    if len(events_data) > config.INGEST_MAX_BULK_EVENTS:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=f"Too many events in one request (max {config.INGEST_MAX_BULK_EVENTS}).")
+
+    received_time = datetime.now().isoformat()
+    try:
+        event_ids = await ingest.event_writer.submit(events_data, received_time) # Paczki zawsze z potwierdzeniem zapisu
+    except ingest.IngestQueueFull as e:
+        raise core.ingest_overloaded(e)
+    if event_ids is None:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed to save event data.")
+    return {
+        "status": "received_ok",
+        "received_at": received_time,
+        "count": len(event_ids),
+        "results": [{"index": i, "event_id": event_id, "status": "received_ok"} for i, event_id in enumerate(event_ids)],
+    }
 
 # == Grupa: Admin ==
+@app.get("/api/events/stream", tags=["Admin"], dependencies=[Depends(core.verify_admin_token)])
+async def stream_all_events_endpoint(barrier_id: Optional[List[str]] = Query(None),
+                                     last_event_id: Optional[str] = Query(None),
+                                     last_event_id_header: Optional[str] = Header(None, alias="Last-Event-ID")):
+    """(Admin) Strumień SSE nowych zdarzeń ze wszystkich (albo wskazanych `barrier_id`) szlabanów.
+
+    Po zerwaniu połączenia wznowienie od `Last-Event-ID` (nagłówek EventSource albo parametr) - zaległe zdarzenia z bazy.
+    """
+    return await core.events_stream_response(barrier_id or None, last_event_id_header or last_event_id)
+
 @app.get("/api/events", response_model=List[models.BarrierEventDBResponse], tags=["Admin"], dependencies=[Depends(core.verify_admin_token)])
-async def get_all_events_endpoint(limit: int = config.DEFAULT_EVENT_LIMIT):
-    """(Admin) Pobiera ostatnie zdarzenia ze WSZYSTKICH szlabanów."""
-    events = db.get_events_from_db(barrier_ids=None, limit=limit, only_failures=False)
-    if events is None: # get_events_from_db zwraca None w przypadku błędu DB
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed to retrieve events from database.")
-    # FastAPI automatycznie zwaliduje i przekonwertuje listę dict na listę BarrierEventDBResponse
-    return events
+async def get_all_events_endpoint(limit: Optional[int] = None, before_id: Optional[int] = None, after_id: Optional[int] = None,
+                                  cursor: Optional[str] = None, output_format: str = Query("json", alias="format"),
+                                  filters: Optional[db.EventFilters] = Depends(core.event_filters)):
+    """(Admin) Pobiera ostatnie zdarzenia ze WSZYSTKICH szlabanów.
+
+    Paginacja: `before_id`/`after_id` lub `cursor` z nagłówka X-Next-Cursor poprzedniej strony.
+    `format=ndjson` strumieniuje wszystkie pasujące zdarzenia (bez limitu, jeśli go nie podano).
+    Filtry: `since`/`until` (czas zdarzenia, ISO 8601), `event_type`, `trigger_method`, `user_id`.
+    """
+    return await core.events_response(None, limit=limit, before_id=before_id, after_id=after_id,
+                                      cursor=cursor, output_format=output_format, filters=filters)
 
 @app.post("/api/users", response_model=models.UserResponse, status_code=status.HTTP_201_CREATED, tags=["Admin"], dependencies=[Depends(core.verify_admin_token)])
 async def create_user_endpoint(user_data: models.UserCreate):
     """(Admin) Tworzy nowego użytkownika."""
     # Sprawdź, czy użytkownik już istnieje
-    existing_user = db.get_user_by_username(user_data.username)
+    existing_user = await db_async.get_user_by_username(user_data.username)
     if existing_user:
         raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Username '{user_data.username}' already exists.")
 
     # Stwórz hash hasła
-    hashed_password = core.get_password_hash(user_data.password)
+    hashed_password = await core.get_password_hash_async(user_data.password)
 
     # Dodaj użytkownika do bazy
-    user_id = db.create_db_user(user_data.username, hashed_password)
+    user_id = await db_async.create_db_user(user_data.username, hashed_password)
     if user_id:
         log.info(f"Admin created user '{user_data.username}' (ID: {user_id}).")
         return models.UserResponse(id=user_id, username=user_data.username)
@@ -88,18 +200,15 @@ async def add_barrier_endpoint(barrier_data: models.BarrierCreate):
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid controller_url format (must start with http:// or https://).")
 
     # Dodaj szlaban do bazy
-    db_id = db.create_db_barrier(barrier_data.barrier_id, barrier_data.controller_url)
+    db_id = await db_async.create_db_barrier(barrier_data.barrier_id, barrier_data.controller_url)
     if db_id:
+        authz_cache.cache.set_barrier(barrier_data.barrier_id, barrier_data.controller_url)
         log.info(f"Admin added barrier '{barrier_data.barrier_id}'.")
         return models.BarrierResponse(id=db_id, **barrier_data.model_dump())
     else:
         # create_db_barrier zwrócił None, co oznacza, że ID lub URL już istnieje (lub inny błąd DB)
         # Sprawdźmy co było przyczyną dla lepszego komunikatu błędu (choć to race condition)
-        conn_check = db.get_db()
-        cursor_check = conn_check.cursor()
-        cursor_check.execute(f"SELECT 1 FROM {config.TABLE_BARRIERS} WHERE barrier_id=? OR controller_url=?", (barrier_data.barrier_id, barrier_data.controller_url))
-        exists = cursor_check.fetchone()
-        conn_check.close()
+        exists = await db_async.barrier_exists(barrier_data.barrier_id, barrier_data.controller_url)
         if exists:
              raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Barrier ID or Controller URL already exists.")
         else: # Jeśli nie istnieje, a był błąd, to coś innego poszło nie tak
@@ -109,14 +218,15 @@ async def add_barrier_endpoint(barrier_data: models.BarrierCreate):
 async def grant_permission_endpoint(permission_data: models.PermissionCreate):
     """(Admin) Nadaje użytkownikowi uprawnienia do szlabanu."""
     # Znajdź użytkownika
-    user = db.get_user_by_username(permission_data.username)
+    user = await db_async.get_user_by_username(permission_data.username)
     if not user:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"User '{permission_data.username}' not found.")
 
     # Nadaj uprawnienie
-    permission_id, status_msg = db.grant_db_permission(user['id'], permission_data.barrier_id, permission_data.permission_level)
+    permission_id, status_msg = await db_async.grant_db_permission(user['id'], permission_data.barrier_id, permission_data.permission_level)
 
     if status_msg == "ok" and permission_id is not None:
+        authz_cache.cache.set_permission(user['id'], permission_data.barrier_id, permission_data.permission_level)
         log.info(f"Admin granted '{permission_data.permission_level}' permission to user '{permission_data.username}' for barrier '{permission_data.barrier_id}'.")
         return models.PermissionResponse(
             id=permission_id,
@@ -138,80 +248,315 @@ async def grant_permission_endpoint(permission_data: models.PermissionCreate):
         log.warning(f"Failed to grant permission: {detail_msg} (User: {permission_data.username}, Barrier: {permission_data.barrier_id}, Status: {status_msg})")
         raise HTTPException(status_code=status_code, detail=detail_msg)
 
+@app.post("/api/users/bulk", response_model=models.BulkResponse, tags=["Admin"], dependencies=[Depends(core.verify_admin_token)])
+async def create_users_bulk_endpoint(users_data: List[models.UserBulkCreate]):
+    """(Admin) Tworzy wielu użytkowników jedną transakcją.
+
+    Każdy element ma `password` (hashowane równolegle w puli procesów) albo gotowy `password_hash` (bcrypt).
+    Wynik per element: created / conflict (nazwa zajęta, także przez wcześniejszy element paczki).
+    """
+    core.check_bulk_size(users_data)
+    existing = await db_async.get_existing_usernames([user.username for user in users_data])
+    if existing is None:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Database error creating users.")
+
+    # Hashujemy tylko hasła użytkowników, którzy faktycznie powstaną (bcrypt to główny koszt importu)
+    candidates = []
+    taken = set(existing)
+    for index, user in enumerate(users_data):
+        if user.username not in taken:
+            taken.add(user.username)
+            candidates.append(index)
+    to_hash = [index for index in candidates if users_data[index].password is not None]
+    hashes = dict(zip(to_hash, await core.hash_passwords_bulk([users_data[index].password for index in to_hash])))
+
+    created = await db_async.create_db_users_bulk(
+        [(users_data[index].username, hashes.get(index, users_data[index].password_hash)) for index in candidates])
+    if created is None:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Database error creating users.")
+    results = {index: ("conflict", None) for index in range(len(users_data))}
+    results.update(zip(candidates, created))
+    log.info(f"Admin bulk-created users: {sum(1 for result in created if result[0] == 'created')} of {len(users_data)}.")
+    return core.bulk_response(results, len(users_data))
+
+@app.post("/api/barriers/bulk", response_model=models.BulkResponse, tags=["Admin"], dependencies=[Depends(core.verify_admin_token)])
+async def add_barriers_bulk_endpoint(barriers_data: List[models.BarrierCreate]):
+    """(Admin) Rejestruje wiele szlabanów jedną transakcją. Wynik per element: created / conflict / invalid (zły URL)."""
+    core.check_bulk_size(barriers_data)
+    invalid = {index: "Invalid controller_url format (must start with http:// or https://)."
+               for index, barrier in enumerate(barriers_data) if not barrier.controller_url.startswith(("http://", "https://"))}
+    valid = [index for index in range(len(barriers_data)) if index not in invalid]
+
+    created = await db_async.create_db_barriers_bulk([(barriers_data[index].barrier_id, barriers_data[index].controller_url) for index in valid])
+    if created is None:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Database error adding barriers.")
+    results = dict(zip(valid, created))
+    for index, (result_status, _) in results.items():
+        if result_status == "created":
+            authz_cache.cache.set_barrier(barriers_data[index].barrier_id, barriers_data[index].controller_url)
+    log.info(f"Admin bulk-added barriers: {sum(1 for result in created if result[0] == 'created')} of {len(barriers_data)}.")
+    return core.bulk_response(results, len(barriers_data), invalid)
+
+@app.post("/api/permissions/bulk", response_model=models.BulkResponse, tags=["Admin"], dependencies=[Depends(core.verify_admin_token)])
+async def grant_permissions_bulk_endpoint(permissions_data: List[models.PermissionCreate]):
+    """(Admin) Nadaje wiele uprawnień jedną transakcją. Wynik per element: created / conflict / not_found (użytkownik lub szlaban)."""
+    core.check_bulk_size(permissions_data)
+    outcome = await db_async.grant_db_permissions_bulk(
+        [(permission.username, permission.barrier_id, permission.permission_level) for permission in permissions_data])
+    if outcome is None:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Database error granting permissions.")
+    granted, user_ids = outcome
+    for permission, (result_status, _) in zip(permissions_data, granted):
+        if result_status == "created":
+            authz_cache.cache.set_permission(user_ids[permission.username], permission.barrier_id, permission.permission_level)
+    log.info(f"Admin bulk-granted permissions: {sum(1 for result in granted if result[0] == 'created')} of {len(permissions_data)}.")
+    return core.bulk_response(dict(enumerate(granted)), len(permissions_data))
+
+@app.get("/api/metrics", tags=["Admin"], dependencies=[Depends(core.verify_admin_token)])
+async def get_metrics_endpoint():
+    """(Admin) Zwraca metryki wewnętrznych podsystemów serwera (np. puli połączeń DB)."""
+    return {"db_pool": db.get_pool_stats(), "db_executor": db_async.get_stats(), "ingest": ingest.event_writer.stats(),
+            "authz_cache": authz_cache.cache.stats(), "retention": retention.manager.stats(),
+            "credential_cache": credential_cache.cache.stats(), "tokens": tokens.manager.stats(),
+            "password_hasher": passwords.hasher.stats(), "rate_limit": ratelimit.command_limiter.stats(),
+            "controller_client": controller_client.client.stats(), "controller_health": health.monitor.stats(),
+            "barrier_state": barrier_state.cache.stats(), "command_gate": command_gate.gate.stats(),
+            "commands": commands.dispatcher.stats(), "event_broker": broker.event_broker.stats(),
+            "recent_events": recent_events.cache.stats()}
+
+@app.get("/api/controllers/health", tags=["Admin"], dependencies=[Depends(core.verify_admin_token)])
+async def get_controllers_health_endpoint(only_unhealthy: bool = False):
+    """(Admin) Stan kontrolerów szlabanów: dostępność, stan bezpiecznika, czas i wynik ostatniej sondy /status."""
+    controllers = health.monitor.snapshot()
+    if only_unhealthy:
+        controllers = [c for c in controllers if c["reachable"] is False or c["circuit"] != health.CircuitBreaker.CLOSED]
+    return {"summary": health.monitor.stats(), "controllers": controllers}
+
+@app.get("/api/stats", response_model=models.EventStatsResponse, tags=["Admin"], dependencies=[Depends(core.verify_admin_token)])
+async def get_stats_endpoint(barrier_id: Optional[List[str]] = Query(None), since: Optional[str] = None, until: Optional[str] = None,
+                             granularity: str = "hour", event_type: Optional[str] = None, trigger_method: Optional[str] = None):
+    """(Admin) Liczby zdarzeń i awarii w kubełkach czasu (hour/day/month/total), z agregatów godzinowych.
+
+    Opcjonalnie zawężone do podanych szlabanów (`barrier_id` można powtórzyć), typu zdarzenia i sposobu wyzwolenia.
+    Zakres `since` (włącznie) - `until` (wyłącznie) w ISO 8601, z dokładnością do pełnych godzin.
+    """
+    return await core.stats_response(barrier_id, since=since, until=until, granularity=granularity,
+                                     event_type=event_type, trigger_method=trigger_method)
+
+@app.post("/api/users/{username}/revoke-tokens", tags=["Admin"], dependencies=[Depends(core.verify_admin_token)])
+async def revoke_user_tokens_endpoint(username: str):
+    """(Admin) Unieważnia wszystkie wydane dotąd tokeny użytkownika (we wszystkich procesach serwera)."""
+    user = await db_async.get_user_by_username(username)
+    if not user:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"User '{username}' not found.")
+    if not await db_async.run(tokens.manager.revoke_user, user['id']):
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Database error revoking tokens.")
+    log.info(f"Admin revoked all tokens of user '{username}'.")
+    return {"status": "revoked", "username": username}
+
+# == Grupa: Auth ==
+
+@app.post("/api/auth/token", response_model=models.TokenResponse, tags=["Auth"])
+async def issue_token_endpoint(current_user: sqlite3.Row = Depends(core.get_basic_user)):
+    """(User) Wydaje podpisany token dostępu po jednorazowej weryfikacji hasła (Basic Auth).
+
+    Kolejne żądania mogą używać nagłówka `Authorization: Bearer <token>` zamiast Basic Auth.
+    """
+    if not tokens.manager.ready:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Token issuing is not available.")
+    token, expires_at = tokens.manager.issue(current_user['id'], current_user['username'], current_user['token_generation'])
+    log.info(f"Issued access token for user '{current_user['username']}'.")
+    return models.TokenResponse(access_token=token, expires_at=expires_at, expires_in=config.TOKEN_TTL)
+
+@app.post("/api/auth/revoke", tags=["Auth"])
+async def revoke_token_endpoint(bearer: Optional[HTTPAuthorizationCredentials] = Security(core.bearer_security)):
+    """(User) Odwołuje przedstawiony token (wylogowanie)."""
+    if bearer is None or tokens.manager.verify(bearer.credentials) is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid or expired token",
+                            headers={"WWW-Authenticate": "Bearer"})
+    if await db_async.run(tokens.manager.revoke, bearer.credentials) is None:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Database error revoking token.")
+    return {"status": "revoked"}
+
 # == Grupa: User Actions ==
 
 @app.post("/api/barriers/{barrier_id}/open",
           status_code=status.HTTP_202_ACCEPTED,
           tags=["User Actions"],
           summary="Otwiera wskazany szlaban")
-async def open_barrier_endpoint(barrier_id: str, current_user: sqlite3.Row = Depends(core.get_current_user)):
+async def open_barrier_endpoint(barrier_id: str, async_mode: bool = Query(False, alias="async"),
+                                authz: core.CommandAuthorization = Depends(core.authorize_command)):
     """
     (User) Wysyła komendę 'open' do wskazanego szlabanu.
     Centrala zwraca 202 Accepted, ale *ciało odpowiedzi* zawiera status i dane zwrócone przez kontroler szlabanu.
     W przypadku błędu komunikacji z kontrolerem, centrala zwróci odpowiedni błąd 5xx.
+
+    `async=true`: centrala od razu zwraca 202 z `command_id` (nagłówek Location) i wysyła polecenie w tle;
+    przebieg i potwierdzenie wykonania (zdarzenie od kontrolera) - `GET /api/commands/{command_id}`.
     """
-    await core.send_command_to_barrier(barrier_id, "open", current_user)
+    if async_mode:
+        return await core.submit_command_job(barrier_id, "open", authz)
+    await core.send_command_to_barrier(barrier_id, "open", authz)
 
 
 @app.post("/api/barriers/{barrier_id}/close", status_code=status.HTTP_202_ACCEPTED, tags=["User Actions"], summary="Zamyka wskazany szlaban")
-async def close_barrier_endpoint(barrier_id: str, current_user: sqlite3.Row = Depends(core.get_current_user)):
-    """(User) Wysyła komendę 'close' do wskazanego szlabanu. Działa jak /open."""
-    await core.send_command_to_barrier(barrier_id, "close", current_user)
+async def close_barrier_endpoint(barrier_id: str, async_mode: bool = Query(False, alias="async"),
+                                 authz: core.CommandAuthorization = Depends(core.authorize_command)):
+    """(User) Wysyła komendę 'close' do wskazanego szlabanu. Działa jak /open (także `async=true`)."""
+    if async_mode:
+        return await core.submit_command_job(barrier_id, "close", authz)
+    await core.send_command_to_barrier(barrier_id, "close", authz)
 
 @app.post("/api/barriers/{barrier_id}/service/start", status_code=status.HTTP_202_ACCEPTED, tags=["User Actions"], summary="Włącza tryb serwisowy")
-async def service_start_endpoint(barrier_id: str, current_user: sqlite3.Row = Depends(core.get_current_user)):
-    """(User) Wysyła komendę 'service/start' (wymaga 'technician'). Działa jak /open."""
-    await core.send_command_to_barrier(barrier_id, "service/start", current_user)
+async def service_start_endpoint(barrier_id: str, async_mode: bool = Query(False, alias="async"),
+                                 authz: core.CommandAuthorization = Depends(core.authorize_command)):
+    """(User) Wysyła komendę 'service/start' (wymaga 'technician'). Działa jak /open (także `async=true`)."""
+    if async_mode:
+        return await core.submit_command_job(barrier_id, "service/start", authz)
+    await core.send_command_to_barrier(barrier_id, "service/start", authz)
 
 @app.post("/api/barriers/{barrier_id}/service/end", status_code=status.HTTP_202_ACCEPTED, tags=["User Actions"], summary="Wyłącza tryb serwisowy")
-async def service_end_endpoint(barrier_id: str, current_user: sqlite3.Row = Depends(core.get_current_user)):
-    """(User) Wysyła komendę 'service/end' (wymaga 'technician'). Działa jak /open."""
-    await core.send_command_to_barrier(barrier_id, "service/end", current_user)
+async def service_end_endpoint(barrier_id: str, async_mode: bool = Query(False, alias="async"),
+                               authz: core.CommandAuthorization = Depends(core.authorize_command)):
+    """(User) Wysyła komendę 'service/end' (wymaga 'technician'). Działa jak /open (także `async=true`)."""
+    if async_mode:
+        return await core.submit_command_job(barrier_id, "service/end", authz)
+    await core.send_command_to_barrier(barrier_id, "service/end", authz)
+
+@app.post("/api/barriers/commands", response_model=models.BarrierCommandsResponse, tags=["User Actions"],
+          summary="Wysyła polecenia do wielu szlabanów naraz")
+async def barrier_commands_endpoint(commands: List[models.BarrierCommand], request: Request,
+                                    credentials: Optional[HTTPBasicCredentials] = Security(core.basic_security),
+                                    bearer: Optional[HTTPAuthorizationCredentials] = Security(core.bearer_security)):
+    """
+    (User) Wysyła listę poleceń (`barrier_id`, `action`) jednym żądaniem - np. otwarcie całej grupy szlabanów.
+    Uprawnienia całej listy sprawdzane są jednym zapytaniem, a polecenia trafiają do kontrolerów równolegle.
+    Odpowiedź zawiera wynik dla każdego szlabanu (status i odpowiedź kontrolera albo błąd centrali).
+    """
+    core.check_bulk_size(commands, config.BARRIER_COMMANDS_MAX_ITEMS)
+    barrier_ids = [command.barrier_id for command in commands]
+    if len(set(barrier_ids)) != len(barrier_ids):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Each barrier may appear only once per request.")
+    authorizations = await core.authorize_commands(barrier_ids, credentials, bearer, core.client_address(request))
+    result = await core.send_commands_to_barriers(commands, authorizations)
+    username = next(iter(authorizations.values())).user['username']
+    log.info(f"Fan-out: User '{username}' sent {len(commands)} commands: {result['succeeded']} succeeded, {result['failed']} failed in {result['duration_ms']} ms.")
+    return result
+
+@app.get("/api/commands/{command_id}", response_model=models.CommandJobResponse, tags=["User Actions"],
+         summary="Stan polecenia asynchronicznego")
+async def get_command_endpoint(command_id: str, wait: float = Query(0.0, ge=0, le=config.COMMAND_LONG_POLL_MAX),
+                               current_user: sqlite3.Row = Depends(core.get_current_user)):
+    """
+    (User) Stan polecenia zleconego z `async=true`: queued, sent, acknowledged (kontroler przyjął),
+    completed (przyszło zdarzenie wykonania), failed albo expired.
+    `wait=N` (long-poll): odpowiedź dopiero po zakończeniu polecenia albo po N sekundach.
+    Stan polecenia jest w pamięci procesu, który je przyjął - przy kilku workerach uvicorn
+    zapytanie musi trafić do tego samego procesu (sticky sessions), inaczej 404.
+    """
+    job = commands.dispatcher.get(command_id)
+    if job is None or job.user_id != current_user['id']: # Cudze polecenia są niewidoczne
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Command '{command_id}' not found.")
+    await commands.dispatcher.wait(job, wait)
+    return job.to_dict()
 
 # == Grupa: User Info ==
-@app.get("/api/my/barriers", response_model=List[models.MyBarrierResponse], tags=["User Info"])
-async def get_my_barriers_endpoint(current_user: sqlite3.Row = Depends(core.get_current_user)):
-    """(User) Zwraca listę szlabanów, do których zalogowany użytkownik ma dostęp."""
-    barriers_details = db.get_user_authorized_barriers_details(current_user['id'])
+@app.get("/api/my/barriers", response_model=List[models.MyBarrierResponse], response_model_exclude_unset=True, tags=["User Info"])
+async def get_my_barriers_endpoint(include_status: bool = False, current_user: sqlite3.Row = Depends(core.get_current_user)):
+    """(User) Zwraca listę szlabanów, do których zalogowany użytkownik ma dostęp.
+
+    `include_status=true` dołącza stan każdego szlabanu z cache centrali (z wiekiem wartości) - bez łączenia się z kontrolerami.
+    """
+    barriers_details = await core.get_authorized_barriers_details(current_user['id'])
+    if include_status:
+        barriers_details = [{**details, "status": core.cached_barrier_status(details['barrier_id'])} for details in barriers_details]
     return barriers_details
 
+@app.get("/api/barriers/{barrier_id}/status", response_model=models.BarrierStatusResponse, tags=["User Info"])
+async def get_barrier_status_endpoint(barrier_id: str, max_age: Optional[float] = Query(None, ge=0),
+                                      current_user: sqlite3.Row = Depends(core.get_current_user)):
+    """(User) Stan szlabanu z cache centrali (sondy /status i zdarzenia), z wiekiem wartości.
+
+    `max_age` (sekundy): starszy stan jest najpierw odświeżany sondą kontrolera (chyba że kontroler jest niedostępny).
+    """
+    permission = await core.get_permission_level(current_user['id'], barrier_id)
+    if permission is None:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=f"No permission for barrier '{barrier_id}'.")
+    controller_url = await core.get_controller_url(barrier_id)
+    return await core.get_barrier_status(barrier_id, controller_url, max_age=max_age)
+
 @app.get("/api/my/events", response_model=List[models.BarrierEventDBResponse], tags=["User Info"])
-async def get_my_events_endpoint(limit: int = config.DEFAULT_EVENT_LIMIT, current_user: sqlite3.Row = Depends(core.get_current_user)):
-    """(User) Zwraca ostatnie zdarzenia z autoryzowanych szlabanów."""
-    authorized_ids = db.get_user_authorized_barrier_ids(current_user['id'])
+async def get_my_events_endpoint(limit: Optional[int] = None, before_id: Optional[int] = None, after_id: Optional[int] = None,
+                                 cursor: Optional[str] = None, output_format: str = Query("json", alias="format"),
+                                 filters: Optional[db.EventFilters] = Depends(core.event_filters),
+                                 current_user: sqlite3.Row = Depends(core.get_current_user)):
+    """(User) Zwraca ostatnie zdarzenia z autoryzowanych szlabanów (paginacja i filtry jak w /api/events)."""
+    authorized_ids = await core.get_authorized_barrier_ids(current_user['id'])
     if not authorized_ids:
         return [] # Użytkownik nie ma dostępu do żadnych szlabanów
 
-    events = db.get_events_from_db(barrier_ids=authorized_ids, limit=limit)
-    if events is None:
-         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Error reading events from database.")
-    return events
+    return await core.events_response(authorized_ids, limit=limit, before_id=before_id, after_id=after_id,
+                                      cursor=cursor, output_format=output_format, filters=filters)
+
+@app.get("/api/my/events/stream", tags=["User Info"])
+async def stream_my_events_endpoint(barrier_id: Optional[List[str]] = Query(None),
+                                    last_event_id: Optional[str] = Query(None),
+                                    last_event_id_header: Optional[str] = Header(None, alias="Last-Event-ID"),
+                                    current_user: sqlite3.Row = Depends(core.get_current_user)):
+    """(User) Strumień SSE nowych zdarzeń z autoryzowanych szlabanów (albo ich podzbioru `barrier_id`) - zamiast odpytywania /api/my/events.
+
+    Uprawnienia sprawdzane są przy połączeniu. Wznowienie od `Last-Event-ID` jak w /api/events/stream.
+    """
+    authorized_ids = await core.get_authorized_barrier_ids(current_user['id'])
+    if barrier_id:
+        forbidden = [b for b in barrier_id if b not in authorized_ids]
+        if forbidden:
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=f"No permission for barrier '{forbidden[0]}'.")
+        authorized_ids = barrier_id
+    return await core.events_stream_response(list(authorized_ids), last_event_id_header or last_event_id)
 
 @app.get("/api/barriers/{barrier_id}/events", response_model=List[models.BarrierEventDBResponse], tags=["User Info"])
-async def get_specific_barrier_events_endpoint(barrier_id: str, limit: int = config.DEFAULT_EVENT_LIMIT, current_user: sqlite3.Row = Depends(core.get_current_user)):
-    """(User) Zwraca ostatnie zdarzenia dla konkretnego, autoryzowanego szlabanu."""
+async def get_specific_barrier_events_endpoint(barrier_id: str, limit: Optional[int] = None, before_id: Optional[int] = None,
+                                               after_id: Optional[int] = None, cursor: Optional[str] = None,
+                                               output_format: str = Query("json", alias="format"),
+                                               filters: Optional[db.EventFilters] = Depends(core.event_filters),
+                                               current_user: sqlite3.Row = Depends(core.get_current_user)):
+    """(User) Zwraca ostatnie zdarzenia dla konkretnego, autoryzowanego szlabanu (paginacja i filtry jak w /api/events)."""
     # Sprawdź uprawnienia do tego konkretnego szlabanu
-    permission = db.get_db_permission_level(current_user['id'], barrier_id)
+    permission = await core.get_permission_level(current_user['id'], barrier_id)
     if permission is None:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=f"No permission for barrier '{barrier_id}'.")
 
     # Pobierz zdarzenia tylko dla tego szlabanu
-    events = db.get_events_from_db(barrier_ids=[barrier_id], limit=limit)
-    if events is None:
-         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Error reading events from database.")
-    return events
+    return await core.events_response([barrier_id], limit=limit, before_id=before_id, after_id=after_id,
+                                      cursor=cursor, output_format=output_format, filters=filters)
 
 @app.get("/api/my/failures", response_model=List[models.BarrierEventDBResponse], tags=["User Info"])
-async def get_my_failures_endpoint(limit: int = config.DEFAULT_EVENT_LIMIT, current_user: sqlite3.Row = Depends(core.get_current_user)):
-    """(User) Zwraca ostatnie awarie (zdarzenia z success=false) z autoryzowanych szlabanów."""
-    authorized_ids = db.get_user_authorized_barrier_ids(current_user['id'])
+async def get_my_failures_endpoint(limit: Optional[int] = None, before_id: Optional[int] = None, after_id: Optional[int] = None,
+                                   cursor: Optional[str] = None, output_format: str = Query("json", alias="format"),
+                                   filters: Optional[db.EventFilters] = Depends(core.event_filters),
+                                   current_user: sqlite3.Row = Depends(core.get_current_user)):
+    """(User) Zwraca ostatnie awarie (zdarzenia z success=false) z autoryzowanych szlabanów (paginacja i filtry jak w /api/events)."""
+    authorized_ids = await core.get_authorized_barrier_ids(current_user['id'])
     if not authorized_ids:
         return []
 
-    failure_events = db.get_events_from_db(barrier_ids=authorized_ids, limit=limit, only_failures=True)
-    if failure_events is None:
-         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Error reading failure events from database.")
-    return failure_events
+    return await core.events_response(authorized_ids, only_failures=True, limit=limit, before_id=before_id, after_id=after_id,
+                                      cursor=cursor, output_format=output_format, filters=filters)
+
+@app.get("/api/my/stats", response_model=models.EventStatsResponse, tags=["User Info"])
+async def get_my_stats_endpoint(barrier_id: Optional[List[str]] = Query(None), since: Optional[str] = None, until: Optional[str] = None,
+                                granularity: str = "hour", event_type: Optional[str] = None, trigger_method: Optional[str] = None,
+                                current_user: sqlite3.Row = Depends(core.get_current_user)):
+    """(User) Statystyki zdarzeń (jak /api/stats) dla autoryzowanych szlabanów."""
+    authorized_ids = await core.get_authorized_barrier_ids(current_user['id'])
+    if barrier_id:
+        forbidden = [b for b in barrier_id if b not in authorized_ids]
+        if forbidden:
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=f"No permission for barrier '{forbidden[0]}'.")
+        authorized_ids = barrier_id
+    return await core.stats_response(authorized_ids, since=since, until=until, granularity=granularity,
+                                     event_type=event_type, trigger_method=trigger_method)
 
 if __name__ == "__main__":
     import uvicorn
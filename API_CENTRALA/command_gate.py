@@ -0,0 +1,103 @@
+# command_gate.py
+# -*- coding: utf-8 -*-
+
+import asyncio
+import logging
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Optional, TypeVar
+
+import config
+
+log = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class _PendingCommand:
+    """Polecenie w kolejce jednego szlabanu: akcja i zadanie wysyłające je do kontrolera."""
+
+    __slots__ = ("action", "task", "waiters")
+
+    def __init__(self, action: str):
+        self.action = action
+        self.task: Optional[asyncio.Task] = None
+        self.waiters = 1
+
+
+class CommandGate:
+    """Porządkuje polecenia dla szlabanów w obrębie procesu: kolejka per szlaban i łączenie duplikatów (single-flight).
+
+    Polecenia do jednego szlabanu wykonywane są po kolei, w kolejności nadejścia - kontroler
+    nie dostaje naraz "open" i "close". Polecenie identyczne z ostatnim w kolejce (ta sama akcja,
+    jeszcze niezakończona) nie jest wysyłane ponownie: dołącza do niego i dostaje ten sam wynik.
+    Łączenie tylko z końcem kolejki zachowuje kolejność: open, close, open to trzy wywołania,
+    open, open, close - dwa.
+
+    Wywołanie kontrolera działa jako osobne zadanie, więc rozłączenie klienta, który je zlecił,
+    nie przerywa go pozostałym. Połączone polecenie idzie z X-User-ID pierwszego zlecającego.
+    """
+
+    def __init__(self):
+        self._queues: Dict[str, Deque[_PendingCommand]] = {}
+
+        # Statystyki
+        self.commands = 0
+        self.upstream_calls = 0
+        self.coalesced = 0
+        self.queued = 0 # Czekały na zakończenie innej akcji dla tego samego szlabanu
+        self.peak_queue_depth = 0
+
+    async def run(self, barrier_id: str, action: str, call: Callable[[], Awaitable[T]]) -> T:
+        """Wykonuje `call` (wysłanie polecenia) w kolejce szlabanu albo dołącza do identycznego polecenia w toku."""
+        self.commands += 1
+        if not config.BARRIER_COMMAND_COALESCING:
+            self.upstream_calls += 1
+            return await call()
+
+        queue = self._queues.setdefault(barrier_id, deque())
+        if queue and queue[-1].action == action:
+            pending = queue[-1]
+            pending.waiters += 1
+            self.coalesced += 1
+            log.info(f"Command gate: Coalesced '{action}' @ '{barrier_id}' with a command in progress ({pending.waiters} waiting).")
+        else:
+            previous = queue[-1].task if queue else None
+            if previous is not None:
+                self.queued += 1
+            pending = _PendingCommand(action)
+            pending.task = asyncio.create_task(self._execute(barrier_id, pending, previous, call))
+            queue.append(pending)
+            self.peak_queue_depth = max(self.peak_queue_depth, len(queue))
+        # shield: anulowanie jednego czekającego (rozłączony klient) nie anuluje wspólnego wywołania
+        return await asyncio.shield(pending.task)
+
+    async def _execute(self, barrier_id: str, pending: _PendingCommand, previous: Optional[asyncio.Task],
+                       call: Callable[[], Awaitable[T]]) -> T:
+        try:
+            if previous is not None:
+                await asyncio.wait([previous]) # Wynik poprzedniego polecenia nas nie dotyczy
+            self.upstream_calls += 1
+            return await call()
+        finally:
+            queue = self._queues.get(barrier_id)
+            if queue is not None:
+                queue.remove(pending)
+                if not queue:
+                    del self._queues[barrier_id]
+
+    def stats(self) -> Dict:
+        """Zwraca statystyki kolejek poleceń do monitoringu."""
+        return {
+            "enabled": config.BARRIER_COMMAND_COALESCING,
+            "commands": self.commands,
+            "upstream_calls": self.upstream_calls,
+            "coalesced": self.coalesced,
+            "queued": self.queued,
+            "active_barriers": len(self._queues),
+            "pending": sum(len(queue) for queue in self._queues.values()),
+            "peak_queue_depth": self.peak_queue_depth,
+        }
+
+
+# Globalna bramka procesu
+gate = CommandGate()
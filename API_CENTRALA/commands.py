@@ -0,0 +1,346 @@
+# commands.py
+# -*- coding: utf-8 -*-
+
+import asyncio
+import contextlib
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+import config
+import db_async
+import ingest
+
+log = logging.getLogger(__name__)
+
+# Zdarzenie kontrolera potwierdzające wykonanie akcji (SZLABAN/main.py: send_notification)
+COMPLETION_EVENTS = {
+    "open": "barrier_opened",
+    "close": "barrier_closed",
+    "service/start": "service_mode_started",
+    "service/end": "service_mode_ended",
+}
+# failed_action zdarzenia barrier_failure, które kończy polecenie błędem (service/end zamyka szlaban)
+FAILURE_ACTIONS = {"open": "open", "close": "close", "service/end": "close"}
+
+
+class CommandQueueFull(Exception):
+    """Kolejka poleceń asynchronicznych jest pełna - żądanie należy odrzucić (503)."""
+
+
+class CommandJob:
+    """Polecenie asynchroniczne: queued -> sent -> acknowledged -> completed / failed / expired."""
+
+    QUEUED = "queued" # Czeka na wolnego wykonawcę
+    SENT = "sent" # Wysłane do kontrolera, brak odpowiedzi
+    ACKNOWLEDGED = "acknowledged" # Kontroler przyjął (202), czekamy na zdarzenie wykonania
+    COMPLETED = "completed" # Przyszło zdarzenie wykonania (albo kontroler odpowiedział, że nie ma nic do zrobienia)
+    FAILED = "failed" # Błąd kontrolera / komunikacji albo zdarzenie barrier_failure
+    EXPIRED = "expired" # Brak zdarzenia wykonania w COMMAND_COMPLETION_TIMEOUT
+    FINISHED = frozenset((COMPLETED, FAILED, EXPIRED))
+
+    __slots__ = ("id", "barrier_id", "action", "user_id", "username", "state", "created_at", "sent_at",
+                 "acknowledged_at", "finished_at", "controller_status", "controller_response", "completion_event_id",
+                 "detail", "done", "finished_mono", "start_id", "_send", "_early_event", "_expiry", "_created_mono", "_acked_mono")
+
+    def __init__(self, barrier_id: str, action: str, user_id: int, username: str,
+                 send: Callable[[], Awaitable[Tuple[int, Any]]]):
+        self.id = uuid.uuid4().hex
+        self.barrier_id = barrier_id
+        self.action = action
+        self.user_id = user_id
+        self.username = username
+        self.state = self.QUEUED
+        self.created_at = datetime.now().isoformat()
+        self.sent_at: Optional[str] = None
+        self.acknowledged_at: Optional[str] = None
+        self.finished_at: Optional[str] = None
+        self.controller_status: Optional[int] = None
+        self.controller_response: Any = None
+        self.completion_event_id: Optional[int] = None
+        self.detail: Optional[str] = None
+        self.done = asyncio.Event()
+        self.finished_mono = 0.0
+        self.start_id: Optional[int] = None # Największe ID zdarzenia przed wysłaniem - zdarzenie wykonania ma większe
+        self._send = send
+        self._early_event: Optional[Tuple[int, bool]] = None # Zdarzenie, które przyszło przed odpowiedzią kontrolera
+        self._expiry: Optional[asyncio.TimerHandle] = None
+        self._created_mono = time.monotonic()
+        self._acked_mono = 0.0
+
+    @property
+    def finished(self) -> bool:
+        return self.state in self.FINISHED
+
+    def to_dict(self) -> Dict:
+        return {
+            "command_id": self.id,
+            "barrier_id": self.barrier_id,
+            "action": self.action,
+            "state": self.state,
+            "created_at": self.created_at,
+            "sent_at": self.sent_at,
+            "acknowledged_at": self.acknowledged_at,
+            "finished_at": self.finished_at,
+            "controller_status": self.controller_status,
+            "controller_response": self.controller_response,
+            "completion_event_id": self.completion_event_id,
+            "detail": self.detail,
+            "status_url": f"/api/commands/{self.id}",
+        }
+
+
+class CommandDispatcher:
+    """Wykonuje polecenia asynchroniczne (`?async=true`) w tle, ograniczoną pulą wykonawców.
+
+    Klient dostaje od razu 202 z ID polecenia, a połączenie HTTP nie czeka na kontroler.
+    Po przyjęciu przez kontroler (202) polecenie czeka na zdarzenie wykonania (barrier_opened,
+    barrier_closed, ...) od tego samego szlabanu - zdarzenia dostarcza callback writera zdarzeń,
+    a zapisane przez inne procesy uvicorn pętla `_poll_events` (ID większe niż `start_id`
+    polecenia, co COMMAND_EVENT_POLL_INTERVAL). Jedno zdarzenie kończy wszystkie czekające
+    polecenia tej akcji dla szlabanu (np. połączone przez command_gate). Stan poleceń jest
+    w pamięci procesu, który je przyjął (GET /api/commands/{id} musi trafić do tego samego
+    procesu); zakończone są usuwane po COMMAND_JOB_TTL albo po przekroczeniu COMMAND_JOB_MAX.
+    """
+
+    def __init__(self, workers: int, max_pending: int, completion_timeout: float, job_ttl: float, max_jobs: int):
+        self.workers = max(1, int(workers))
+        self.max_pending = max(1, int(max_pending))
+        self.completion_timeout = completion_timeout
+        self.job_ttl = job_ttl
+        self.max_jobs = max(1, int(max_jobs))
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._jobs: "OrderedDict[str, CommandJob]" = OrderedDict()
+        self._finished_jobs: "OrderedDict[str, CommandJob]" = OrderedDict() # Zakończone, w kolejności zakończenia
+        self._poll_task: Optional[asyncio.Task] = None
+        self._awaiting: Dict[str, List[CommandJob]] = {} # barrier_id -> polecenia wysłane, bez zdarzenia wykonania
+        self._detached: Set[asyncio.Task] = set() # Zadania poleceń zleconych poza lifespan (referencje przed GC)
+
+        # Statystyki
+        self.submitted = 0
+        self.rejected = 0
+        self.polled_events = 0 # Zdarzenia odczytane z bazy przez _poll_events
+        self.finished: Dict[str, int] = {state: 0 for state in sorted(CommandJob.FINISHED)}
+        self._ack_total = 0.0
+        self._ack_count = 0
+        self._completion_total = 0.0
+        self._completion_count = 0
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def start(self):
+        """Uruchamia wykonawców (lifespan)."""
+        if self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_pending)
+        self._tasks = [asyncio.create_task(self._worker(), name=f"command-dispatcher-{i}") for i in range(self.workers)]
+        if config.COMMAND_EVENT_POLL_INTERVAL > 0:
+            self._poll_task = asyncio.create_task(self._poll_events(config.COMMAND_EVENT_POLL_INTERVAL), name="command-event-poll")
+        log.info(f"Commands: Dispatcher started ({self.workers} workers, max {self.max_pending} queued).")
+
+    async def stop(self):
+        """Zatrzymuje wykonawców; polecenia jeszcze niewysłane kończą się błędem."""
+        tasks = self._tasks + ([self._poll_task] if self._poll_task is not None else [])
+        for task in tasks:
+            task.cancel()
+        for task in tasks:
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+        self._tasks = []
+        self._poll_task = None
+        while self._queue is not None and not self._queue.empty():
+            self._finish(self._queue.get_nowait(), CommandJob.FAILED, "Server shutting down before the command was sent.")
+        log.info("Commands: Dispatcher stopped.")
+
+    # --- Zlecanie ---
+
+    def submit(self, barrier_id: str, action: str, user_id: int, username: str,
+               send: Callable[[], Awaitable[Tuple[int, Any]]]) -> CommandJob:
+        """Kolejkuje polecenie (`send` - wysłanie do kontrolera). CommandQueueFull, gdy kolejka jest pełna."""
+        if self.running and self._queue.full():
+            self.rejected += 1
+            raise CommandQueueFull()
+        self._evict()
+        job = CommandJob(barrier_id, action, user_id, username, send)
+        self._jobs[job.id] = job
+        self.submitted += 1
+        if self.running:
+            self._queue.put_nowait(job)
+        else:
+            task = asyncio.create_task(self._run_job(job)) # Poza lifespan (np. skrypty) - bez puli wykonawców
+            self._detached.add(task)
+            task.add_done_callback(self._detached.discard)
+        return job
+
+    def _evict(self):
+        """Usuwa najdawniej zakończone polecenia: po TTL i tyle, by zmieścić nowe w COMMAND_JOB_MAX.
+
+        Niezakończonych nie usuwa - ich liczbę ogranicza kolejka i COMMAND_COMPLETION_TIMEOUT.
+        """
+        now = time.monotonic()
+        while self._finished_jobs:
+            oldest = next(iter(self._finished_jobs.values()))
+            if len(self._jobs) < self.max_jobs and now - oldest.finished_mono < self.job_ttl:
+                break
+            self._finished_jobs.popitem(last=False)
+            del self._jobs[oldest.id]
+
+    # --- Wykonanie ---
+
+    async def _worker(self):
+        while True:
+            await self._run_job(await self._queue.get())
+
+    async def _run_job(self, job: CommandJob):
+        try:
+            await self._process(job)
+        except Exception:
+            log.exception(f"Commands: Unexpected error processing command {job.id}.")
+            if not job.finished:
+                self._finish(job, CommandJob.FAILED, "Unexpected error while sending the command.")
+
+    async def _process(self, job: CommandJob):
+        job.start_id = await db_async.get_max_event_id() # None (błąd bazy) - tylko zdarzenia tego procesu
+        job.state = CommandJob.SENT
+        job.sent_at = datetime.now().isoformat()
+        self._awaiting.setdefault(job.barrier_id, []).append(job) # Zdarzenie może przyjść przed odpowiedzią
+        send, job._send = job._send, None
+        status_code, body = await send()
+        job.controller_status = status_code
+        job.controller_response = body
+        if job.finished:
+            return
+        if not 200 <= status_code < 300:
+            self._finish(job, CommandJob.FAILED, "Controller rejected the command or could not be reached.")
+            return
+
+        job.acknowledged_at = datetime.now().isoformat()
+        job._acked_mono = time.monotonic()
+        self._ack_total += job._acked_mono - job._created_mono
+        self._ack_count += 1
+        if job._early_event is not None:
+            event_id, success = job._early_event
+            job.completion_event_id = event_id
+            self._finish(job, CommandJob.COMPLETED if success else CommandJob.FAILED, "Completion event received.")
+        elif status_code != 202:
+            # 200: kontroler nie rozpoczął ruchu (już otwarty/zamknięty, w ruchu) - zdarzenia nie będzie
+            self._finish(job, CommandJob.COMPLETED, "Controller reported nothing to do.")
+        else:
+            job.state = CommandJob.ACKNOWLEDGED
+            job._expiry = asyncio.get_running_loop().call_later(self.completion_timeout, self._expire, job)
+
+    def _expire(self, job: CommandJob):
+        if not job.finished:
+            log.warning(f"Commands: No completion event for '{job.action}' @ '{job.barrier_id}' (command {job.id}) within {self.completion_timeout}s.")
+            self._finish(job, CommandJob.EXPIRED, "No completion event received in time.")
+
+    def _finish(self, job: CommandJob, state: str, detail: str):
+        job.state = state
+        job.detail = detail
+        job.finished_at = datetime.now().isoformat()
+        job.finished_mono = time.monotonic()
+        if job._expiry is not None:
+            job._expiry.cancel()
+            job._expiry = None
+        awaiting = self._awaiting.get(job.barrier_id)
+        if awaiting is not None and job in awaiting:
+            awaiting.remove(job)
+            if not awaiting:
+                del self._awaiting[job.barrier_id]
+        if state == CommandJob.COMPLETED and job._acked_mono:
+            self._completion_total += job.finished_mono - job._created_mono
+            self._completion_count += 1
+        self.finished[state] += 1
+        if job.id in self._jobs:
+            self._finished_jobs[job.id] = job
+        job.done.set()
+
+    # --- Korelacja ze zdarzeniami ---
+
+    def on_events(self, rows: List[ingest.CommittedEvent]):
+        """Callback writera zdarzeń: kończy polecenia, na które czekało zapisane zdarzenie."""
+        for event, _, event_id in rows:
+            self._match(event.barrier_id, event.event_type, event.success, event.failed_action, event_id)
+
+    async def _poll_events(self, interval: float):
+        """Pętla tła (lifespan): zdarzenia wykonania zapisane przez inne procesy (kilka workerów uvicorn)."""
+        while True:
+            await asyncio.sleep(interval)
+            after_ids = {}
+            for barrier_id, awaiting in self._awaiting.items():
+                start_ids = [job.start_id for job in awaiting if job.start_id is not None]
+                if start_ids:
+                    after_ids[barrier_id] = min(start_ids)
+            if not after_ids:
+                continue
+            try:
+                rows = await db_async.get_barrier_events_after(after_ids)
+                if rows is None:
+                    continue
+                self.polled_events += len(rows)
+                for event_id, barrier_id, event_type, success, failed_action in rows:
+                    self._match(barrier_id, event_type, bool(success), failed_action, event_id)
+            except Exception:
+                log.exception("Commands: Unexpected error polling completion events.")
+
+    def _match(self, barrier_id: str, event_type: str, success: bool, failed_action: Optional[str], event_id: int):
+        """Kończy (albo zapamiętuje dla wysłanych) polecenia szlabanu, które kończy to zdarzenie."""
+        awaiting = self._awaiting.get(barrier_id)
+        if not awaiting:
+            return
+        for job in list(awaiting):
+            if job.start_id is not None and event_id <= job.start_id:
+                continue # Zdarzenie sprzed wysłania polecenia
+            if success and event_type == COMPLETION_EVENTS.get(job.action):
+                completed = True
+            elif not success and failed_action is not None and failed_action == FAILURE_ACTIONS.get(job.action):
+                completed = False
+            else:
+                continue
+            if job.state == CommandJob.SENT:
+                job._early_event = job._early_event or (event_id, completed)
+                continue
+            job.completion_event_id = event_id
+            self._finish(job, CommandJob.COMPLETED if completed else CommandJob.FAILED,
+                         "Completion event received." if completed else f"Controller reported failure ({event_type}).")
+
+    # --- Odczyty ---
+
+    def get(self, job_id: str) -> Optional[CommandJob]:
+        return self._jobs.get(job_id)
+
+    async def wait(self, job: CommandJob, timeout: float):
+        """Czeka najwyżej `timeout` sekund na zakończenie polecenia (long-poll)."""
+        if timeout > 0 and not job.finished:
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(job.done.wait(), timeout=timeout)
+
+    def stats(self) -> Dict:
+        """Zwraca statystyki poleceń asynchronicznych do monitoringu."""
+        states = [job.state for job in self._jobs.values()]
+        return {
+            "running": self.running,
+            "workers": self.workers,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "max_pending": self.max_pending,
+            "sent": states.count(CommandJob.SENT),
+            "awaiting_completion": states.count(CommandJob.ACKNOWLEDGED),
+            "submitted": self.submitted,
+            "rejected": self.rejected,
+            "polled_events": self.polled_events,
+            "finished": dict(self.finished),
+            "stored_jobs": len(self._jobs),
+            "avg_ack_ms": round(self._ack_total / self._ack_count * 1000, 1) if self._ack_count else 0.0,
+            "avg_completion_ms": round(self._completion_total / self._completion_count * 1000, 1) if self._completion_count else 0.0,
+        }
+
+
+# Globalny dyspozytor procesu (wykonawcy uruchamiani w lifespan)
+dispatcher = CommandDispatcher(config.COMMAND_DISPATCH_WORKERS, config.COMMAND_QUEUE_MAX_PENDING,
+                               config.COMMAND_COMPLETION_TIMEOUT, config.COMMAND_JOB_TTL, config.COMMAND_JOB_MAX)
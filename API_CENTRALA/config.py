@@ -7,6 +7,78 @@ TABLE_BARRIER_EVENTS = "barrier_events"
 TABLE_USERS = "users"
 TABLE_BARRIERS = "barriers"
 TABLE_PERMISSIONS = "user_barrier_permissions"
+TABLE_AUTHZ_GENERATION = "authz_generation" # Licznik zmian danych autoryzacyjnych (utrzymywany triggerami)
+TABLE_EVENT_STATS = "barrier_event_stats_hourly" # Godzinowe agregaty zdarzeń (aktualizowane przy zapisie)
+TABLE_SERVER_SECRETS = "server_secrets" # Klucze serwera (np. podpis tokenów) - wspólne dla wszystkich procesów
+TABLE_TOKEN_REVOCATIONS = "token_revocations" # Odwołane tokeny (jti) do ich wygaśnięcia - wspólne dla wszystkich procesów
+TABLE_TOKEN_STATE_GENERATION = "token_state_generation" # Licznik zmian odwołań i generacji tokenów (utrzymywany triggerami)
+
+# --- Pula Połączeń SQLite ---
+DB_POOL_SIZE = 8 # Maksymalna liczba długo żyjących połączeń
+DB_POOL_TIMEOUT = 10.0 # Sekundy oczekiwania na wolne połączenie z puli
+DB_EXECUTOR_WORKERS = 8 # Wątki wykonujące zapytania z handlerów async (nie więcej niż DB_POOL_SIZE); 0 - w pętli zdarzeń (tylko do porównań)
+DB_BUSY_TIMEOUT = 10.0 # Sekundy oczekiwania na blokadę zapisu SQLite
+# Pragmy ustawiane raz, przy otwarciu każdego połączenia w puli
+DB_PRAGMAS = {
+    # auto_vacuum musi być ustawione przed journal_mode (działa tylko dla nowej, pustej bazy);
+    # INCREMENTAL pozwala retencji oddawać zwolnione strony do systemu plików
+    "auto_vacuum": "INCREMENTAL",
+    "journal_mode": "WAL", # Czytelnicy nie blokują zapisu (i odwrotnie)
+    # FULL: fsync WAL przy każdym commicie - zapis potwierdzony odpowiedzią (POST /barrier/events) przetrwa utratę
+    # zasilania; group commit (ingest.py) rozkłada koszt fsync na całą paczkę. NORMAL przy WAL traci przy awarii
+    # zasilania ostatnie commity sprzed checkpointu.
+    "synchronous": "FULL",
+    "foreign_keys": "ON",
+    "cache_size": -16000, # Ujemna wartość = KiB (~16 MB na połączenie)
+    "mmap_size": 268435456, # 256 MB
+    "temp_store": "MEMORY",
+}
+
+# --- Zapis Zdarzeń (group commit) ---
+INGEST_BATCH_MAX_ROWS = 500 # Maksymalna liczba zdarzeń w jednej transakcji
+INGEST_BATCH_MAX_DELAY = 0.005 # Sekundy oczekiwania na kolejne zdarzenia do wspólnego commita
+INGEST_MAX_BULK_EVENTS = 5000 # Maksymalna liczba zdarzeń w jednym żądaniu POST /barrier/events
+INGEST_WRITE_BEHIND = True # POST /barrier/event potwierdza (202) po przyjęciu do kolejki; zapis w tle (False - dopiero po commicie)
+INGEST_QUEUE_HIGH_WATER = 50000 # Zdarzenia czekające na zapis; powyżej - 503 z Retry-After
+INGEST_QUEUE_LOW_WATER = 25000 # ...aż kolejka zejdzie poniżej tego progu
+INGEST_WRITE_RETRIES = 5 # Próby zapisu potwierdzonych zdarzeń, po których są porzucane (dropped_rows w /api/metrics)
+INGEST_RETRY_DELAY = 0.5 # Sekundy przerwy po nieudanym zapisie paczki
+INGEST_RETRY_AFTER_MAX = 30 # Górna granica Retry-After przy przepełnieniu kolejki (sekundy)
+INGEST_DRAIN_RATE_WINDOW = 10.0 # Sekundy, z których liczone jest tempo zapisu (drain_rate w /api/metrics)
+
+# --- Cache Autoryzacji ---
+AUTHZ_CACHE_CHECK_INTERVAL = 1.0 # Sekundy między sprawdzeniami PRAGMA data_version (zmiany z innych procesów)
+CREDENTIAL_CACHE_ENABLED = True # Pomijanie bcrypt dla powtarzanych, już zweryfikowanych danych Basic Auth
+CREDENTIAL_CACHE_TTL = 60.0 # Sekundy ważności wpisu
+CREDENTIAL_CACHE_MAX_ENTRIES = 10000 # Powyżej - usuwane najdawniej używane (LRU)
+TOKEN_TTL = 3600 # Sekundy ważności tokenu z /api/auth/token
+PASSWORD_HASH_PROCESSES = None # Procesy hashujące/weryfikujące hasła bcrypt (None = liczba rdzeni)
+PASSWORD_HASH_MAX_PENDING = None # Limit operacji bcrypt w toku i w kolejce; nadmiar -> 503 (None = 8 na proces)
+
+# --- Limity Poleceń dla Szlabanów (token bucket; przekroczenie -> 429 z Retry-After) ---
+RATE_LIMIT_ENABLED = True
+RATE_LIMIT_CLIENT_RATE = 20.0 # Żądania poleceń/s z jednego adresu IP (sprawdzane przed uwierzytelnieniem)
+RATE_LIMIT_CLIENT_BURST = 50
+RATE_LIMIT_GLOBAL_RATE = 100.0 # Polecenia/s dla całej centrali (w procesie)
+RATE_LIMIT_GLOBAL_BURST = 200 # Chwilowy nadmiar ponad tempo
+RATE_LIMIT_USER_RATE = 2.0 # Polecenia/s jednego użytkownika
+RATE_LIMIT_USER_BURST = 10
+RATE_LIMIT_BARRIER_RATE = 1.0 # Polecenia/s do jednego szlabanu (kontroler RPi to jednoprocesowy Flask)
+RATE_LIMIT_BARRIER_BURST = 5
+RATE_LIMIT_MAX_KEYS = 100000 # Maksymalna liczba śledzonych użytkowników / szlabanów (LRU)
+
+# --- Operacje Masowe (provisioning) ---
+BULK_MAX_ITEMS = 10000 # Maksymalna liczba elementów w jednym żądaniu /api/*/bulk
+
+# --- Retencja i Archiwum Zdarzeń ---
+RETENTION_ENABLED = True
+RETENTION_MAX_AGE_DAYS = 90 # Starsze zdarzenia (wg received_at) trafiają do archiwum
+RETENTION_INTERVAL = 3600.0 # Sekundy między przebiegami retencji
+RETENTION_STARTUP_DELAY = 60.0 # Sekundy od startu serwera do pierwszego przebiegu
+RETENTION_BATCH_SIZE = 1000 # Wiersze przenoszone w jednej (krótkiej) transakcji
+RETENTION_BATCH_PAUSE = 0.05 # Sekundy przerwy między paczkami (oddanie blokady zapisu)
+ARCHIVE_DIR = "archive" # Katalog segmentów archiwum (per szlaban, per miesiąc)
+ARCHIVE_COMPRESSION_LEVEL = 6 # Poziom kompresji zlib (1-9)
 
 # --- Konfiguracja Logowania ---
 LOG_LEVEL = logging.INFO
@@ -18,4 +90,37 @@ API_KEY_NAME = "X-Admin-API-Key"
 # --- Inne Ustawienia ---
 DEFAULT_EVENT_LIMIT = 50
 MAX_EVENT_LIMIT = 1000
-BARRIER_COMMAND_TIMEOUT = 15.0 # Sekundy
\ No newline at end of file
+EVENT_STREAM_BATCH_SIZE = 500 # Wiersze pobierane naraz przy eksporcie NDJSON
+SSE_QUEUE_SIZE = 1000 # Zdarzenia czekające na wysłanie do jednego strumienia SSE; przepełnienie -> odłączenie (wznowienie z Last-Event-ID)
+SSE_MAX_SUBSCRIBERS = 1000 # Maksymalna liczba otwartych strumieni SSE w procesie; nadmiar -> 503
+SSE_HEARTBEAT_INTERVAL = 15.0 # Sekundy ciszy, po których wysyłany jest komentarz keep-alive
+SSE_RETRY_MS = 3000 # Sugerowany klientowi odstęp ponownego połączenia (pole retry)
+SSE_RESUME_MAX_EVENTS = 10000 # Maksymalna liczba zaległych zdarzeń wysyłanych przy wznowieniu (Last-Event-ID)
+RECENT_EVENTS_ENABLED = True # Ostatnie zdarzenia każdego szlabanu w pamięci procesu (typowe zapytania /api/events bez SQLite)
+RECENT_EVENTS_PER_BARRIER = 50 # Zdarzenia trzymane w buforze jednego szlabanu
+RECENT_EVENTS_SYNC_INTERVAL = 0.5 # Sekundy między sprawdzeniami zdarzeń zapisanych przez inne procesy (PRAGMA data_version)
+EVENT_TIME_INDEX_MAX_SPAN = 2 * 86400 # Sekundy; węższe zakresy czasu czytane są indeksem czasu zamiast indeksu id
+EVENT_FEED_PLAN = "auto" # Strona zdarzeń wielu szlabanów: "auto" (planer w db._use_feed_scan), "index" (IN po szlabanach) albo "scan" (od najnowszych id)
+EVENT_FEED_SEEK_ROWS = 20 # Koszt zejścia indeksem do jednego szlabanu w wierszach skanu (próg planera; zmierzone: benchmark.py multi-barrier-feed)
+BARRIER_COMMAND_TIMEOUT = 15.0 # Sekundy
+CONTROLLER_MAX_CONNECTIONS = 100 # Połączenia keep-alive do kontrolerów (łącznie, wspólny klient HTTP)
+CONTROLLER_MAX_CONNECTIONS_PER_HOST = 4 # Równoczesne żądania do jednego kontrolera (jednoprocesowy Flask na RPi)
+CONTROLLER_KEEPALIVE_EXPIRY = 30.0 # Sekundy bezczynności, po których połączenie jest zamykane
+CONTROLLER_HEALTH_ENABLED = True # Sondy /status kontrolerów i bezpieczniki (circuit breaker) na ścieżce poleceń
+CONTROLLER_HEALTH_INTERVAL = 10.0 # Sekundy między rundami sond
+CONTROLLER_HEALTH_PROBE_TIMEOUT = 2.0 # Sekundy na odpowiedź /status
+CONTROLLER_HEALTH_CONCURRENCY = 50 # Sondy wykonywane równocześnie
+CONTROLLER_BREAKER_FAILURE_THRESHOLD = 3 # Kolejne błędy (sondy lub polecenia), po których obwód się otwiera
+CONTROLLER_BREAKER_OPEN_SECONDS = 30.0 # Czas odrzucania poleceń przed próbą (half-open)
+BARRIER_STATE_MAX_AGE = 30.0 # Sekundy; starszy stan szlabanu w cache jest oznaczany jako "stale"
+BARRIER_STATE_EVENT_MAX_DELAY = 60.0 # Sekundy; zdarzenia odebrane z większym opóźnieniem (z bufora kontrolera) nie zmieniają stanu
+BARRIER_COMMAND_COALESCING = True # Polecenia do szlabanu po kolei; identyczne polecenie w toku jest współdzielone, nie wysyłane ponownie
+COMMAND_DISPATCH_WORKERS = 32 # Polecenia asynchroniczne (?async=true) wysyłane równocześnie
+COMMAND_QUEUE_MAX_PENDING = 1000 # Polecenia asynchroniczne czekające na wysłanie; nadmiar -> 503
+COMMAND_COMPLETION_TIMEOUT = 60.0 # Sekundy oczekiwania na zdarzenie wykonania (barrier_opened, ...) po przyjęciu polecenia
+COMMAND_JOB_TTL = 600.0 # Sekundy przechowywania zakończonych poleceń asynchronicznych (GET /api/commands/{id})
+COMMAND_JOB_MAX = 10000 # Maksymalna liczba przechowywanych poleceń
+COMMAND_EVENT_POLL_INTERVAL = 1.0 # Sekundy między odczytami zdarzeń wykonania z bazy (zapisanych przez inne procesy uvicorn); 0 - tylko zdarzenia tego procesu
+COMMAND_LONG_POLL_MAX = 30.0 # Maksymalny parametr wait= w GET /api/commands/{id}
+BARRIER_COMMANDS_MAX_ITEMS = 200 # Maksymalna liczba poleceń w jednym POST /api/barriers/commands
+BARRIER_FANOUT_CONCURRENCY = 32 # Polecenia z jednego żądania wysyłane równocześnie
\ No newline at end of file
@@ -0,0 +1,130 @@
+# controller_client.py
+# -*- coding: utf-8 -*-
+
+import asyncio
+import logging
+import time
+from typing import Dict, Optional
+
+import httpx
+
+import config
+
+log = logging.getLogger(__name__)
+
+
+class ControllerClient:
+    """Jeden długo żyjący httpx.AsyncClient procesu dla poleceń wysyłanych do kontrolerów szlabanów.
+
+    Połączenia keep-alive są używane ponownie, więc kolejne polecenie do tego samego kontrolera
+    nie płaci za nawiązanie TCP ani budowę klienta. Kontroler na RPi to jednoprocesowy Flask,
+    dlatego liczba równoczesnych żądań do jednego hosta jest dodatkowo ograniczona semaforem;
+    czekanie na wolne miejsce wlicza się do limitu czasu polecenia.
+    """
+
+    def __init__(self, timeout: float, max_connections: int, max_per_host: int, keepalive_expiry: float):
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.max_per_host = max(1, int(max_per_host))
+        self.keepalive_expiry = keepalive_expiry
+        self._client: Optional[httpx.AsyncClient] = None
+        self._host_slots: Dict[str, asyncio.Semaphore] = {}
+
+        # Statystyki
+        self.requests = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.waiting_for_host = 0
+        self.errors = 0
+        self.timeouts = 0
+        self._latency_total = 0.0
+
+    def start(self):
+        """Tworzy klienta (lifespan)."""
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.timeout),
+                limits=httpx.Limits(max_connections=self.max_connections,
+                                    max_keepalive_connections=self.max_connections,
+                                    keepalive_expiry=self.keepalive_expiry),
+            )
+            log.info(f"Controller client: Started (max {self.max_connections} connections, {self.max_per_host} per host).")
+
+    async def close(self):
+        """Zamyka wszystkie połączenia (lifespan)."""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            self._host_slots.clear()
+            log.info("Controller client: Closed.")
+
+    async def request(self, method: str, url: str, headers: Optional[Dict[str, str]] = None,
+                      timeout: Optional[float] = None) -> httpx.Response:
+        """Żądanie do kontrolera przez wspólną pulę połączeń. Wyjątki httpx przechodzą do wywołującego.
+
+        `timeout` (domyślnie BARRIER_COMMAND_TIMEOUT) obejmuje czekanie na wolne miejsce dla hosta.
+        """
+        if self._client is None: # Poza lifespan (np. skrypty) - klient tworzony przy pierwszym użyciu
+            self.start()
+        timeout = timeout or self.timeout
+        host = httpx.URL(url).netloc.decode("ascii")
+        slots = self._host_slots.setdefault(host, asyncio.Semaphore(self.max_per_host))
+        started = time.perf_counter()
+        self.requests += 1
+        acquired = False
+        try:
+            self.waiting_for_host += 1
+            try:
+                async with asyncio.timeout(timeout):
+                    await slots.acquire()
+                    acquired = True
+            except TimeoutError:
+                raise httpx.PoolTimeout(f"No free connection slot for controller host {host}.")
+            finally:
+                self.waiting_for_host -= 1
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            try:
+                remaining = max(0.001, timeout - (time.perf_counter() - started))
+                return await self._client.request(method, url, headers=headers, timeout=remaining)
+            finally:
+                self.in_flight -= 1
+        except httpx.TimeoutException:
+            self.timeouts += 1
+            raise
+        except httpx.HTTPError:
+            self.errors += 1
+            raise
+        finally:
+            if acquired: # Także gdy anulowanie / limit czasu przyszły tuż po zajęciu miejsca
+                slots.release()
+            self._latency_total += time.perf_counter() - started
+
+    async def post(self, url: str, headers: Optional[Dict[str, str]] = None) -> httpx.Response:
+        """POST z poleceniem do kontrolera."""
+        return await self.request("POST", url, headers=headers)
+
+    async def get(self, url: str, timeout: Optional[float] = None) -> httpx.Response:
+        """GET (np. /status) z kontrolera."""
+        return await self.request("GET", url, timeout=timeout)
+
+    def stats(self) -> Dict:
+        """Zwraca statystyki klienta do monitoringu."""
+        return {
+            "started": self._client is not None,
+            "requests": self.requests,
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "waiting_for_host": self.waiting_for_host,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "avg_latency_ms": round(self._latency_total / self.requests * 1000, 2) if self.requests else 0.0,
+            "hosts": len(self._host_slots),
+            "max_connections": self.max_connections,
+            "max_per_host": self.max_per_host,
+        }
+
+
+# Globalny klient procesu (tworzony i zamykany w lifespan)
+client = ControllerClient(config.BARRIER_COMMAND_TIMEOUT, config.CONTROLLER_MAX_CONNECTIONS,
+                          config.CONTROLLER_MAX_CONNECTIONS_PER_HOST, config.CONTROLLER_KEEPALIVE_EXPIRY)
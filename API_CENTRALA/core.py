@@ -1,33 +1,80 @@
 # core.py
 # -*- coding: utf-8 -*-
 
+import asyncio
+import base64
+import binascii
+import json
 import logging
+import math
 import sqlite3
+import time
 import httpx
-from typing import Optional
-from passlib.context import CryptContext
-from fastapi import HTTPException, status, Depends, Security
-from fastapi.security import APIKeyHeader, HTTPBasic, HTTPBasicCredentials
+from datetime import datetime
+from dataclasses import dataclass
+from typing import Any, Optional, List, Dict, Tuple
+from fastapi import HTTPException, Request, status, Depends, Security
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.security import APIKeyHeader, HTTPAuthorizationCredentials, HTTPBasic, HTTPBasicCredentials, HTTPBearer
 
 # Importuj konfigurację i funkcje DB
 import config
-import db # Potrzebne do get_user_by_username, get_db_permission_level, get_barrier_controller_url
+import db # Potrzebne do iter_event_batches_from_db (eksport NDJSON)
+import db_async # Asynchroniczne odpowiedniki funkcji db (wykonywane w executorze DB)
+import authz_cache # Procesowy cache uprawnień i URL-i kontrolerów
+import credential_cache # Cache zweryfikowanych danych Basic Auth (pomija bcrypt)
+import tokens # Podpisane tokeny dostępu (bearer)
+import passwords # bcrypt w puli procesów
+import ratelimit # Limity poleceń dla szlabanów
+import controller_client # Wspólny klient HTTP (keep-alive) do kontrolerów szlabanów
+import health # Sondy kontrolerów i bezpieczniki
+import command_gate # Kolejka poleceń per szlaban i łączenie duplikatów
+import commands # Polecenia asynchroniczne (?async=true)
+import broker # Rozsyłanie zdarzeń do strumieni SSE
+import barrier_state # Stan szlabanów w pamięci (sondy + zdarzenia)
+import recent_events # Bufory ostatnich zdarzeń (typowe zapytania /api/events bez bazy)
+import ingest # Kolejka zapisu zdarzeń (IngestQueueFull)
+import timestamps
 
 log = logging.getLogger(__name__)
 
 # --- Konfiguracja Bezpieczeństwa (obiekty) ---
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-basic_security = HTTPBasic()
+# auto_error=False: oba schematy czytają nagłówek Authorization, więc sprawdzamy je po kolei sami
+basic_security = HTTPBasic(auto_error=False)
+bearer_security = HTTPBearer(auto_error=False)
 admin_api_key_header = APIKeyHeader(name=config.API_KEY_NAME, auto_error=False) # auto_error=False by móc zwrócić własny błąd
 
 # --- Funkcje Pomocnicze Bezpieczeństwa ---
-def verify_password(plain: str, hashed: str) -> bool:
-    """Weryfikuje hasło jawne z hashem."""
-    return pwd_context.verify(plain, hashed)
+# Synchroniczne wersje (skrypty, benchmark); handlery używają wersji *_async z pulą procesów
+pwd_context = passwords.pwd_context
+verify_password = passwords.verify_password
+get_password_hash = passwords.get_password_hash
 
-def get_password_hash(pwd: str) -> str:
-    """Generuje hash hasła."""
-    return pwd_context.hash(pwd)
+def _hasher_busy() -> HTTPException:
+    log.warning("Password hasher queue full - rejecting authentication work with 503.")
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Server is busy verifying passwords, retry shortly.",
+        headers={"Retry-After": "1"},
+    )
+
+async def verify_password_async(plain: str, hashed: str) -> bool:
+    """Jak verify_password, ale w puli procesów; 503 przy przepełnionej kolejce."""
+    try:
+        return await passwords.hasher.verify(plain, hashed)
+    except passwords.HasherBusy:
+        raise _hasher_busy()
+
+async def get_password_hash_async(pwd: str) -> str:
+    """Jak get_password_hash, ale w puli procesów; 503 przy przepełnionej kolejce."""
+    try:
+        return await passwords.hasher.hash(pwd)
+    except passwords.HasherBusy:
+        raise _hasher_busy()
+
+async def hash_passwords_bulk(pwds: List[str]) -> List[str]:
+    """Hashuje wiele haseł równolegle w puli procesów (import masowy)."""
+    return await passwords.hasher.hash_many(pwds)
 
 # --- Zależności Autoryzacji FastAPI ---
 async def verify_admin_token(api_key: str = Security(admin_api_key_header)):
@@ -44,8 +91,19 @@ async def verify_admin_token(api_key: str = Security(admin_api_key_header)):
             )
     # Token jest poprawny, nie ma potrzeby nic zwracać
 
-async def get_current_user(credentials: Optional[HTTPBasicCredentials] = Security(basic_security)) -> sqlite3.Row:
-    """Weryfikuje dane logowania Basic Auth i zwraca obiekt użytkownika (Row)."""
+def _bearer_user(bearer: HTTPAuthorizationCredentials) -> Dict:
+    """Użytkownik z podpisanego tokenu (bez bazy i bez bcrypt) albo 401."""
+    user = tokens.manager.verify(bearer.credentials)
+    if user is None:
+        log.warning("Bearer auth attempt failed: invalid, expired or revoked token.")
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid or expired token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return user
+
+def _require_basic(credentials: Optional[HTTPBasicCredentials]) -> HTTPBasicCredentials:
     if credentials is None:
         log.warning("Basic Auth attempt failed: No credentials provided.")
         raise HTTPException(
@@ -53,32 +111,469 @@ async def get_current_user(credentials: Optional[HTTPBasicCredentials] = Securit
             detail="Not authenticated",
             headers={"WWW-Authenticate": "Basic"},
         )
+    return credentials
 
-    user = db.get_user_by_username(credentials.username)
-    if user is None or not verify_password(credentials.password, user['hashed_password']):
+def _cached_basic_user(credentials: HTTPBasicCredentials):
+    """Użytkownik z cache poświadczeń (ta sama para nazwa+hasło zweryfikowana niedawno) albo None."""
+    if not config.CREDENTIAL_CACHE_ENABLED:
+        return None
+    cached_user = credential_cache.cache.get(credentials.username, credentials.password)
+    if cached_user is not None:
+        log.debug(f"User '{credentials.username}' authenticated via Basic Auth (cached).")
+    return cached_user
+
+async def _check_basic_password(credentials: HTTPBasicCredentials, user: Optional[sqlite3.Row]) -> sqlite3.Row:
+    """Weryfikuje hasło (bcrypt) względem wiersza użytkownika z bazy; 401 przy błędzie."""
+    if user is None or not await verify_password_async(credentials.password, user['hashed_password']):
         log.warning(f"Failed Basic Auth attempt for user '{credentials.username}'")
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Basic"},
         )
+    if config.CREDENTIAL_CACHE_ENABLED:
+        credential_cache.cache.put(credentials.username, credentials.password, user)
     log.info(f"User '{credentials.username}' authenticated via Basic Auth.")
     return user
 
-# --- Pośrednik Komend do Szlabanów ---
-async def send_command_to_barrier(barrier_id: str, action: str, current_user: sqlite3.Row):
+async def get_current_user(credentials: Optional[HTTPBasicCredentials] = Security(basic_security),
+                           bearer: Optional[HTTPAuthorizationCredentials] = Security(bearer_security)) -> sqlite3.Row:
+    """Weryfikuje token (Bearer) albo dane logowania Basic Auth i zwraca użytkownika.
+
+    Dla tokenu zwracany jest słownik {"id", "username"} zbudowany z podpisanych danych tokenu
+    (bez bazy i bez bcrypt); dla Basic Auth - wiersz z bazy. Endpointy używają tylko tych dwóch pól.
+    """
+    if bearer is not None:
+        return _bearer_user(bearer)
+    return await get_basic_user(credentials)
+
+async def get_basic_user(credentials: Optional[HTTPBasicCredentials] = Security(basic_security)) -> sqlite3.Row:
+    """Weryfikuje wyłącznie Basic Auth (hasło) - np. przy wydawaniu tokenu w /api/auth/token."""
+    credentials = _require_basic(credentials)
+    cached_user = _cached_basic_user(credentials)
+    if cached_user is not None:
+        return cached_user
+    return await _check_basic_password(credentials, await db_async.get_user_by_username(credentials.username))
+
+def _too_many_commands(scope: str, retry_after: float) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail=f"Too many commands ({scope} limit), retry later.",
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+    )
+
+def client_address(request: Request) -> str:
+    """Adres IP klienta (klucz limitu przed uwierzytelnieniem)."""
+    return request.client.host if request.client is not None else "unknown"
+
+def check_client_rate(client: str):
+    """Limit per adres klienta przed sprawdzeniem hasła - zalew złych haseł nie kosztuje bcrypt; 429 po przekroczeniu."""
+    retry_after, scope = ratelimit.command_limiter.check_client(client)
+    if scope is not None:
+        log.warning(f"Rate limit ({scope}) exceeded: client {client}; retry after {retry_after:.2f}s.")
+        raise _too_many_commands(scope, retry_after)
+
+def check_command_rate(username: Optional[str], barrier_ids: List[str]):
+    """Limity poleceń (globalny, użytkownik, szlaban) - po sprawdzeniu uprawnień; 429 z Retry-After po przekroczeniu.
+
+    `barrier_ids` - tylko szlabany poleceń dozwolonych (_command_denial zwróciło None).
+    """
+    retry_after, scope = ratelimit.command_limiter.check(username, barrier_ids)
+    if scope is not None:
+        log.warning(f"Rate limit ({scope}) exceeded: user '{username}', barriers {barrier_ids}; retry after {retry_after:.2f}s.")
+        raise _too_many_commands(scope, retry_after)
+
+@dataclass(frozen=True)
+class CommandAuthorization:
+    """Dane potrzebne do wysłania polecenia: użytkownik, jego poziom dla szlabanu i URL kontrolera."""
+    user: Any # sqlite3.Row albo słownik {"id", "username"} (token)
+    permission_level: Optional[str]
+    controller_url: Optional[str]
+
+async def _get_command_authorization(username: str, barrier_ids: List[str]) -> List[sqlite3.Row]:
+    """db.get_command_authorization; błąd bazy to 500, a nie 401 (pusta lista - użytkownik nie istnieje)."""
+    rows = await db_async.get_command_authorization(username, barrier_ids)
+    if rows is None:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Error reading authorization data from database.")
+    return rows
+
+async def authorize_commands(barrier_ids: List[str], credentials: Optional[HTTPBasicCredentials],
+                             bearer: Optional[HTTPAuthorizationCredentials], client: str) -> Dict[str, CommandAuthorization]:
+    """Uwierzytelnienie i dane autoryzacyjne dla listy szlabanów - najwyżej jednym zapytaniem do bazy.
+
+    Token albo trafienie w cache poświadczeń - uprawnienia i URL-e z authz_cache (bez bazy), a gdy
+    cache nie jest wczytany - z get_command_authorization. Bez tego get_command_authorization
+    zwraca od razu użytkownika z hashem hasła, uprawnieniami i URL-ami (zamiast 1 + 2N zapytań).
+    Przed hasłem sprawdzany jest tylko limit adresu klienta; limity użytkownika, szlabanów
+    i puli globalnej obciąża check_command_rate dopiero po sprawdzeniu uprawnień do polecenia.
+    """
+    if bearer is not None:
+        user = _bearer_user(bearer)
+    else:
+        credentials = _require_basic(credentials)
+        check_client_rate(client) # Przed bcrypt i bazą
+        user = _cached_basic_user(credentials)
+        if user is None:
+            rows = await _get_command_authorization(credentials.username, barrier_ids)
+            user = await _check_basic_password(credentials, rows[0] if rows else None)
+            return {row['barrier_id']: CommandAuthorization(user, row['permission_level'], row['controller_url']) for row in rows}
+
+    if authz_cache.cache.loaded:
+        return {barrier_id: CommandAuthorization(user, authz_cache.cache.get_permission_level(user['id'], barrier_id),
+                                                 authz_cache.cache.get_controller_url(barrier_id))
+                for barrier_id in barrier_ids}
+    rows = await _get_command_authorization(user['username'], barrier_ids)
+    if not rows or rows[0]['id'] != user['id']: # Użytkownik usunięty od czasu logowania
+        return {barrier_id: CommandAuthorization(user, None, None) for barrier_id in barrier_ids}
+    return {row['barrier_id']: CommandAuthorization(user, row['permission_level'], row['controller_url']) for row in rows}
+
+async def authorize_command(barrier_id: str, request: Request,
+                            credentials: Optional[HTTPBasicCredentials] = Security(basic_security),
+                            bearer: Optional[HTTPAuthorizationCredentials] = Security(bearer_security)) -> CommandAuthorization:
+    """Zależność endpointów poleceń dla jednego szlabanu (authorize_commands z jednym ID)."""
+    return (await authorize_commands([barrier_id], credentials, bearer, client_address(request)))[barrier_id]
+
+# --- Dane Autoryzacyjne (cache w pamięci, baza tylko gdy cache niedostępny) ---
+async def get_permission_level(user_id: int, barrier_id: str) -> Optional[str]:
+    """Poziom uprawnień użytkownika do szlabanu (O(1) z cache)."""
+    if authz_cache.cache.loaded:
+        return authz_cache.cache.get_permission_level(user_id, barrier_id)
+    return await db_async.get_db_permission_level(user_id, barrier_id)
+
+async def get_authorized_barrier_ids(user_id: int) -> List[str]:
+    """ID szlabanów, do których użytkownik ma dostęp."""
+    if authz_cache.cache.loaded:
+        return authz_cache.cache.get_authorized_barrier_ids(user_id)
+    return await db_async.get_user_authorized_barrier_ids(user_id)
+
+async def get_authorized_barriers_details(user_id: int) -> List[Dict]:
+    """Szczegóły szlabanów (ID, URL, poziom), do których użytkownik ma dostęp."""
+    if authz_cache.cache.loaded:
+        return authz_cache.cache.get_authorized_barriers_details(user_id)
+    return await db_async.get_user_authorized_barriers_details(user_id)
+
+async def get_controller_url(barrier_id: str) -> Optional[str]:
+    """URL kontrolera szlabanu."""
+    if authz_cache.cache.loaded:
+        return authz_cache.cache.get_controller_url(barrier_id)
+    return await db_async.get_barrier_controller_url(barrier_id)
+
+# --- Stan Szlabanów (cache w pamięci) ---
+def cached_barrier_status(barrier_id: str) -> Dict:
+    """Stan szlabanu z cache (bez kontaktu z kontrolerem)."""
+    controller = health.monitor.get(barrier_id)
+    return barrier_state.cache.to_dict(barrier_id, controller.reachable if controller else None)
+
+async def get_barrier_status(barrier_id: str, controller_url: Optional[str], max_age: Optional[float] = None) -> Dict:
+    """Stan szlabanu; gdy jest starszy niż `max_age` sekund - najpierw sonda /status kontrolera (jeśli dostępny)."""
+    if max_age is not None and controller_url and config.CONTROLLER_HEALTH_ENABLED:
+        age = barrier_state.cache.age(barrier_id)
+        if age is None or age > max_age:
+            await health.monitor.probe_now(barrier_id, controller_url)
+    return cached_barrier_status(barrier_id)
+
+# --- Odbiór Zdarzeń od Kontrolerów ---
+def ingest_overloaded(error: ingest.IngestQueueFull) -> HTTPException:
+    """503 dla kontrolera, gdy kolejka zapisu zdarzeń jest przepełniona (ponowi po Retry-After)."""
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Event queue is full, retry later.",
+        headers={"Retry-After": str(max(1, math.ceil(error.retry_after)))},
+    )
+
+# --- Odpowiedzi ze Zdarzeniami (paginacja i eksport NDJSON) ---
+EVENT_CURSOR_HEADER = "X-Next-Cursor"
+
+def encode_event_cursor(before_id: Optional[int] = None, after_id: Optional[int] = None) -> str:
+    """Koduje pozycję paginacji jako nieprzezroczysty kursor (base64url z JSON)."""
+    payload = {k: v for k, v in (("b", before_id), ("a", after_id)) if v is not None}
+    return base64.urlsafe_b64encode(json.dumps(payload, separators=(",", ":")).encode()).decode().rstrip("=")
+
+def decode_event_cursor(cursor: str) -> Dict[str, Optional[int]]:
+    """Dekoduje kursor z encode_event_cursor; zły kursor -> 400."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        before_id, after_id = payload.get("b"), payload.get("a")
+        if not all(v is None or isinstance(v, int) for v in (before_id, after_id)):
+            raise ValueError("cursor ids must be integers")
+    except (ValueError, TypeError, AttributeError, binascii.Error) as e:
+        log.warning(f"Invalid event cursor '{cursor}': {e}")
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid pagination cursor.")
+    return {"before_id": before_id, "after_id": after_id}
+
+def _next_event_cursor(events: List[Dict], limit: int, before_id: Optional[int], after_id: Optional[int]) -> Optional[str]:
+    """Wyznacza kursor następnej strony (None = brak kolejnych starszych zdarzeń)."""
+    if after_id is not None and before_id is None:
+        # Strony rosnąco (nowsze zdarzenia) - kursor zawsze, by móc dalej śledzić nowe wpisy
+        return encode_event_cursor(after_id=events[-1]['id'] if events else after_id)
+    if len(events) < limit:
+        return None
+    return encode_event_cursor(before_id=events[-1]['id'], after_id=after_id)
+
+def _parse_time_filter(value: Optional[str], name: str) -> Optional[int]:
+    """Granica zakresu czasu (ISO 8601) -> mikrosekundy od epoki; zła data -> 400."""
+    if value is None:
+        return None
+    try:
+        return timestamps.iso_to_epoch_us(value)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid '{name}' (expected ISO 8601 date/time).")
+
+async def event_filters(since: Optional[str] = None, until: Optional[str] = None, event_type: Optional[str] = None,
+                        trigger_method: Optional[str] = None, user_id: Optional[str] = None) -> Optional[db.EventFilters]:
+    """Zależność FastAPI: filtry zdarzeń z parametrów zapytania (since włącznie, until wyłącznie - czas zdarzenia)."""
+    if since is None and until is None and event_type is None and trigger_method is None and user_id is None:
+        return None
+    return db.EventFilters(since_us=_parse_time_filter(since, "since"), until_us=_parse_time_filter(until, "until"),
+                           event_type=event_type, trigger_method=trigger_method, user_id=user_id)
+
+async def events_response(barrier_ids: Optional[List[str]], only_failures: bool = False, limit: Optional[int] = None,
+                          before_id: Optional[int] = None, after_id: Optional[int] = None,
+                          cursor: Optional[str] = None, output_format: str = "json",
+                          filters: Optional[db.EventFilters] = None):
+    """Wspólna obsługa endpointów zdarzeń: strona JSON z kursorem w nagłówku lub strumień NDJSON.
+
+    Strona JSON jest serializowana bezpośrednio (bez ponownej walidacji przez response_model),
+    a kursor kolejnej strony trafia do nagłówka X-Next-Cursor.
+    """
+    if cursor:
+        position = decode_event_cursor(cursor)
+        before_id, after_id = position["before_id"], position["after_id"]
+
+    if output_format == "ndjson":
+        return StreamingResponse(
+            _ndjson_event_stream(barrier_ids, only_failures, limit, before_id, after_id, filters),
+            media_type="application/x-ndjson",
+        )
+    if output_format != "json":
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Unsupported format (use 'json' or 'ndjson').")
+
+    if limit is None:
+        limit = config.DEFAULT_EVENT_LIMIT
+    elif not (1 <= limit <= config.MAX_EVENT_LIMIT):
+        limit = config.DEFAULT_EVENT_LIMIT # Jak w db.get_events_from_db
+    events = None
+    if config.RECENT_EVENTS_ENABLED and not only_failures and after_id is None and filters is None:
+        # Najnowsze zdarzenia (także kolejne strony po before_id) z buforów w pamięci, gdy wynik jest pewny
+        events = recent_events.cache.query(barrier_ids, limit, before_id)
+    if events is None:
+        events = await db_async.get_events_from_db(barrier_ids=barrier_ids, limit=limit, only_failures=only_failures,
+                                                   before_id=before_id, after_id=after_id, filters=filters)
+        if events is None: # get_events_from_db zwraca None w przypadku błędu DB
+            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Error reading events from database.")
+
+    headers = {}
+    next_cursor = _next_event_cursor(events, limit, before_id, after_id)
+    if next_cursor:
+        headers[EVENT_CURSOR_HEADER] = next_cursor
+    return JSONResponse(content=events, headers=headers)
+
+async def _ndjson_event_stream(barrier_ids: Optional[List[str]], only_failures: bool, limit: Optional[int],
+                               before_id: Optional[int], after_id: Optional[int], filters: Optional[db.EventFilters] = None):
+    """Strumień NDJSON: paczki zdarzeń pobierane w executorze DB, po jednej naraz (bez trzymania połączenia między nimi)."""
+    batches = db.iter_event_batches_from_db(barrier_ids=barrier_ids, only_failures=only_failures,
+                                            before_id=before_id, after_id=after_id, limit=limit, filters=filters)
+    fetch: Optional[asyncio.Future] = None
+    try:
+        while True:
+            fetch = asyncio.ensure_future(db_async.run(next, batches, None))
+            try:
+                batch = await asyncio.shield(fetch)
+            except sqlite3.Error as e:
+                log.error(f"DB Stream Events Error: Export aborted. Error: {e}")
+                break # Nagłówki już wysłane - przerywamy strumień
+            if batch is None:
+                break
+            yield "".join(json.dumps(event, ensure_ascii=False) + "\n" for event in batch)
+    finally:
+        # Rozłączenie klienta w trakcie pobierania: generator nadal działa w wątku executora -
+        # zamknięcie dopiero po zakończeniu tej paczki (inaczej "generator already executing")
+        if fetch is not None:
+            if not fetch.done():
+                await asyncio.wait([fetch])
+            if not fetch.cancelled():
+                fetch.exception() # Wynik porzuconej paczki nie jest już potrzebny (bez ostrzeżenia asyncio)
+        batches.close()
+
+# --- Strumień Zdarzeń na Żywo (SSE) ---
+def _sse_message(event_id: int, data: str) -> str:
+    return f"id: {event_id}\nevent: barrier_event\ndata: {data}\n\n"
+
+async def events_stream_response(barrier_ids: Optional[List[str]], last_event_id: Optional[str]) -> StreamingResponse:
+    """Strumień SSE nowych zdarzeń wskazanych szlabanów (None - wszystkich); z `last_event_id` najpierw zaległe z bazy."""
+    resume_after = None
+    if last_event_id:
+        try:
+            resume_after = int(last_event_id)
+        except ValueError:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid Last-Event-ID (expected event ID).")
+    try:
+        broker.event_broker.check_capacity()
+    except broker.BrokerFull:
+        log.warning("SSE: Subscriber limit reached - rejecting event stream.")
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Too many event streams, retry later.",
+                            headers={"Retry-After": "5"})
+    return StreamingResponse(_sse_event_stream(barrier_ids, resume_after), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+async def _sse_event_stream(barrier_ids: Optional[List[str]], resume_after: Optional[int]):
+    """Zaległe zdarzenia z bazy (id > resume_after), potem zdarzenia z brokera; co SSE_HEARTBEAT_INTERVAL komentarz keep-alive.
+
+    Subskrypcja powstaje dopiero przy pierwszym odczycie treści (klient rozłączony wcześniej
+    niczego nie zostawia) i przed odczytem zaległych zdarzeń - nic nie umknie między bazą a brokerem.
     """
-    Sprawdza uprawnienia, znajduje URL i wysyła komendę do kontrolera szlabanu.
-    Zwraca odpowiedź kontrolera lub podnosi HTTPException w razie błędu.
+    try:
+        subscription = broker.event_broker.subscribe(barrier_ids)
+    except broker.BrokerFull: # Limit zajęty między sprawdzeniem a startem strumienia
+        log.warning("SSE: Subscriber limit reached - ending event stream.")
+        yield f"retry: {config.SSE_RETRY_MS}\n\nevent: reset\ndata: {{\"reason\": \"too_many_streams\"}}\n\n"
+        return
+    try:
+        yield f"retry: {config.SSE_RETRY_MS}\n\n"
+        last_sent = resume_after
+        resumed = 0
+        while last_sent is not None:
+            events = await db_async.get_events_from_db(barrier_ids=barrier_ids, limit=config.MAX_EVENT_LIMIT, after_id=last_sent)
+            if events is None:
+                log.error("SSE: Failed reading missed events from database.")
+                yield "event: reset\ndata: {\"reason\": \"database_error\"}\n\n"
+                break
+            if events:
+                yield "".join(_sse_message(event["id"], json.dumps(event, ensure_ascii=False)) for event in events)
+                last_sent = events[-1]["id"]
+                resumed += len(events)
+            if len(events) < config.MAX_EVENT_LIMIT:
+                break
+            if resumed >= config.SSE_RESUME_MAX_EVENTS:
+                # Za duża zaległość na strumień - klient powinien pobrać historię przez /api/*/events
+                yield "event: reset\ndata: {\"reason\": \"too_many_missed_events\"}\n\n"
+                break
+
+        while True:
+            try:
+                item = await subscription.get(config.SSE_HEARTBEAT_INTERVAL)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            items = [item]
+            while item is not None and not subscription.queue.empty(): # Wszystko, co czeka - jednym zapisem
+                item = subscription.queue.get_nowait()
+                items.append(item)
+            chunk = []
+            for queued in items:
+                if queued is None:
+                    break
+                event_id, _, data = queued
+                if last_sent is not None and event_id <= last_sent:
+                    continue # Już wysłane z bazy przy wznowieniu
+                chunk.append(_sse_message(event_id, data))
+                last_sent = event_id
+            if chunk:
+                yield "".join(chunk)
+            if items[-1] is None:
+                if subscription.overflowed:
+                    # Klient (EventSource) połączy się ponownie z Last-Event-ID i dostanie resztę z bazy
+                    yield "event: overflow\ndata: {}\n\n"
+                break
+    finally:
+        broker.event_broker.unsubscribe(subscription)
+
+# --- Statystyki Zdarzeń (agregaty godzinowe) ---
+def _parse_stats_bound(value: Optional[str], name: str) -> Optional[str]:
+    """Zamienia granicę zakresu (ISO 8601) na kubełek godzinowy 'RRRR-MM-DDTHH'; zła data -> 400."""
+    if value is None:
+        return None
+    try:
+        moment = datetime.fromisoformat(value)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid '{name}' (expected ISO 8601 date/time).")
+    return timestamps.to_local_naive(moment).strftime("%Y-%m-%dT%H") # Agregaty trzymają czas lokalny
+
+async def stats_response(barrier_ids: Optional[List[str]], since: Optional[str] = None, until: Optional[str] = None,
+                         granularity: str = "hour", event_type: Optional[str] = None, trigger_method: Optional[str] = None) -> Dict:
+    """Wspólna obsługa /api/stats i /api/my/stats: liczby zdarzeń i awarii w kubełkach czasu.
+
+    Zakres z dokładnością do pełnych godzin: `since` włącznie, `until` wyłącznie.
     """
-    user_id_db = current_user['id']
-    username = current_user['username']
+    if granularity not in db.STATS_GRANULARITIES:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"Unsupported granularity (use one of: {', '.join(db.STATS_GRANULARITIES)}).")
+    since_hour = _parse_stats_bound(since, "since")
+    until_hour = _parse_stats_bound(until, "until")
+
+    rows = await db_async.get_event_stats_from_db(barrier_ids=barrier_ids, since_hour=since_hour, until_hour=until_hour,
+                                                  granularity=granularity, event_type=event_type, trigger_method=trigger_method)
+    if rows is None:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Error reading statistics from database.")
+
+    # Wiersze są posortowane po (barrier_id, bucket) - składamy po jednym kubełku na parę
+    buckets: List[Dict] = []
+    for row in rows:
+        if not buckets or (buckets[-1]["barrier_id"], buckets[-1]["bucket"]) != (row["barrier_id"], row["bucket"]):
+            buckets.append({"barrier_id": row["barrier_id"], "bucket": row["bucket"], "total": 0, "failures": 0, "by_event_type": {}})
+        bucket = buckets[-1]
+        bucket["total"] += row["total"]
+        bucket["failures"] += row["failures"]
+        bucket["by_event_type"][row["event_type"]] = row["total"]
+    for bucket in buckets:
+        bucket["failure_rate"] = round(bucket["failures"] / bucket["total"], 4) if bucket["total"] else 0.0
+
+    total = sum(bucket["total"] for bucket in buckets)
+    failures = sum(bucket["failures"] for bucket in buckets)
+    return {
+        "granularity": granularity,
+        "since": since_hour,
+        "until": until_hour,
+        "total": total,
+        "failures": failures,
+        "failure_rate": round(failures / total, 4) if total else 0.0,
+        "buckets": buckets,
+    }
+
+# --- Odpowiedzi Operacji Masowych ---
+# Status z funkcji db.*_bulk -> (status w API, opis)
+_BULK_STATUSES = {
+    "created": ("created", None),
+    "conflict": ("conflict", "Already exists."),
+    "user_not_found": ("not_found", "User not found."),
+    "barrier_not_found": ("not_found", "Barrier not found."),
+}
+
+def check_bulk_size(items: List, max_items: Optional[int] = None):
+    """Odrzuca puste (400) i zbyt duże (413) żądania masowe (domyślny limit - BULK_MAX_ITEMS)."""
+    max_items = max_items or config.BULK_MAX_ITEMS
+    if not items:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Item list is empty.")
+    if len(items) > max_items:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=f"Too many items in one request (max {max_items}).")
+
+def bulk_response(results: Dict[int, Tuple[str, Optional[int]]], count: int, invalid: Optional[Dict[int, str]] = None) -> Dict:
+    """Składa odpowiedź masową: wynik per indeks wejścia (results z db, invalid - odrzucone przed bazą)."""
+    invalid = invalid or {}
+    items = []
+    for index in range(count):
+        if index in invalid:
+            items.append({"index": index, "status": "invalid", "id": None, "detail": invalid[index]})
+            continue
+        db_status, item_id = results[index]
+        api_status, detail = _BULK_STATUSES.get(db_status, (db_status, None))
+        items.append({"index": index, "status": api_status, "id": item_id, "detail": detail})
+    totals = {name: sum(1 for item in items if item["status"] == name) for name in ("created", "conflict", "not_found", "invalid")}
+    return {"created": totals["created"], "conflicts": totals["conflict"], "not_found": totals["not_found"],
+            "invalid": totals["invalid"], "results": items}
+
+# --- Pośrednik Komend do Szlabanów ---
+def _command_denial(barrier_id: str, action: str, authz: CommandAuthorization) -> Optional[Tuple[int, str]]:
+    """Sprawdza uprawnienia i konfigurację szlabanu. Zwraca (status, opis) odmowy albo None, gdy można wysłać."""
+    user_id_db = authz.user['id']
+    username = authz.user['username']
 
     # 1. Sprawdź poziom uprawnień
-    permission_level = db.get_db_permission_level(user_id_db, barrier_id)
+    permission_level = authz.permission_level
     if permission_level is None:
         log.warning(f"AuthZ Fail: User '{username}'(ID:{user_id_db}) has no permission for barrier '{barrier_id}'.")
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=f"No permission for barrier '{barrier_id}'.")
+        return status.HTTP_403_FORBIDDEN, f"No permission for barrier '{barrier_id}'."
 
     # 2. Sprawdź, czy poziom wystarcza do akcji
     action_allowed = False
@@ -89,52 +584,117 @@ async def send_command_to_barrier(barrier_id: str, action: str, current_user: sq
 
     if not action_allowed:
         log.warning(f"AuthZ Fail: User '{username}'(Lvl:{permission_level}) insufficient for action '{action}' on barrier '{barrier_id}'.")
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=f"Permission level '{permission_level}' insufficient for action '{action}'.")
+        return status.HTTP_403_FORBIDDEN, f"Permission level '{permission_level}' insufficient for action '{action}'."
 
-    # 3. Znajdź URL kontrolera
-    controller_url = db.get_barrier_controller_url(barrier_id)
-    if not controller_url:
+    # 3. URL kontrolera
+    if not authz.controller_url:
         log.error(f"Config Error: Controller URL for barrier '{barrier_id}' not found in DB.")
         # Użyj 500, bo to błąd konfiguracji serwera centralnego
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Barrier controller URL not configured for ID '{barrier_id}'.")
+        return status.HTTP_500_INTERNAL_SERVER_ERROR, f"Barrier controller URL not configured for ID '{barrier_id}'."
+    return None
+
+def _check_command(barrier_id: str, action: str, authz: CommandAuthorization):
+    """Odmowa (403/500) albo przekroczony limit (429) - HTTPException. Odmowa obciąża tylko limit użytkownika."""
+    denial = _command_denial(barrier_id, action, authz)
+    check_command_rate(authz.user['username'], [barrier_id] if denial is None else [])
+    if denial is not None:
+        raise HTTPException(status_code=denial[0], detail=denial[1])
+
+async def _forward_command(barrier_id: str, action: str, authz: CommandAuthorization) -> Tuple[int, Any]:
+    """Wysyła komendę do kontrolera przez kolejkę szlabanu (identyczne polecenia w toku są łączone)."""
+    return await command_gate.gate.run(barrier_id, action, lambda: _send_to_controller(barrier_id, action, authz))
 
-    # 4. Wyślij komendę
+async def _send_to_controller(barrier_id: str, action: str, authz: CommandAuthorization) -> Tuple[int, Any]:
+    """Wysyła komendę do kontrolera. Zwraca (status, treść) odpowiedzi kontrolera albo błędu komunikacji."""
     target_endpoint = f"/{action}" # Zakładamy, że URL kontrolera nie ma slasha na końcu
-    full_url = controller_url.rstrip('/') + target_endpoint
+    full_url = authz.controller_url.rstrip('/') + target_endpoint
     # Kluczowe: Przekazujemy ID użytkownika (z centrali) do kontrolera szlabanu
     # Kontroler może chcieć wiedzieć, kto inicjuje akcję
-    headers = {'X-User-ID': str(user_id_db)}
+    headers = {'X-User-ID': str(authz.user['id'])}
+
+    if not health.monitor.allow_command(barrier_id, authz.controller_url):
+        log.warning(f"Proxy Cmd: Circuit open for '{barrier_id}' - rejecting '{action}' without contacting the controller.")
+        return status.HTTP_503_SERVICE_UNAVAILABLE, f"Controller for barrier '{barrier_id}' is unreachable, retry later."
+
+    log.info(f"Proxy Cmd: User '{authz.user['username']}'(Lvl:{authz.permission_level}) -> '{action}' @ '{barrier_id}' ({full_url})")
 
-    log.info(f"Proxy Cmd: User '{username}'(Lvl:{permission_level}) -> '{action}' @ '{barrier_id}' ({full_url})")
+    try:
+        response = await controller_client.client.post(full_url, headers=headers)
+        health.monitor.record_command(barrier_id, authz.controller_url, reachable=True)
+        log.info(f"Proxy Response from {barrier_id} ({action}): Status={response.status_code}")
 
-    async with httpx.AsyncClient(timeout=config.BARRIER_COMMAND_TIMEOUT) as client:
+        # Próbujemy odczytać JSON, jeśli się nie uda, bierzemy tekst
         try:
-            response = await client.post(full_url, headers=headers)
-            log.info(f"Proxy Response from {barrier_id} ({action}): Status={response.status_code}")
+            response_json = response.json()
+        except Exception:
+            response_json = {"raw_response": response.text}
+        return response.status_code, response_json
 
-            # Próbujemy odczytać JSON, jeśli się nie uda, bierzemy tekst
-            try:
-                response_json = response.json()
-            except Exception:
-                response_json = {"raw_response": response.text}
-
-            # Podnieś HTTPException ze statusem i ciałem odpowiedzi kontrolera
-            # Niezależnie czy sukces (np. 200 OK) czy błąd (np. 400, 500) od kontrolera
-            # Pozwala to klientowi API centrali zobaczyć, co odpowiedział szlaban
-            # Status 202 Accepted z centrali był tylko potwierdzeniem przyjęcia żądania do proxy
-            raise HTTPException(status_code=response.status_code, detail=response_json)
-
-        except httpx.TimeoutException:
-            log.error(f"Proxy Error: Timeout ({config.BARRIER_COMMAND_TIMEOUT}s) connecting to '{barrier_id}' ({full_url}).")
-            raise HTTPException(status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail=f"Timeout connecting to barrier '{barrier_id}'.")
-        except httpx.RequestError as exc:
-            log.error(f"Proxy Error: Connection error to '{barrier_id}' ({full_url}): {exc}")
-            raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail=f"Connection error to barrier '{barrier_id}': {exc}")
-        except HTTPException as http_exc:
-             # Przechwyć HTTPException podniesione powyżej (z odpowiedzi kontrolera)
-             # i przekaż je dalej bez zmian
-             raise http_exc
-        except Exception as e:
-             # Inne nieoczekiwane błędy podczas komunikacji
-             log.exception(f"Proxy Error: Unexpected error sending command to '{barrier_id}': {e}")
-             raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Unexpected proxy error: {e}")
\ No newline at end of file
+    except httpx.TimeoutException:
+        health.monitor.record_command(barrier_id, authz.controller_url, reachable=False)
+        log.error(f"Proxy Error: Timeout ({config.BARRIER_COMMAND_TIMEOUT}s) connecting to '{barrier_id}' ({full_url}).")
+        return status.HTTP_504_GATEWAY_TIMEOUT, f"Timeout connecting to barrier '{barrier_id}'."
+    except httpx.RequestError as exc:
+        health.monitor.record_command(barrier_id, authz.controller_url, reachable=False)
+        log.error(f"Proxy Error: Connection error to '{barrier_id}' ({full_url}): {exc}")
+        return status.HTTP_502_BAD_GATEWAY, f"Connection error to barrier '{barrier_id}': {exc}"
+    except Exception as e:
+        # Inne nieoczekiwane błędy podczas komunikacji
+        health.monitor.record_command(barrier_id, authz.controller_url, reachable=False)
+        log.exception(f"Proxy Error: Unexpected error sending command to '{barrier_id}': {e}")
+        return status.HTTP_500_INTERNAL_SERVER_ERROR, f"Unexpected proxy error: {e}"
+
+async def send_command_to_barrier(barrier_id: str, action: str, authz: CommandAuthorization):
+    """
+    Sprawdza uprawnienia (z authorize_command) i wysyła komendę do kontrolera szlabanu.
+    Zawsze kończy się HTTPException: ze statusem i ciałem odpowiedzi kontrolera
+    (niezależnie czy sukces, np. 200 OK, czy błąd, np. 400, 500) albo z błędem centrali.
+    Pozwala to klientowi API centrali zobaczyć, co odpowiedział szlaban.
+    """
+    _check_command(barrier_id, action, authz)
+    status_code, body = await _forward_command(barrier_id, action, authz)
+    retry_after = health.monitor.retry_after(barrier_id) if status_code == status.HTTP_503_SERVICE_UNAVAILABLE else 0
+    raise HTTPException(status_code=status_code, detail=body,
+                        headers={"Retry-After": str(max(1, math.ceil(retry_after)))} if retry_after else None)
+
+async def submit_command_job(barrier_id: str, action: str, authz: CommandAuthorization) -> JSONResponse:
+    """Tryb asynchroniczny: odmowy od razu (403/500), a polecenie trafia do kolejki i klient dostaje 202 z jego ID."""
+    _check_command(barrier_id, action, authz)
+    try:
+        job = commands.dispatcher.submit(barrier_id, action, authz.user['id'], authz.user['username'],
+                                         lambda: _forward_command(barrier_id, action, authz))
+    except commands.CommandQueueFull:
+        log.warning(f"Proxy Cmd: Async command queue full - rejecting '{action}' @ '{barrier_id}'.")
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Command queue is full, retry later.",
+                            headers={"Retry-After": "1"})
+    log.info(f"Proxy Cmd: User '{authz.user['username']}' queued '{action}' @ '{barrier_id}' as command {job.id}.")
+    return JSONResponse(status_code=status.HTTP_202_ACCEPTED, content=job.to_dict(), headers={"Location": job.to_dict()["status_url"]})
+
+async def send_commands_to_barriers(commands: List, authorizations: Dict[str, CommandAuthorization]) -> Dict:
+    """Wysyła polecenia do wielu szlabanów naraz (najwyżej BARRIER_FANOUT_CONCURRENCY równocześnie).
+
+    Odmowy (403/500) nie wychodzą z centrali; reszta leci równolegle, więc całość trwa mniej więcej
+    tyle, co najwolniejszy kontroler. Wynik per polecenie, w kolejności wejścia. Limity szlabanów
+    i puli globalnej obciążają tylko dozwolone polecenia; przekroczenie dowolnego limitu - 429 dla całości.
+    """
+    started = time.perf_counter()
+    slots = asyncio.Semaphore(config.BARRIER_FANOUT_CONCURRENCY)
+    denials = {command.barrier_id: _command_denial(command.barrier_id, command.action, authorizations[command.barrier_id])
+               for command in commands}
+    username = authorizations[commands[0].barrier_id].user['username']
+    check_command_rate(username, [barrier_id for barrier_id, denial in denials.items() if denial is None])
+
+    async def run_one(command) -> Dict:
+        command_started = time.perf_counter()
+        authz = authorizations[command.barrier_id]
+        outcome = denials[command.barrier_id]
+        if outcome is None:
+            async with slots:
+                outcome = await _forward_command(command.barrier_id, command.action, authz)
+        return {"barrier_id": command.barrier_id, "action": command.action, "status_code": outcome[0], "detail": outcome[1],
+                "duration_ms": round((time.perf_counter() - command_started) * 1000, 2)}
+
+    results = await asyncio.gather(*(run_one(command) for command in commands))
+    succeeded = sum(1 for result in results if 200 <= result["status_code"] < 300)
+    return {"succeeded": succeeded, "failed": len(results) - succeeded,
+            "duration_ms": round((time.perf_counter() - started) * 1000, 2), "results": results}
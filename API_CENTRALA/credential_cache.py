@@ -0,0 +1,98 @@
+# credential_cache.py
+# -*- coding: utf-8 -*-
+
+import hashlib
+import hmac
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+import config
+
+log = logging.getLogger(__name__)
+
+
+class CredentialCache:
+    """Krótkotrwały cache poprawnie zweryfikowanych danych Basic Auth (LRU + TTL).
+
+    Kluczem jest HMAC-SHA256(username, hasło) z sekretem losowanym przy starcie procesu,
+    więc w pamięci nie ma ani haseł, ani wartości, które dałoby się porównać z innym
+    procesem lub zrzutem. Wpis pomija bcrypt tylko dla identycznej pary nazwa+hasło;
+    nieudane logowania nie są zapamiętywane (każda zła próba nadal kosztuje bcrypt).
+    Każda zmiana lub usunięcie użytkownika (w tym czy innym procesie - API nie ma takich
+    endpointów, zmiany robi się w bazie) podbija generację authz triggerem, a callback
+    authz_cache czyści wtedy cały cache.
+    """
+
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max(1, int(max_entries))
+        self._secret = os.urandom(32)
+        self._entries: "OrderedDict[bytes, tuple]" = OrderedDict() # klucz -> (username, user, wygasa)
+        self._lock = threading.Lock() # Unieważnienia przychodzą z wątku executora DB
+
+        # Statystyki
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _key(self, username: str, password: str) -> bytes:
+        message = username.encode("utf-8") + b"\0" + password.encode("utf-8")
+        return hmac.new(self._secret, message, hashlib.sha256).digest()
+
+    def get(self, username: str, password: str) -> Optional[Any]:
+        """Zwraca zapamiętanego użytkownika dla tej pary nazwa+hasło albo None (brak lub wygasł)."""
+        key = self._key(username, password)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[2] <= now:
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, username: str, password: str, user: Any):
+        """Zapamiętuje użytkownika po udanej weryfikacji bcrypt."""
+        key = self._key(username, password)
+        with self._lock:
+            self._entries[key] = (username, user, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """Czyści cały cache (wykryta zmiana użytkowników)."""
+        with self._lock:
+            self._entries.clear()
+            self.invalidations += 1
+
+    def stats(self) -> Dict:
+        """Zwraca statystyki cache do monitoringu."""
+        lookups = self.hits + self.misses
+        return {
+            "enabled": config.CREDENTIAL_CACHE_ENABLED,
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "expirations": self.expirations,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+# Globalny cache procesu
+cache = CredentialCache(config.CREDENTIAL_CACHE_TTL, config.CREDENTIAL_CACHE_MAX_ENTRIES)
@@ -1,78 +1,87 @@
 # db.py
 # -*- coding: utf-8 -*-
 
+import json
 import sqlite3
 import logging
-from typing import Optional, List, Dict, Tuple
+import threading
+import zlib
+from collections import Counter
+from itertools import islice
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Optional, List, Dict, Tuple, Iterator
 from datetime import datetime
 
 # Importuj konfigurację i modele
 import config
 import models # Zakładamy, że modele są w models.py
+import migrations
+import archive # Skompresowane segmenty zdarzeń przeniesionych przez retencję
+import timestamps
+from db_pool import ConnectionPool
 
 log = logging.getLogger(__name__)
 
 # --- Funkcje Połączenia i Inicjalizacji ---
 
-def get_db() -> sqlite3.Connection:
-    """Zwraca połączenie do bazy SQLite z row_factory."""
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+
+def get_pool() -> ConnectionPool:
+    """Zwraca (tworząc leniwie) globalną pulę połączeń dla config.DATABASE_FILE."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    config.DATABASE_FILE,
+                    size=config.DB_POOL_SIZE,
+                    timeout=config.DB_POOL_TIMEOUT,
+                    busy_timeout=config.DB_BUSY_TIMEOUT,
+                    pragmas=config.DB_PRAGMAS,
+                )
+                log.info(f"DB Pool: Created pool for {config.DATABASE_FILE} (size={config.DB_POOL_SIZE}).")
+    return _pool
+
+def close_pool():
+    """Zamyka pulę połączeń (wywoływane przy zamykaniu serwera)."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+def get_pool_stats() -> Dict:
+    """Zwraca statystyki puli połączeń do monitoringu."""
+    return get_pool().stats()
+
+def open_dedicated_connection() -> sqlite3.Connection:
+    """Otwiera osobne połączenie spoza puli (te same pragmy), np. do obserwacji PRAGMA data_version."""
+    return get_pool().connect()
+
+@contextmanager
+def get_db() -> Iterator[sqlite3.Connection]:
+    """Wypożycza połączenie z puli (row_factory=Row, pragmy ustawione przy otwarciu).
+
+    Użycie: `with get_db() as conn:` - commit przy sukcesie, rollback przy wyjątku,
+    a na końcu połączenie wraca do puli zamiast być zamykane.
+    """
     try:
-        conn = sqlite3.connect(config.DATABASE_FILE, timeout=10)
-        conn.row_factory = sqlite3.Row
-        conn.execute("PRAGMA foreign_keys = ON;") # Włącz FK dla każdej sesji
-        return conn
+        pool = get_pool()
     except sqlite3.Error as e:
-        log.exception(f"DB Connection Error: Failed to connect to {config.DATABASE_FILE}: {e}")
-        raise # Rzuć wyjątek dalej, aby zatrzymać aplikację w razie problemów z DB
+        log.exception(f"DB Connection Error: Failed to create pool for {config.DATABASE_FILE}: {e}")
+        raise
+    with pool.connection() as conn:
+        yield conn
 
 def init_db():
-    """Inicjalizuje schemat bazy danych, jeśli tabele nie istnieją."""
+    """Doprowadza schemat bazy danych do bieżącej wersji (patrz migrations.py)."""
     log.info(f"DB Init: Checking schema in {config.DATABASE_FILE}...")
     try:
         with get_db() as conn: # Używamy context manager
-            cursor = conn.cursor()
-            # Włącz obsługę kluczy obcych (już w get_db, ale dla pewności)
-            cursor.execute("PRAGMA foreign_keys = ON;")
-
-            # Tabele (kolejność ma znaczenie ze względu na klucze obce)
-            cursor.execute(f"""
-                CREATE TABLE IF NOT EXISTS {config.TABLE_USERS} (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    username TEXT NOT NULL UNIQUE,
-                    hashed_password TEXT NOT NULL
-                )""")
-            cursor.execute(f"""
-                CREATE TABLE IF NOT EXISTS {config.TABLE_BARRIERS} (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    barrier_id TEXT NOT NULL UNIQUE,
-                    controller_url TEXT NOT NULL UNIQUE
-                )""")
-            cursor.execute(f"""
-                CREATE TABLE IF NOT EXISTS {config.TABLE_PERMISSIONS} (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    barrier_id TEXT NOT NULL,
-                    permission_level TEXT NOT NULL CHECK(permission_level IN ('operator', 'technician')),
-                    FOREIGN KEY (user_id) REFERENCES {config.TABLE_USERS} (id) ON DELETE CASCADE,
-                    FOREIGN KEY (barrier_id) REFERENCES {config.TABLE_BARRIERS} (barrier_id) ON DELETE CASCADE,
-                    UNIQUE(user_id, barrier_id)
-                )""")
-            cursor.execute(f"""
-                CREATE TABLE IF NOT EXISTS {config.TABLE_BARRIER_EVENTS} (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    barrier_id TEXT NOT NULL,
-                    event_type TEXT NOT NULL,
-                    trigger_method TEXT NOT NULL,
-                    event_timestamp TEXT NOT NULL, -- Oryginalny czas zdarzenia
-                    user_id TEXT,
-                    success INTEGER NOT NULL, -- 0 or 1
-                    details TEXT,
-                    failed_action TEXT,
-                    received_at TEXT NOT NULL -- Czas odebrania przez centralę
-                )""")
-
-            conn.commit()
-            log.info("DB Init: Schema verified/created successfully.")
+            version = migrations.migrate(conn)
+            log.info(f"DB Init: Schema verified at version {version}.")
     except sqlite3.Error as e:
         log.exception(f"DB Init Error: Failed to initialize database schema: {e}")
         raise # Zatrzymujemy aplikację, jeśli baza nie działa poprawnie przy starcie
@@ -81,22 +90,136 @@ def init_db():
 
 def add_event_to_db(event: models.BarrierEventDBInput, received_at: str) -> bool:
     """Zapisuje zdarzenie szlabanu do bazy danych."""
+    return add_events_to_db([(event, received_at)]) is not None
+
+# --- Agregaty Statystyk Zdarzeń ---
+
+EVENT_STATS_UPSERT_SQL = f"""INSERT INTO {config.TABLE_EVENT_STATS} (barrier_id, hour, event_type, trigger_method, success, count)
+                             VALUES (?,?,?,?,?,?)
+                             ON CONFLICT (barrier_id, hour, event_type, trigger_method, success)
+                             DO UPDATE SET count = count + excluded.count"""
+
+# Długość prefiksu kolumny hour ('RRRR-MM-DDTHH') dla każdej ziarnistości; 0 = jeden kubełek na cały zakres
+STATS_GRANULARITIES = {"hour": 13, "day": 10, "month": 7, "total": 0}
+
+def stats_hour(event_timestamp: Optional[str], received_at: str) -> str:
+    """Kubełek godzinowy zdarzenia ('RRRR-MM-DDTHH').
+
+    Liczy się czas zdarzenia z kontrolera (paczki wysłane z opóźnieniem trafiają do właściwej
+    godziny); gdy nie jest poprawnym ISO 8601 - czas odebrania przez centralę.
+    """
+    moment = timestamps.parse_event_time(event_timestamp, received_at)
+    return timestamps.to_local_naive(moment).strftime("%Y-%m-%dT%H")
+
+def get_event_stats_from_db(barrier_ids: Optional[List[str]] = None, since_hour: Optional[str] = None, until_hour: Optional[str] = None,
+                            granularity: str = "hour", event_type: Optional[str] = None,
+                            trigger_method: Optional[str] = None) -> Optional[List[sqlite3.Row]]:
+    """Sumy z tabeli agregatów: wiersz na (barrier_id, kubełek, event_type) z kolumnami total i failures.
+
+    Zakres godzin: since_hour włącznie, until_hour wyłącznie (format 'RRRR-MM-DDTHH').
+    Koszt zależy od liczby kubełków godzinowych w zakresie, a nie od liczby zdarzeń.
+    """
+    prefix = STATS_GRANULARITIES[granularity]
+    bucket = f"substr(hour, 1, {prefix})" if prefix else "'total'"
+    conditions = []
+    params: List = []
+    if barrier_ids is not None:
+        if not barrier_ids:
+            return []
+        conditions.append(f"barrier_id IN ({','.join('?' * len(barrier_ids))})")
+        params.extend(barrier_ids)
+    if since_hour is not None:
+        conditions.append("hour >= ?")
+        params.append(since_hour)
+    if until_hour is not None:
+        conditions.append("hour < ?")
+        params.append(until_hour)
+    if event_type is not None:
+        conditions.append("event_type = ?")
+        params.append(event_type)
+    if trigger_method is not None:
+        conditions.append("trigger_method = ?")
+        params.append(trigger_method)
+    sql_where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    sql = f"""SELECT barrier_id, {bucket} AS bucket, event_type,
+                     SUM(count) AS total, SUM(CASE WHEN success = 0 THEN count ELSE 0 END) AS failures
+              FROM {config.TABLE_EVENT_STATS} {sql_where}
+              GROUP BY barrier_id, bucket, event_type
+              ORDER BY barrier_id, bucket"""
+    try:
+        with get_db() as conn:
+            return conn.execute(sql, params).fetchall()
+    except sqlite3.Error as e:
+        log.error(f"DB Get Event Stats Error: {e}")
+        return None
+
+def rebuild_event_stats(include_archive: bool = True) -> int:
+    """Przelicza od zera tabelę agregatów z tabeli zdarzeń (i archiwum). Zwraca liczbę kubełków.
+
+    Jednorazowe narzędzie dla baz sprzed agregatów (patrz stats.py). Całość w jednej transakcji
+    BEGIN IMMEDIATE, więc równoległy zapis zdarzeń czeka na koniec i nic nie zostanie policzone podwójnie.
+    """
+    with get_db() as conn:
+        conn.create_function("stats_hour", 2, stats_hour, deterministic=True)
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute(f"DELETE FROM {config.TABLE_EVENT_STATS}")
+        conn.execute(f"""INSERT INTO {config.TABLE_EVENT_STATS} (barrier_id, hour, event_type, trigger_method, success, count)
+                         SELECT barrier_id, stats_hour(event_timestamp, received_at), event_type, trigger_method, success, COUNT(*)
+                         FROM {config.TABLE_BARRIER_EVENTS}
+                         GROUP BY 1, 2, 3, 4, 5""")
+        if include_archive:
+            # Wiersze zarchiwizowane, ale jeszcze nieusunięte przez retencję, są już policzone z tabeli
+            oldest_hot_id = conn.execute(f"SELECT MIN(id) FROM {config.TABLE_BARRIER_EVENTS}").fetchone()[0]
+            rollup = Counter(
+                (row["barrier_id"], stats_hour(row["event_timestamp"], row["received_at"]), row["event_type"], row["trigger_method"], row["success"])
+                for row in archive.iter_events(before_id=oldest_hot_id, descending=False)
+            )
+            conn.executemany(EVENT_STATS_UPSERT_SQL, [(*key, count) for key, count in rollup.items()])
+        buckets = conn.execute(f"SELECT COUNT(*) FROM {config.TABLE_EVENT_STATS}").fetchone()[0]
+        conn.commit()
+    log.info(f"DB Stats: Rebuilt event statistics ({buckets} buckets).")
+    return buckets
+
+def insert_events(events: List[Tuple[models.BarrierEventDBInput, str]]) -> List[int]:
+    """Zapisuje paczkę zdarzeń (zdarzenie, received_at) jednym executemany i jednym commitem.
+
+    Zwraca listę ID nadanych wierszom (w kolejności wejścia). Błędy (sqlite3.Error, ValueError
+    przy nieprawidłowym znaczniku czasu) przekazuje wywołującemu - writer zdarzeń odróżnia
+    w ten sposób zajętą bazę od wadliwego wiersza.
+    """
+    if not events:
+        return []
     sql = f"""INSERT INTO {config.TABLE_BARRIER_EVENTS}
-              (barrier_id, event_type, trigger_method, event_timestamp, user_id, success, details, failed_action, received_at)
-              VALUES (?,?,?,?,?,?,?,?,?)"""
-    params = (
-        event.barrier_id, event.event_type, event.trigger_method, event.timestamp,
-        event.user_id, 1 if event.success else 0, event.details, event.failed_action, received_at
+              (barrier_id, event_type, trigger_method, event_timestamp, user_id, success, details, failed_action, received_at,
+               event_ts_us, received_ts_us)
+              VALUES (?,?,?,?,?,?,?,?,?,?,?)"""
+    params = [
+        (event.barrier_id, event.event_type, event.trigger_method, event.timestamp,
+         event.user_id, 1 if event.success else 0, event.details, event.failed_action, received_at,
+         timestamps.event_time_us(event.timestamp, received_at), timestamps.iso_to_epoch_us(received_at))
+        for event, received_at in events
+    ]
+    rollup = Counter(
+        (event.barrier_id, stats_hour(event.timestamp, received_at), event.event_type, event.trigger_method, 1 if event.success else 0)
+        for event, received_at in events
     )
+    with get_db() as conn:
+        conn.executemany(sql, params)
+        # Trzymamy blokadę zapisu do commita, więc AUTOINCREMENT nadał kolejne ID
+        last_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+        # Agregaty w tej samej transakcji - statystyki zawsze zgodne z tabelą zdarzeń
+        conn.executemany(EVENT_STATS_UPSERT_SQL, [(*key, count) for key, count in rollup.items()])
+        conn.commit()
+    log.debug(f"Saved batch of {len(events)} events (last ID: {last_id}).")
+    return list(range(last_id - len(events) + 1, last_id + 1))
+
+def add_events_to_db(events: List[Tuple[models.BarrierEventDBInput, str]]) -> Optional[List[int]]:
+    """Jak insert_events, ale zwraca None w razie błędu bazy (błąd jest logowany)."""
     try:
-        with get_db() as conn:
-            conn.execute(sql, params)
-            conn.commit()
-        log.debug(f"Event from barrier '{event.barrier_id}' saved successfully.")
-        return True
+        return insert_events(events)
     except sqlite3.Error as e:
-        log.error(f"DB Event Save Error: Failed to save event for barrier '{event.barrier_id}'. Error: {e}")
-        return False
+        log.error(f"DB Event Save Error: Failed to save batch of {len(events)} events. Error: {e}")
+        return None
 
 def get_user_by_username(username: str) -> Optional[sqlite3.Row]:
     """Pobiera dane użytkownika na podstawie nazwy."""
@@ -147,6 +270,16 @@ def create_db_barrier(barrier_id: str, controller_url: str) -> Optional[int]:
         log.error(f"DB Barrier Create Error: Failed adding barrier '{barrier_id}'. Error: {e}")
         return None
 
+def barrier_exists(barrier_id: str, controller_url: Optional[str] = None) -> bool:
+    """Sprawdza, czy istnieje szlaban o danym ID (lub, opcjonalnie, o danym URL kontrolera)."""
+    sql = f"SELECT 1 FROM {config.TABLE_BARRIERS} WHERE barrier_id = ? OR controller_url = ?"
+    try:
+        with get_db() as conn:
+            return conn.execute(sql, (barrier_id, controller_url)).fetchone() is not None
+    except sqlite3.Error as e:
+        log.error(f"DB Barrier Exists Error: Barrier '{barrier_id}'. Error: {e}")
+        return False
+
 def grant_db_permission(user_id: int, barrier_id: str, permission_level: str) -> Tuple[Optional[int], str]:
     """Nadaje użytkownikowi uprawnienia do szlabanu."""
     # Sprawdzenie czy user i barrier istnieją może być pomocne, ale FK constraint powinien to załatwić
@@ -168,11 +301,10 @@ def grant_db_permission(user_id: int, barrier_id: str, permission_level: str) ->
         return permission_id, "ok"
     except sqlite3.IntegrityError as e:
         # Sprawdźmy, czy to błąd unikalności (już istnieje) czy błąd klucza obcego
-        conn_check = get_db()
-        cursor_check = conn_check.cursor()
-        cursor_check.execute(f"SELECT 1 FROM {config.TABLE_PERMISSIONS} WHERE user_id = ? AND barrier_id = ?", (user_id, barrier_id))
-        exists = cursor_check.fetchone()
-        conn_check.close()
+        with get_db() as conn_check:
+            cursor_check = conn_check.cursor()
+            cursor_check.execute(f"SELECT 1 FROM {config.TABLE_PERMISSIONS} WHERE user_id = ? AND barrier_id = ?", (user_id, barrier_id))
+            exists = cursor_check.fetchone()
         if exists:
             log.warning(f"DB Perm Grant Error: Permission already exists for user {user_id} on barrier '{barrier_id}'.")
             return None, "permission_exists"
@@ -184,6 +316,138 @@ def grant_db_permission(user_id: int, barrier_id: str, permission_level: str) ->
         log.error(f"DB Perm Grant Error: User {user_id}, Barrier '{barrier_id}'. Error: {e}")
         return None, "db_error"
 
+# --- Operacje Masowe (provisioning) ---
+# Każda funkcja działa w jednej transakcji BEGIN IMMEDIATE: istniejące wiersze odczytujemy
+# jednym zapytaniem (lista wartości jako parametr JSON, bez limitu liczby parametrów SQLite),
+# a nowe wstawiamy jednym executemany. Wynik to lista (status, id) w kolejności wejścia:
+# "created" / "conflict" / "user_not_found" / "barrier_not_found".
+
+BulkResult = Tuple[str, Optional[int]]
+
+def _select_existing(conn: sqlite3.Connection, sql: str, values: List) -> List[sqlite3.Row]:
+    """Wykonuje zapytanie z `IN (SELECT value FROM json_each(?))` dla listy wartości."""
+    return conn.execute(sql, (json.dumps(values),)).fetchall()
+
+def get_existing_usernames(usernames: List[str]) -> Optional[set]:
+    """Zwraca zbiór nazw użytkowników, które już istnieją (wstępna selekcja przed hashowaniem haseł)."""
+    sql = f"SELECT username FROM {config.TABLE_USERS} WHERE username IN (SELECT value FROM json_each(?))"
+    try:
+        with get_db() as conn:
+            return {row['username'] for row in _select_existing(conn, sql, usernames)}
+    except sqlite3.Error as e:
+        log.error(f"DB Get Existing Users Error: {e}")
+        return None
+
+def create_db_users_bulk(users: List[Tuple[str, str]]) -> Optional[List[BulkResult]]:
+    """Tworzy wielu użytkowników (username, hashed_password). Duplikaty w paczce: wygrywa pierwszy."""
+    usernames = [username for username, _ in users]
+    try:
+        with get_db() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            taken = {row['username'] for row in _select_existing(
+                conn, f"SELECT username FROM {config.TABLE_USERS} WHERE username IN (SELECT value FROM json_each(?))", usernames)}
+            to_insert = []
+            for username, hashed_password in users:
+                if username not in taken:
+                    taken.add(username)
+                    to_insert.append((username, hashed_password))
+            conn.executemany(f"INSERT INTO {config.TABLE_USERS} (username, hashed_password) VALUES (?, ?)", to_insert)
+            new_ids = {row['username']: row['id'] for row in _select_existing(
+                conn, f"SELECT id, username FROM {config.TABLE_USERS} WHERE username IN (SELECT value FROM json_each(?))",
+                [username for username, _ in to_insert])}
+            conn.commit()
+    except sqlite3.Error as e:
+        log.error(f"DB Bulk User Create Error: Failed creating {len(users)} users. Error: {e}")
+        return None
+
+    results: List[BulkResult] = []
+    for username in usernames:
+        user_id = new_ids.pop(username, None) # pop: kolejne wystąpienie tej samej nazwy to konflikt
+        results.append(("created", user_id) if user_id is not None else ("conflict", None))
+    log.info(f"Bulk created {len(to_insert)} users ({len(users) - len(to_insert)} conflicts).")
+    return results
+
+def create_db_barriers_bulk(barriers: List[Tuple[str, str]]) -> Optional[List[BulkResult]]:
+    """Dodaje wiele szlabanów (barrier_id, controller_url). Konflikt: zajęte ID lub URL (także w samej paczce)."""
+    try:
+        with get_db() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            taken_ids = {row['barrier_id'] for row in _select_existing(
+                conn, f"SELECT barrier_id FROM {config.TABLE_BARRIERS} WHERE barrier_id IN (SELECT value FROM json_each(?))",
+                [barrier_id for barrier_id, _ in barriers])}
+            taken_urls = {row['controller_url'] for row in _select_existing(
+                conn, f"SELECT controller_url FROM {config.TABLE_BARRIERS} WHERE controller_url IN (SELECT value FROM json_each(?))",
+                [url for _, url in barriers])}
+            to_insert = []
+            accepted = []
+            for barrier_id, controller_url in barriers:
+                ok = barrier_id not in taken_ids and controller_url not in taken_urls
+                accepted.append(ok)
+                if ok:
+                    taken_ids.add(barrier_id)
+                    taken_urls.add(controller_url)
+                    to_insert.append((barrier_id, controller_url))
+            conn.executemany(f"INSERT INTO {config.TABLE_BARRIERS} (barrier_id, controller_url) VALUES (?, ?)", to_insert)
+            new_ids = {row['barrier_id']: row['id'] for row in _select_existing(
+                conn, f"SELECT id, barrier_id FROM {config.TABLE_BARRIERS} WHERE barrier_id IN (SELECT value FROM json_each(?))",
+                [barrier_id for barrier_id, _ in to_insert])}
+            conn.commit()
+    except sqlite3.Error as e:
+        log.error(f"DB Bulk Barrier Create Error: Failed adding {len(barriers)} barriers. Error: {e}")
+        return None
+
+    results = [("created", new_ids[barrier_id]) if ok else ("conflict", None)
+               for (barrier_id, _), ok in zip(barriers, accepted)]
+    log.info(f"Bulk added {len(to_insert)} barriers ({len(barriers) - len(to_insert)} conflicts).")
+    return results
+
+def grant_db_permissions_bulk(grants: List[Tuple[str, str, str]]) -> Optional[Tuple[List[BulkResult], Dict[str, int]]]:
+    """Nadaje wiele uprawnień (username, barrier_id, permission_level).
+
+    Zwraca (wyniki, mapa username -> user_id dla znalezionych użytkowników).
+    """
+    try:
+        with get_db() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            user_ids = {row['username']: row['id'] for row in _select_existing(
+                conn, f"SELECT id, username FROM {config.TABLE_USERS} WHERE username IN (SELECT value FROM json_each(?))",
+                [username for username, _, _ in grants])}
+            barriers = {row['barrier_id'] for row in _select_existing(
+                conn, f"SELECT barrier_id FROM {config.TABLE_BARRIERS} WHERE barrier_id IN (SELECT value FROM json_each(?))",
+                [barrier_id for _, barrier_id, _ in grants])}
+            taken = {(row['user_id'], row['barrier_id']) for row in _select_existing(
+                conn, f"SELECT user_id, barrier_id FROM {config.TABLE_PERMISSIONS} WHERE user_id IN (SELECT value FROM json_each(?))",
+                list(user_ids.values()))}
+
+            statuses = []
+            to_insert = []
+            for username, barrier_id, level in grants:
+                user_id = user_ids.get(username)
+                if user_id is None:
+                    statuses.append("user_not_found")
+                elif barrier_id not in barriers:
+                    statuses.append("barrier_not_found")
+                elif (user_id, barrier_id) in taken:
+                    statuses.append("conflict")
+                else:
+                    taken.add((user_id, barrier_id))
+                    statuses.append("created")
+                    to_insert.append((user_id, barrier_id, level))
+            conn.executemany(f"INSERT INTO {config.TABLE_PERMISSIONS} (user_id, barrier_id, permission_level) VALUES (?, ?, ?)", to_insert)
+            new_ids = {(row['user_id'], row['barrier_id']): row['id'] for row in _select_existing(
+                conn, f"SELECT id, user_id, barrier_id FROM {config.TABLE_PERMISSIONS} WHERE user_id IN (SELECT value FROM json_each(?))",
+                sorted({user_id for user_id, _, _ in to_insert}))}
+            conn.commit()
+    except sqlite3.Error as e:
+        log.error(f"DB Bulk Perm Grant Error: Failed granting {len(grants)} permissions. Error: {e}")
+        return None
+
+    results: List[BulkResult] = []
+    for (username, barrier_id, _), result_status in zip(grants, statuses):
+        results.append((result_status, new_ids.get((user_ids[username], barrier_id)) if result_status == "created" else None))
+    log.info(f"Bulk granted {len(to_insert)} permissions ({len(grants) - len(to_insert)} rejected).")
+    return results, user_ids
+
 def get_db_permission_level(user_id: int, barrier_id: str) -> Optional[str]:
     """Pobiera poziom uprawnień użytkownika do danego szlabanu."""
     sql = f"SELECT permission_level FROM {config.TABLE_PERMISSIONS} WHERE user_id = ? AND barrier_id = ?"
@@ -210,6 +474,36 @@ def get_barrier_controller_url(barrier_id: str) -> Optional[str]:
         log.error(f"DB Get Barrier URL Error: Barrier '{barrier_id}'. Error: {e}")
         return None
 
+def get_command_authorization(username: str, barrier_ids: List[str]) -> Optional[List[sqlite3.Row]]:
+    """Użytkownik, jego poziom uprawnień i URL kontrolera dla listy szlabanów - jednym zapytaniem (ścieżka poleceń).
+
+    Zwraca po jednym wierszu (id, username, hashed_password, token_generation, barrier_id,
+    permission_level, controller_url) na szlaban; permission_level / controller_url są NULL przy braku uprawnienia
+    lub szlabanu. Pusta lista - użytkownik nie istnieje; None - błąd bazy. Każde złączenie trafia w indeks unikalny.
+    """
+    sql = f"""SELECT u.id, u.username, u.hashed_password, u.token_generation, j.value AS barrier_id, p.permission_level, b.controller_url
+              FROM {config.TABLE_USERS} u
+              CROSS JOIN json_each(?) j
+              LEFT JOIN {config.TABLE_PERMISSIONS} p ON p.user_id = u.id AND p.barrier_id = j.value
+              LEFT JOIN {config.TABLE_BARRIERS} b ON b.barrier_id = j.value
+              WHERE u.username = ?"""
+    try:
+        with get_db() as conn:
+            return conn.execute(sql, (json.dumps(barrier_ids), username)).fetchall()
+    except sqlite3.Error as e:
+        log.error(f"DB Get Command Authorization Error: User '{username}', {len(barrier_ids)} barriers. Error: {e}")
+        return None
+
+def get_barrier_controller_urls() -> Dict[str, str]:
+    """Pobiera {barrier_id: controller_url} wszystkich zarejestrowanych szlabanów."""
+    sql = f"SELECT barrier_id, controller_url FROM {config.TABLE_BARRIERS}"
+    try:
+        with get_db() as conn:
+            return {row['barrier_id']: row['controller_url'] for row in conn.execute(sql)}
+    except sqlite3.Error as e:
+        log.error(f"DB Get Barrier URLs Error: {e}")
+        return {}
+
 def get_user_authorized_barrier_ids(user_id: int) -> List[str]:
     """Pobiera listę ID szlabanów, do których użytkownik ma dostęp."""
     sql = f"SELECT barrier_id FROM {config.TABLE_PERMISSIONS} WHERE user_id = ?"
@@ -243,6 +537,112 @@ def get_user_authorized_barriers_details(user_id: int) -> List[Dict]:
         log.error(f"DB Get Auth Barrier Details Error: User {user_id}. Error: {e}")
         return [] # Zwróć pustą listę w razie błędu
 
+def get_oldest_events(limit: int) -> List[Tuple]:
+    """Pobiera `limit` najstarszych (po id) zdarzeń jako krotki w kolejności EVENT_COLUMNS (dla retencji)."""
+    sql = f"SELECT {EVENT_COLUMNS} FROM {config.TABLE_BARRIER_EVENTS} ORDER BY id LIMIT ?"
+    with get_db() as conn:
+        return [tuple(row) for row in conn.execute(sql, (limit,))]
+
+def delete_events_up_to(max_id: int) -> int:
+    """Usuwa zdarzenia o id <= max_id (krótka transakcja zapisu). Zwraca liczbę usuniętych wierszy."""
+    sql = f"DELETE FROM {config.TABLE_BARRIER_EVENTS} WHERE id <= ?"
+    with get_db() as conn:
+        deleted = conn.execute(sql, (max_id,)).rowcount
+        conn.commit()
+    return deleted
+
+def get_storage_stats() -> Dict[str, int]:
+    """Zwraca rozmiar pliku bazy w stronach (page_size, page_count, freelist_count, auto_vacuum)."""
+    with get_db() as conn:
+        return {name: conn.execute(f"PRAGMA {name}").fetchone()[0]
+                for name in ("page_size", "page_count", "freelist_count", "auto_vacuum")}
+
+def incremental_vacuum(pages: int = 0):
+    """Zwraca wolne strony do systemu plików (tylko przy auto_vacuum=INCREMENTAL; 0 = wszystkie)."""
+    with get_db() as conn:
+        # executescript wykonuje pragmę do końca (execute zwalnia po jednej stronie na krok)
+        conn.executescript(f"PRAGMA incremental_vacuum({int(pages)});")
+
+def get_server_secret(name: str) -> Optional[bytes]:
+    """Pobiera sekret serwera (np. klucz podpisu tokenów) z bazy."""
+    try:
+        with get_db() as conn:
+            row = conn.execute(f"SELECT value FROM {config.TABLE_SERVER_SECRETS} WHERE name = ?", (name,)).fetchone()
+        return bytes(row['value']) if row else None
+    except sqlite3.Error as e:
+        log.error(f"DB Get Secret Error: '{name}'. Error: {e}")
+        return None
+
+def get_token_state_generation(conn: sqlite3.Connection) -> int:
+    """Zwraca licznik zmian stanu tokenów (zwiększany triggerami, patrz migrations.py)."""
+    row = conn.execute(f"SELECT generation FROM {config.TABLE_TOKEN_STATE_GENERATION} WHERE id = 1").fetchone()
+    return row[0] if row else 0
+
+def load_token_state(now: int) -> Optional[Tuple[Dict[int, int], Dict[int, int], int]]:
+    """Generacje tokenów użytkowników {user_id: generacja}, nie wygasłe odwołania {jti: exp} i licznik stanu tokenów
+    (jedna transakcja) albo None."""
+    try:
+        with get_db() as conn:
+            conn.execute("BEGIN")
+            state_generation = get_token_state_generation(conn)
+            generations = {row[0]: row[1] for row in conn.execute(f"SELECT id, token_generation FROM {config.TABLE_USERS}")}
+            revoked = {int(row[0]): row[1] for row in conn.execute(
+                f"SELECT jti, expires_at FROM {config.TABLE_TOKEN_REVOCATIONS} WHERE expires_at > ?", (now,))}
+            conn.commit()
+        return generations, revoked, state_generation
+    except sqlite3.Error as e:
+        log.error(f"DB Load Token State Error: {e}")
+        return None
+
+def add_token_revocation(jti: int, expires_at: int, now: int) -> bool:
+    """Zapisuje odwołany token (do jego wygaśnięcia) i usuwa odwołania już wygasłych tokenów."""
+    try:
+        with get_db() as conn:
+            conn.execute(f"DELETE FROM {config.TABLE_TOKEN_REVOCATIONS} WHERE expires_at <= ?", (now,))
+            conn.execute(f"INSERT OR IGNORE INTO {config.TABLE_TOKEN_REVOCATIONS} (jti, expires_at) VALUES (?, ?)",
+                         (str(jti), expires_at)) # jti to 64 bity bez znaku - poza zakresem INTEGER SQLite
+            conn.commit()
+        return True
+    except sqlite3.Error as e:
+        log.error(f"DB Token Revocation Error: {e}")
+        return False
+
+def bump_token_generation(user_id: int) -> Optional[int]:
+    """Zwiększa generację tokenów użytkownika (unieważnia wszystkie wydane). Zwraca nową generację albo None."""
+    try:
+        with get_db() as conn:
+            conn.execute(f"UPDATE {config.TABLE_USERS} SET token_generation = token_generation + 1 WHERE id = ?", (user_id,))
+            row = conn.execute(f"SELECT token_generation FROM {config.TABLE_USERS} WHERE id = ?", (user_id,)).fetchone()
+            conn.commit()
+        return row[0] if row else None
+    except sqlite3.Error as e:
+        log.error(f"DB Token Generation Error: User ID {user_id}. Error: {e}")
+        return None
+
+def get_authz_generation(conn: sqlite3.Connection) -> int:
+    """Zwraca licznik zmian danych autoryzacyjnych (zwiększany triggerami, patrz migrations.py)."""
+    row = conn.execute(f"SELECT generation FROM {config.TABLE_AUTHZ_GENERATION} WHERE id = 1").fetchone()
+    return row[0] if row else 0
+
+def load_authorization_snapshot() -> Optional[Tuple[List[Tuple[int, str, str]], Dict[str, str], int]]:
+    """Wczytuje spójny (jedna transakcja) obraz uprawnień i URL-i kontrolerów dla cache autoryzacji.
+
+    Zwraca (lista (user_id, barrier_id, permission_level), {barrier_id: controller_url}, generacja) lub None.
+    """
+    try:
+        with get_db() as conn:
+            conn.execute("BEGIN") # Jeden snapshot odczytu dla wszystkich zapytań
+            generation = get_authz_generation(conn)
+            permissions = [tuple(row) for row in conn.execute(
+                f"SELECT user_id, barrier_id, permission_level FROM {config.TABLE_PERMISSIONS}")]
+            urls = {row['barrier_id']: row['controller_url'] for row in conn.execute(
+                f"SELECT barrier_id, controller_url FROM {config.TABLE_BARRIERS}")}
+            conn.commit()
+        return permissions, urls, generation
+    except sqlite3.Error as e:
+        log.error(f"DB Load Authz Snapshot Error: {e}")
+        return None
+
 def _map_event_row_to_dict(row: sqlite3.Row) -> Dict:
     """Pomocnik do konwersji wiersza zdarzenia z bazy na słownik zgodny z modelem."""
     if not row:
@@ -255,41 +655,346 @@ def _map_event_row_to_dict(row: sqlite3.Row) -> Dict:
          event_dict['success'] = bool(event_dict['success']) # Konwersja 0/1 na False/True
     return event_dict
 
-def get_events_from_db(barrier_ids: Optional[List[str]] = None, limit: int = config.DEFAULT_EVENT_LIMIT, only_failures: bool = False) -> Optional[List[Dict]]:
-    """Pobiera zdarzenia z bazy, opcjonalnie filtrując po ID szlabanów i awariach."""
-    if barrier_ids is not None and not barrier_ids:
-        return [] # Pusta lista ID = brak wyników, nie błąd
+# Kolumny zwracane przez API (bez kolumn technicznych dodawanych migracjami)
+EVENT_COLUMNS = "id, barrier_id, event_type, trigger_method, event_timestamp, user_id, success, details, failed_action, received_at"
 
-    # Walidacja i ograniczenie limitu
-    if not (1 <= limit <= config.MAX_EVENT_LIMIT):
-        limit = config.DEFAULT_EVENT_LIMIT
-        log.warning(f"Invalid limit provided. Using default limit: {limit}")
+@dataclass(frozen=True)
+class EventFilters:
+    """Dodatkowe filtry zdarzeń (poza szlabanami, awariami i paginacją po id).
+
+    Zakres czasu dotyczy czasu zdarzenia (kolumna event_ts_us): since_us włącznie, until_us wyłącznie.
+    """
+    since_us: Optional[int] = None
+    until_us: Optional[int] = None
+    event_type: Optional[str] = None
+    trigger_method: Optional[str] = None
+    user_id: Optional[str] = None
 
+    def matches(self, event: Dict) -> bool:
+        """Sprawdza zdarzenie spoza tabeli (np. z archiwum, bez kolumn *_ts_us)."""
+        if self.event_type is not None and event["event_type"] != self.event_type:
+            return False
+        if self.trigger_method is not None and event["trigger_method"] != self.trigger_method:
+            return False
+        if self.user_id is not None and event["user_id"] != self.user_id:
+            return False
+        if self.since_us is not None or self.until_us is not None:
+            event_us = timestamps.event_time_us(event["event_timestamp"], event["received_at"])
+            if self.since_us is not None and event_us < self.since_us:
+                return False
+            if self.until_us is not None and event_us >= self.until_us:
+                return False
+        return True
+
+def _choose_event_index(barrier_ids: Optional[List[str]], only_failures: bool, filters: Optional[EventFilters]) -> Optional[str]:
+    """Wybiera indeks dla kombinacji filtrów (wymuszany przez INDEXED BY; None = plan SQLite).
+
+    Wyniki są zawsze sortowane po id, więc bez wąskiego zakresu czasu najtańszy jest indeks
+    (barrier_id, id) - skan od najnowszych kończy się po `limit` trafieniach. Przy wąskim
+    zakresie (do EVENT_TIME_INDEX_MAX_SPAN) lepiej przeczytać sam zakres indeksu czasu
+    i posortować niewiele wierszy, niż przeskakiwać wszystko, co nowsze.
+    """
+    if filters is not None and filters.user_id is not None:
+        return "idx_events_user" # Zdarzenia jednej osoby - najbardziej selektywny filtr
+    if filters is not None and filters.since_us is not None:
+        until_us = filters.until_us if filters.until_us is not None else timestamps.to_epoch_us(datetime.now())
+        if until_us - filters.since_us <= config.EVENT_TIME_INDEX_MAX_SPAN * 1_000_000:
+            if barrier_ids is None:
+                return "idx_events_time"
+            return "idx_events_failures_time" if only_failures else "idx_events_barrier_time"
+    if barrier_ids is not None:
+        return "idx_events_failures" if only_failures else "idx_events_barrier_id"
+    return None
+
+def _use_feed_scan(conn: sqlite3.Connection, barrier_ids: Optional[List[str]], only_failures: bool,
+                   before_id: Optional[int], after_id: Optional[int], filters: Optional[EventFilters], limit: int) -> bool:
+    """Planer strony zdarzeń wielu szlabanów (od najnowszych): IN po indeksie (barrier_id, id) albo skan najnowszych id.
 
+    IN: SQLite schodzi indeksem osobno do każdego szlabanu i scala zakresy (koszt rośnie z liczbą szlabanów).
+    Skan: czyta zdarzenia od najnowszego id i sprawdza przynależność szlabanu do listy, aż zbierze `limit` -
+    przy równomiernym ruchu to ok. limit * wszystkie_szlabany / wybrane wierszy, więc opłaca się dla dużych list
+    (technik z setkami szlabanów). Jedno zejście IN kosztuje tyle, co EVENT_FEED_SEEK_ROWS wierszy skanu.
+    """
+    if barrier_ids is None or len(barrier_ids) < 2 or (after_id is not None and before_id is None):
+        return False
+    if _choose_event_index(barrier_ids, only_failures, filters) not in ("idx_events_barrier_id", "idx_events_failures"):
+        return False # Filtry czasu / osoby mają własne, węższe indeksy
+    plan = config.EVENT_FEED_PLAN
+    if plan != "auto":
+        return plan == "scan"
+    selected = len(set(barrier_ids))
+    total = conn.execute(f"SELECT COUNT(*) FROM {config.TABLE_BARRIERS}").fetchone()[0]
+    return limit * max(total, selected) < selected * selected * config.EVENT_FEED_SEEK_ROWS
+
+def _build_events_query(barrier_ids: Optional[List[str]], only_failures: bool,
+                        before_id: Optional[int], after_id: Optional[int],
+                        filters: Optional[EventFilters] = None, feed_scan: bool = False) -> Tuple[str, str, List, str]:
+    """Buduje źródło (tabela z INDEXED BY), klauzulę WHERE, parametry i kierunek sortowania dla zapytań o zdarzenia.
+
+    Paginacja po kluczu (keyset): before_id -> starsze (id < before_id, malejąco),
+    samo after_id -> nowsze (id > after_id, rosnąco, do "doganiania" strumienia).
+    `feed_scan` (z _use_feed_scan): skan od najnowszych id zamiast indeksu (barrier_id, id).
+    """
     params = []
     sql_where_parts = []
 
     if barrier_ids is not None:
         # Zabezpieczenie przed SQL Injection (chociaż tu parametryzujemy)
         safe_barrier_ids = [str(bid) for bid in barrier_ids]
-        placeholders = ','.join('?' * len(safe_barrier_ids))
-        sql_where_parts.append(f"barrier_id IN ({placeholders})")
-        params.extend(safe_barrier_ids)
+        if feed_scan:
+            # Lista jako jedna tablica tymczasowa (json_each) - sprawdzenie szlabanu przy każdym wierszu skanu
+            sql_where_parts.append("barrier_id IN (SELECT value FROM json_each(?))")
+            params.append(json.dumps(safe_barrier_ids))
+        else:
+            placeholders = ','.join('?' * len(safe_barrier_ids))
+            sql_where_parts.append(f"barrier_id IN ({placeholders})")
+            params.extend(safe_barrier_ids)
 
     if only_failures:
         sql_where_parts.append("success = 0") # 0 oznacza false w bazie
 
+    if filters is not None:
+        for column, value in (("event_type", filters.event_type), ("trigger_method", filters.trigger_method),
+                              ("user_id", filters.user_id)):
+            if value is not None:
+                sql_where_parts.append(f"{column} = ?")
+                params.append(value)
+        if filters.since_us is not None:
+            sql_where_parts.append("event_ts_us >= ?")
+            params.append(int(filters.since_us))
+        if filters.until_us is not None:
+            sql_where_parts.append("event_ts_us < ?")
+            params.append(int(filters.until_us))
+
+    if before_id is not None:
+        sql_where_parts.append("id < ?")
+        params.append(int(before_id))
+    if after_id is not None:
+        sql_where_parts.append("id > ?")
+        params.append(int(after_id))
+
+    if feed_scan:
+        # Klucz główny od najnowszych (awarie: mały indeks częściowy (id, barrier_id))
+        source = (f"{config.TABLE_BARRIER_EVENTS} INDEXED BY idx_events_failures_feed" if only_failures
+                  else f"{config.TABLE_BARRIER_EVENTS} NOT INDEXED")
+    else:
+        index = _choose_event_index(barrier_ids, only_failures, filters)
+        source = f"{config.TABLE_BARRIER_EVENTS} INDEXED BY {index}" if index else config.TABLE_BARRIER_EVENTS
     sql_where = f"WHERE {' AND '.join(sql_where_parts)}" if sql_where_parts else ""
-    sql = f"SELECT * FROM {config.TABLE_BARRIER_EVENTS} {sql_where} ORDER BY id DESC LIMIT ?"
-    params.append(limit)
+    order = "ASC" if after_id is not None and before_id is None else "DESC"
+    return source, sql_where, params, order
+
+def _select_event_rows(conn: sqlite3.Connection, barrier_ids: Optional[List[str]], limit: int, only_failures: bool,
+                       before_id: Optional[int], after_id: Optional[int],
+                       filters: Optional[EventFilters]) -> Tuple[List[sqlite3.Row], str]:
+    """Wiersze jednej strony zdarzeń (plan z _use_feed_scan) i kierunek sortowania."""
+    def select(feed_scan: bool, before: Optional[int], after: Optional[int], count: int) -> Tuple[List[sqlite3.Row], str]:
+        source, sql_where, params, order = _build_events_query(barrier_ids, only_failures, before, after, filters, feed_scan)
+        sql = f"SELECT {EVENT_COLUMNS} FROM {source} {sql_where} ORDER BY id {order} LIMIT ?"
+        params.append(count)
+        return conn.execute(sql, params).fetchall(), order
+
+    if not _use_feed_scan(conn, barrier_ids, only_failures, before_id, after_id, filters, limit):
+        return select(False, before_id, after_id, limit)
+
+    # Skan tylko okna najnowszych id wartego tyle, co plan IN - gdy wybrane szlabany są akurat rzadkie,
+    # starszą część strony dobiera plan IN (bez ryzyka przeczytania całej tabeli)
+    upper = before_id if before_id is not None else conn.execute(
+        f"SELECT COALESCE(MAX(id), 0) + 1 FROM {config.TABLE_BARRIER_EVENTS}").fetchone()[0]
+    lower = max(upper - len(set(barrier_ids)) * config.EVENT_FEED_SEEK_ROWS, after_id or 0)
+    rows, order = select(True, upper, lower, limit)
+    if len(rows) < limit and lower > (after_id or 0):
+        rows += select(False, lower + 1, after_id, limit - len(rows))[0]
+    return rows, order
+
+def get_events_from_db(barrier_ids: Optional[List[str]] = None, limit: int = config.DEFAULT_EVENT_LIMIT, only_failures: bool = False,
+                       before_id: Optional[int] = None, after_id: Optional[int] = None,
+                       filters: Optional[EventFilters] = None) -> Optional[List[Dict]]:
+    """Pobiera zdarzenia z bazy, opcjonalnie filtrując po ID szlabanów, awariach i EventFilters (z paginacją po ID)."""
+    if barrier_ids is not None and not barrier_ids:
+        return [] # Pusta lista ID = brak wyników, nie błąd
+
+    # Walidacja i ograniczenie limitu
+    if not (1 <= limit <= config.MAX_EVENT_LIMIT):
+        limit = config.DEFAULT_EVENT_LIMIT
+        log.warning(f"Invalid limit provided. Using default limit: {limit}")
 
     try:
         with get_db() as conn:
-            cursor = conn.cursor()
-            cursor.execute(sql, params)
-            rows = cursor.fetchall()
+            rows, order = _select_event_rows(conn, barrier_ids, limit, only_failures, before_id, after_id, filters)
         # Użyj _map_event_row_to_dict do konwersji każdego wiersza
-        return [_map_event_row_to_dict(row) for row in rows]
+        events = [_map_event_row_to_dict(row) for row in rows]
+    except sqlite3.Error as e:
+        log.error(f"DB Read Events Error: Failed fetching events. Filter: barrier_ids={barrier_ids}, only_failures={only_failures}, filters={filters}. Error: {e}")
+        return None # Zwróć None w przypadku błędu odczytu z bazy
+
+    if len(events) < limit:
+        # Zapytanie sięga poza gorące okno - dobierz starsze zdarzenia z archiwum
+        events = _extend_with_archived_events(events, limit, barrier_ids, only_failures, before_id, after_id, order, filters)
+    return events
+
+def _archived_events(barrier_ids: Optional[List[str]], only_failures: bool, before_id: Optional[int],
+                     after_id: Optional[int], descending: bool, filters: Optional[EventFilters] = None) -> Iterator[Dict]:
+    """Zdarzenia z archiwum w formacie API (leniwie)."""
+    for event in archive.iter_events(barrier_ids=barrier_ids, before_id=before_id, after_id=after_id,
+                                     only_failures=only_failures, descending=descending):
+        if filters is None or filters.matches(event):
+            yield _map_event_row_to_dict(event)
+
+def _extend_with_archived_events(events: List[Dict], limit: int, barrier_ids: Optional[List[str]], only_failures: bool,
+                                 before_id: Optional[int], after_id: Optional[int], order: str,
+                                 filters: Optional[EventFilters] = None) -> List[Dict]:
+    """Uzupełnia stronę zdarzeniami z archiwum (wszystkie zarchiwizowane id są mniejsze niż id w tabeli)."""
+    try:
+        if order == "DESC":
+            # Archiwum kontynuuje stronę poniżej najstarszego zwróconego zdarzenia
+            lower_before = events[-1]['id'] if events else before_id
+            archived = _archived_events(barrier_ids, only_failures, lower_before, after_id, True, filters)
+            return events + list(islice(archived, limit - len(events)))
+        # Rosnąco: zarchiwizowane (starsze) zdarzenia idą przed tymi z tabeli
+        max_archived = archive.max_archived_id()
+        if max_archived is None or after_id >= max_archived:
+            return events
+        archived = list(islice(_archived_events(barrier_ids, only_failures, None, after_id, False, filters), limit))
+        return archived + events[:limit - len(archived)]
+    except (OSError, ValueError, zlib.error) as e:
+        log.error(f"Archive Read Error: Failed reading archived events. Error: {e}")
+        return events
+
+def iter_event_batches_from_db(barrier_ids: Optional[List[str]] = None, only_failures: bool = False,
+                               before_id: Optional[int] = None, after_id: Optional[int] = None,
+                               limit: Optional[int] = None, batch_size: int = config.EVENT_STREAM_BATCH_SIZE,
+                               filters: Optional[EventFilters] = None) -> Iterator[List[Dict]]:
+    """Generator paczek zdarzeń do eksportu strumieniowego (stała pamięć, bez limitu MAX_EVENT_LIMIT).
+
+    Każda paczka to osobne, krótkie zapytanie keyset (id < ostatnie / id > ostatnie) na połączeniu
+    wziętym z puli tylko na czas tego zapytania - wolny klient nie trzyma połączenia ani migawki
+    odczytu (która blokowałaby checkpointy WAL) między paczkami. Zdarzenia zapisane w trakcie
+    eksportu malejącego nie trafiają do niego (są nowsze niż pierwsza paczka).
+    Błędy bazy są propagowane jako sqlite3.Error.
+    """
+    if barrier_ids is not None and not barrier_ids:
+        return
+
+    descending = not (after_id is not None and before_id is None)
+    last_id = None
+    if not descending:
+        # Rosnąco: najpierw starsze zdarzenia z archiwum
+        for batch in _archived_event_batches(barrier_ids, only_failures, None, after_id, False, limit, batch_size, filters):
+            if limit is not None:
+                limit -= len(batch)
+            yield batch
+
+    while limit is None or limit > 0:
+        count = batch_size if limit is None else min(batch_size, limit)
+        if descending:
+            page_before, page_after = (last_id if last_id is not None else before_id), after_id
+        else:
+            page_before, page_after = None, (last_id if last_id is not None else after_id)
+        source, sql_where, params, order = _build_events_query(barrier_ids, only_failures, page_before, page_after, filters)
+        params.append(count)
+        with get_db() as conn:
+            rows = conn.execute(f"SELECT {EVENT_COLUMNS} FROM {source} {sql_where} ORDER BY id {order} LIMIT ?", params).fetchall()
+        if not rows:
+            break
+        batch = [_map_event_row_to_dict(row) for row in rows]
+        last_id = batch[-1]['id']
+        if limit is not None:
+            limit -= len(batch)
+        yield batch
+        if len(rows) < count:
+            break
+
+    if descending and (limit is None or limit > 0):
+        # Malejąco: po wyczerpaniu tabeli kontynuuj w archiwum
+        yield from _archived_event_batches(barrier_ids, only_failures, last_id if last_id is not None else before_id,
+                                           after_id, True, limit, batch_size, filters)
+
+def _archived_event_batches(barrier_ids: Optional[List[str]], only_failures: bool, before_id: Optional[int],
+                            after_id: Optional[int], descending: bool, limit: Optional[int], batch_size: int,
+                            filters: Optional[EventFilters] = None) -> Iterator[List[Dict]]:
+    """Paczki zdarzeń z archiwum dla eksportu strumieniowego."""
+    events = _archived_events(barrier_ids, only_failures, before_id, after_id, descending, filters)
+    if limit is not None:
+        events = islice(events, limit)
+    try:
+        while True:
+            batch = list(islice(events, batch_size))
+            if not batch:
+                break
+            yield batch
+    except (OSError, ValueError, zlib.error) as e:
+        log.error(f"Archive Read Error: Export of archived events aborted. Error: {e}")
+
+# --- Ostatnie Zdarzenia (bufory w pamięci, recent_events.py) ---
+# Kolumny w kolejności kluczy słownika z _map_event_row_to_dict (timestamp na końcu)
+RECENT_EVENT_COLUMNS = "id, barrier_id, event_type, trigger_method, user_id, success, details, failed_action, received_at, event_timestamp"
+
+def load_recent_event_rows(per_barrier: int) -> Optional[Tuple[List[sqlite3.Row], int]]:
+    """Najnowsze `per_barrier` zdarzeń każdego szlabanu z tabeli oraz największe ID w chwili odczytu.
+
+    ID szlabanów zbierane są rekurencyjnym przeskakiwaniem po indeksie (barrier_id, id) - koszt
+    zależy od liczby szlabanów, a nie zdarzeń. Zwraca (wiersze, max_id) albo None przy błędzie.
+    """
+    table = config.TABLE_BARRIER_EVENTS
+    try:
+        with get_db() as conn:
+            max_id = conn.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}").fetchone()[0]
+            barrier_ids = [row[0] for row in conn.execute(f"""
+                WITH RECURSIVE ids(barrier_id) AS (
+                    SELECT MIN(barrier_id) FROM {table}
+                    UNION ALL
+                    SELECT (SELECT MIN(barrier_id) FROM {table} WHERE barrier_id > ids.barrier_id) FROM ids WHERE ids.barrier_id IS NOT NULL
+                )
+                SELECT barrier_id FROM ids WHERE barrier_id IS NOT NULL""")]
+            sql = (f"SELECT {RECENT_EVENT_COLUMNS} FROM {table} INDEXED BY idx_events_barrier_id "
+                   f"WHERE barrier_id = ? AND id <= ? ORDER BY id DESC LIMIT ?")
+            rows: List[sqlite3.Row] = []
+            for barrier_id in barrier_ids:
+                rows.extend(conn.execute(sql, (barrier_id, max_id, per_barrier)).fetchall())
+        return rows, max_id
+    except sqlite3.Error as e:
+        log.error(f"DB Load Recent Events Error: {e}")
+        return None
+
+def get_max_event_id() -> Optional[int]:
+    """Największe ID zdarzenia (0 dla pustej tabeli) albo None przy błędzie."""
+    try:
+        with get_db() as conn:
+            return conn.execute(f"SELECT COALESCE(MAX(id), 0) FROM {config.TABLE_BARRIER_EVENTS}").fetchone()[0]
     except sqlite3.Error as e:
-        log.error(f"DB Read Events Error: Failed fetching events. Filter: barrier_ids={barrier_ids}, only_failures={only_failures}. Error: {e}")
-        return None # Zwróć None w przypadku błędu odczytu z bazy
\ No newline at end of file
+        log.error(f"DB Max Event ID Error: {e}")
+        return None
+
+def get_barrier_events_after(after_ids: Dict[str, int], limit: int = 1000) -> Optional[List[sqlite3.Row]]:
+    """Zdarzenia szlabanów o ID większym niż podane dla każdego z nich (indeks barrier_id, id) albo None przy błędzie.
+
+    Kolumny: id, barrier_id, event_type, success, failed_action - tyle potrzeba do korelacji poleceń.
+    """
+    sql = (f"SELECT id, barrier_id, event_type, success, failed_action FROM {config.TABLE_BARRIER_EVENTS} "
+           f"WHERE barrier_id = ? AND id > ? ORDER BY id LIMIT ?")
+    try:
+        with get_db() as conn:
+            rows: List[sqlite3.Row] = []
+            for barrier_id, after_id in after_ids.items():
+                rows.extend(conn.execute(sql, (barrier_id, after_id, limit)).fetchall())
+        return rows
+    except sqlite3.Error as e:
+        log.error(f"DB Barrier Events Error: {e}")
+        return None
+
+def get_event_rows_in_id_range(after_id: int, before_id: Optional[int] = None, limit: int = 10000) -> Optional[List[sqlite3.Row]]:
+    """Zdarzenia z after_id < id < before_id rosnąco (kolumny RECENT_EVENT_COLUMNS) albo None przy błędzie."""
+    sql = f"SELECT {RECENT_EVENT_COLUMNS} FROM {config.TABLE_BARRIER_EVENTS} WHERE id > ?"
+    params = [after_id]
+    if before_id is not None:
+        sql += " AND id < ?"
+        params.append(before_id)
+    sql += " ORDER BY id LIMIT ?"
+    params.append(limit)
+    try:
+        with get_db() as conn:
+            return conn.execute(sql, params).fetchall()
+    except sqlite3.Error as e:
+        log.error(f"DB Read Event Range Error: ids ({after_id}, {before_id}): {e}")
+        return None
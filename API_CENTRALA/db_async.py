@@ -0,0 +1,122 @@
+# db_async.py
+# -*- coding: utf-8 -*-
+
+import asyncio
+import functools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Optional, TypeVar
+
+import config
+import db
+
+log = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# --- Dedykowany Executor dla Operacji Bazodanowych ---
+# Wszystkie wywołania db.* z handlerów async trafiają tutaj, dzięki czemu
+# wolne zapytanie lub oczekiwanie na blokadę SQLite nie wstrzymuje pętli
+# zdarzeń. Wątków (DB_EXECUTOR_WORKERS) jest nie więcej niż połączeń w puli
+# (DB_POOL_SIZE), a każde wywołanie oddaje połączenie przed powrotem - także
+# eksport NDJSON, który bierze połączenie tylko na czas jednej paczki. Wątek
+# czeka więc na połączenie tylko wtedy, gdy trzyma je ktoś spoza executora
+# (skrypty, benchmarki); stąd osobne ustawienia obu rozmiarów.
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_submitted = 0
+_completed = 0
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                workers = max(1, config.DB_EXECUTOR_WORKERS)
+                if workers > config.DB_POOL_SIZE:
+                    log.warning(f"DB Executor: {workers} workers for {config.DB_POOL_SIZE} pooled connections - "
+                                f"workers will wait up to DB_POOL_TIMEOUT for a connection.")
+                _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="db")
+                log.info(f"DB Executor: Started with {workers} workers.")
+    return _executor
+
+def start_executor():
+    """Tworzy executor z góry (wywoływane w lifespan)."""
+    _get_executor()
+
+def shutdown_executor():
+    """Czeka na zakończenie rozpoczętych zadań i zamyka executor."""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=True, cancel_futures=True)
+            _executor = None
+            log.info("DB Executor: Shut down.")
+
+def _tracked(func: Callable[[], T]) -> T:
+    global _completed
+    try:
+        return func()
+    finally:
+        with _stats_lock:
+            _completed += 1
+
+async def run(func: Callable[..., T], *args, **kwargs) -> T:
+    """Wykonuje synchroniczną funkcję DB w executorze i czeka na wynik bez blokowania pętli."""
+    global _submitted
+    with _stats_lock:
+        _submitted += 1
+    if config.DB_EXECUTOR_WORKERS <= 0:
+        # Bez executora: zapytanie blokuje pętlę zdarzeń (zachowanie sprzed db_async, do benchmarku)
+        return _tracked(functools.partial(func, *args, **kwargs))
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor(), _tracked, functools.partial(func, *args, **kwargs))
+
+def get_stats() -> dict:
+    """Zwraca statystyki executora do monitoringu."""
+    with _stats_lock:
+        in_flight = _submitted - _completed
+        return {
+            "workers": config.DB_EXECUTOR_WORKERS,
+            "submitted": _submitted,
+            "completed": _completed,
+            "in_flight": in_flight,
+            "queued": max(0, in_flight - max(1, config.DB_EXECUTOR_WORKERS)),
+        }
+
+def _async_version(func: Callable[..., T]) -> Callable[..., Awaitable[T]]:
+    """Tworzy asynchroniczny odpowiednik funkcji z db.py (ta sama sygnatura i wynik)."""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run(func, *args, **kwargs)
+    return wrapper
+
+# --- Asynchroniczny Odpowiednik API db.py ---
+init_db = _async_version(db.init_db)
+add_event_to_db = _async_version(db.add_event_to_db)
+add_events_to_db = _async_version(db.add_events_to_db)
+insert_events = _async_version(db.insert_events)
+get_user_by_username = _async_version(db.get_user_by_username)
+create_db_user = _async_version(db.create_db_user)
+create_db_barrier = _async_version(db.create_db_barrier)
+barrier_exists = _async_version(db.barrier_exists)
+grant_db_permission = _async_version(db.grant_db_permission)
+get_existing_usernames = _async_version(db.get_existing_usernames)
+create_db_users_bulk = _async_version(db.create_db_users_bulk)
+create_db_barriers_bulk = _async_version(db.create_db_barriers_bulk)
+grant_db_permissions_bulk = _async_version(db.grant_db_permissions_bulk)
+get_db_permission_level = _async_version(db.get_db_permission_level)
+get_barrier_controller_url = _async_version(db.get_barrier_controller_url)
+get_command_authorization = _async_version(db.get_command_authorization)
+get_barrier_controller_urls = _async_version(db.get_barrier_controller_urls)
+get_user_authorized_barrier_ids = _async_version(db.get_user_authorized_barrier_ids)
+get_user_authorized_barriers_details = _async_version(db.get_user_authorized_barriers_details)
+get_events_from_db = _async_version(db.get_events_from_db)
+get_event_stats_from_db = _async_version(db.get_event_stats_from_db)
+get_server_secret = _async_version(db.get_server_secret)
+get_event_rows_in_id_range = _async_version(db.get_event_rows_in_id_range)
+get_max_event_id = _async_version(db.get_max_event_id)
+get_barrier_events_after = _async_version(db.get_barrier_events_after)
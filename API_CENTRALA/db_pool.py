@@ -0,0 +1,170 @@
+# db_pool.py
+# -*- coding: utf-8 -*-
+
+import sqlite3
+import logging
+import threading
+import queue
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator
+
+log = logging.getLogger(__name__)
+
+
+class PoolTimeoutError(sqlite3.OperationalError):
+    """Brak wolnego połączenia w puli w zadanym czasie.
+
+    Dziedziczy po sqlite3.OperationalError, dzięki czemu istniejące bloki
+    `except sqlite3.Error` w db.py obsługują go jak każdy inny błąd bazy.
+    """
+
+
+class ConnectionPool:
+    """Ograniczona pula długo żyjących połączeń SQLite.
+
+    Połączenia tworzone są leniwie (maksymalnie `size`), a pragmy ustawiane
+    są tylko raz - przy otwarciu połączenia. Połączenia mogą być używane
+    z różnych wątków (check_same_thread=False), ale w danej chwili tylko
+    przez jednego właściciela.
+    """
+
+    def __init__(self, database: str, size: int, timeout: float, busy_timeout: float, pragmas: Dict[str, object]):
+        self.database = database
+        self.size = max(1, int(size))
+        self.timeout = timeout
+        self.busy_timeout = busy_timeout
+        self.pragmas = dict(pragmas)
+
+        # LIFO: najczęściej używane połączenia mają "ciepły" cache stron
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._closed = False
+
+        # Statystyki (chronione przez _lock)
+        self._created = 0
+        self._in_use = 0
+        self._acquisitions = 0
+        self._waits = 0
+        self._timeouts = 0
+        self._discarded = 0
+        self._wait_time_total = 0.0
+
+    def connect(self) -> sqlite3.Connection:
+        """Otwiera nowe połączenie i stosuje skonfigurowane pragmy."""
+        conn = sqlite3.connect(self.database, timeout=self.busy_timeout, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name} = {value};")
+        log.debug(f"DB Pool: Opened new connection to {self.database}.")
+        return conn
+
+    def acquire(self) -> sqlite3.Connection:
+        """Pobiera połączenie z puli (tworzy nowe, jeśli limit na to pozwala)."""
+        if self._closed:
+            raise sqlite3.ProgrammingError("Connection pool is closed.")
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                can_create = self._created < self.size
+                if can_create:
+                    self._created += 1
+            if can_create:
+                try:
+                    conn = self.connect()
+                except sqlite3.Error:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                # Pula wyczerpana - czekamy na zwolnienie połączenia
+                started = time.monotonic()
+                try:
+                    conn = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    with self._lock:
+                        self._waits += 1
+                        self._timeouts += 1
+                        self._wait_time_total += time.monotonic() - started
+                    log.error(f"DB Pool: No free connection after {self.timeout}s (size={self.size}).")
+                    raise PoolTimeoutError(f"No free database connection within {self.timeout}s")
+                with self._lock:
+                    self._waits += 1
+                    self._wait_time_total += time.monotonic() - started
+
+        with self._lock:
+            self._in_use += 1
+            self._acquisitions += 1
+        return conn
+
+    def release(self, conn: sqlite3.Connection, discard: bool = False):
+        """Zwraca połączenie do puli lub je zamyka (discard / pula zamknięta)."""
+        with self._lock:
+            self._in_use -= 1
+            if discard or self._closed:
+                self._created -= 1
+                if discard:
+                    self._discarded += 1
+                to_close = True
+            else:
+                to_close = False
+        if to_close:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        else:
+            self._idle.put(conn)
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """Wypożycza połączenie; commit przy sukcesie, rollback przy wyjątku (jak `with sqlite3.connect()`)."""
+        conn = self.acquire()
+        discard = False
+        try:
+            yield conn
+            if conn.in_transaction:
+                conn.commit()
+        except BaseException:
+            try:
+                if conn.in_transaction:
+                    conn.rollback()
+            except sqlite3.Error:
+                discard = True # Połączenie w nieznanym stanie - nie wraca do puli
+            raise
+        finally:
+            self.release(conn, discard=discard)
+
+    def close(self):
+        """Zamyka wszystkie bezczynne połączenia; pożyczone zostaną zamknięte przy zwrocie."""
+        self._closed = True
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            with self._lock:
+                self._created -= 1
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        log.info(f"DB Pool: Closed pool for {self.database}.")
+
+    def stats(self) -> Dict[str, object]:
+        """Zwraca statystyki puli do monitoringu."""
+        with self._lock:
+            return {
+                "database": self.database,
+                "size": self.size,
+                "created": self._created,
+                "in_use": self._in_use,
+                "idle": self._idle.qsize(),
+                "acquisitions": self._acquisitions,
+                "waits": self._waits,
+                "timeouts": self._timeouts,
+                "discarded": self._discarded,
+                "avg_wait_ms": round(self._wait_time_total * 1000 / self._waits, 3) if self._waits else 0.0,
+                "pragmas": {name: str(value) for name, value in self.pragmas.items()},
+            }
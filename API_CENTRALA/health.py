@@ -0,0 +1,259 @@
+# health.py
+# -*- coding: utf-8 -*-
+
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import httpx
+
+import config
+import db_async
+import authz_cache
+import barrier_state
+import controller_client
+
+log = logging.getLogger(__name__)
+
+
+class CircuitBreaker:
+    """Bezpiecznik dla jednego kontrolera: closed -> open -> half-open -> closed.
+
+    Po `failure_threshold` kolejnych błędach (timeout, brak połączenia) obwód się otwiera
+    i polecenia są od razu odrzucane. Po `open_seconds` przepuszczana jest jedna próba
+    (half-open): sukces zamyka obwód, błąd otwiera go ponownie. Sukces sondy /status
+    zamyka obwód niezależnie od stanu.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int, open_seconds: float):
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.open_seconds = open_seconds
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+
+    def allow(self) -> bool:
+        """Czy można wysłać żądanie (w half-open - tylko jedno naraz)."""
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < self.open_seconds:
+                return False
+            self.state = self.HALF_OPEN
+        if self._trial_in_flight:
+            return False
+        self._trial_in_flight = True
+        return True
+
+    def retry_after(self) -> float:
+        """Sekundy do następnej próby (0, gdy obwód nie jest otwarty)."""
+        if self.state != self.OPEN:
+            return 0.0
+        return max(0.0, self.open_seconds - (time.monotonic() - self.opened_at))
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self._trial_in_flight = False
+
+    def record_failure(self) -> bool:
+        """Zapisuje błąd. Zwraca True, gdy obwód właśnie się otworzył."""
+        self.consecutive_failures += 1
+        was_open = self.state == self.OPEN
+        if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+        self._trial_in_flight = False
+        return self.state == self.OPEN and not was_open
+
+
+class ControllerHealth:
+    """Stan jednego kontrolera: bezpiecznik i wynik ostatniej sondy."""
+
+    def __init__(self, barrier_id: str, controller_url: str):
+        self.barrier_id = barrier_id
+        self.controller_url = controller_url
+        self.breaker = CircuitBreaker(config.CONTROLLER_BREAKER_FAILURE_THRESHOLD, config.CONTROLLER_BREAKER_OPEN_SECONDS)
+        self.reachable: Optional[bool] = None # None - jeszcze nie sprawdzany
+        self.last_probe_at: Optional[str] = None
+        self.last_ok_at: Optional[str] = None
+        self.last_latency_ms: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.last_status: Optional[Dict] = None # Odpowiedź /status kontrolera
+
+    def to_dict(self) -> Dict:
+        return {
+            "barrier_id": self.barrier_id,
+            "controller_url": self.controller_url,
+            "reachable": self.reachable,
+            "circuit": self.breaker.state,
+            "consecutive_failures": self.breaker.consecutive_failures,
+            "retry_after_s": round(self.breaker.retry_after(), 1),
+            "last_probe_at": self.last_probe_at,
+            "last_ok_at": self.last_ok_at,
+            "last_latency_ms": self.last_latency_ms,
+            "last_error": self.last_error,
+            "last_status": self.last_status,
+        }
+
+
+class HealthMonitor:
+    """Okresowo sonduje /status wszystkich zarejestrowanych kontrolerów (równolegle) i prowadzi bezpieczniki.
+
+    Polecenia do kontrolera z otwartym obwodem kończą się od razu 503 zamiast czekać
+    BARRIER_COMMAND_TIMEOUT. Wyniki poleceń też zasilają bezpiecznik: timeout i błąd połączenia
+    to porażka, każda odpowiedź HTTP (nawet błąd) - dowód, że kontroler żyje.
+    """
+
+    def __init__(self, interval: float, probe_timeout: float, concurrency: int):
+        self.interval = interval
+        self.probe_timeout = probe_timeout
+        self.concurrency = max(1, int(concurrency))
+        self._controllers: Dict[str, ControllerHealth] = {}
+
+        # Statystyki
+        self.rounds = 0
+        self.probes = 0
+        self.probe_failures = 0
+        self.rejected_commands = 0
+        self.last_round_ms = 0.0
+
+    def _get(self, barrier_id: str, controller_url: str) -> ControllerHealth:
+        health = self._controllers.get(barrier_id)
+        if health is None or health.controller_url != controller_url: # Nowy szlaban albo zmieniony URL
+            health = self._controllers[barrier_id] = ControllerHealth(barrier_id, controller_url)
+        return health
+
+    # --- Bezpiecznik na ścieżce poleceń ---
+
+    def allow_command(self, barrier_id: str, controller_url: str) -> bool:
+        """Czy wysłać polecenie do kontrolera (False - obwód otwarty, odpowiedz od razu)."""
+        if not config.CONTROLLER_HEALTH_ENABLED:
+            return True
+        if self._get(barrier_id, controller_url).breaker.allow():
+            return True
+        self.rejected_commands += 1
+        return False
+
+    def retry_after(self, barrier_id: str) -> float:
+        health = self._controllers.get(barrier_id)
+        return health.breaker.retry_after() if health else 0.0
+
+    def record_command(self, barrier_id: str, controller_url: str, reachable: bool):
+        """Wynik polecenia: reachable=False dla timeoutu / błędu połączenia."""
+        if not config.CONTROLLER_HEALTH_ENABLED:
+            return
+        health = self._get(barrier_id, controller_url)
+        if reachable:
+            health.breaker.record_success()
+        elif health.breaker.record_failure():
+            log.warning(f"Health: Circuit opened for barrier '{barrier_id}' ({controller_url}) after failed command.")
+
+    # --- Sondy /status ---
+
+    async def probe(self, health: ControllerHealth):
+        """Jedna sonda GET {controller_url}/status."""
+        started = time.perf_counter()
+        error = None
+        try:
+            response = await controller_client.client.get(health.controller_url.rstrip('/') + "/status", timeout=self.probe_timeout)
+            if response.status_code == 200:
+                health.last_status = response.json()
+            else:
+                error = f"HTTP {response.status_code}"
+        except httpx.TimeoutException:
+            error = "timeout"
+        except (httpx.HTTPError, ValueError) as exc:
+            error = f"{type(exc).__name__}: {exc}"
+
+        now = datetime.now().isoformat()
+        self.probes += 1
+        health.last_probe_at = now
+        health.last_latency_ms = round((time.perf_counter() - started) * 1000, 2)
+        health.last_error = error
+        if error is None:
+            if health.reachable is False or health.breaker.state != CircuitBreaker.CLOSED:
+                log.info(f"Health: Controller for barrier '{health.barrier_id}' is reachable again.")
+            health.reachable = True
+            health.last_ok_at = now
+            health.breaker.record_success()
+            if isinstance(health.last_status, dict):
+                barrier_state.cache.apply_status(health.barrier_id, health.last_status)
+        else:
+            self.probe_failures += 1
+            health.reachable = False
+            if health.breaker.record_failure():
+                log.warning(f"Health: Circuit opened for barrier '{health.barrier_id}' ({health.controller_url}): {error}.")
+
+    async def run_round(self):
+        """Sonduje wszystkie kontrolery (najwyżej `concurrency` naraz)."""
+        started = time.perf_counter()
+        if authz_cache.cache.loaded:
+            urls = authz_cache.cache.get_controller_urls()
+        else:
+            urls = await db_async.get_barrier_controller_urls()
+        for removed in set(self._controllers) - set(urls): # Szlabany usunięte z bazy
+            del self._controllers[removed]
+        barrier_state.cache.retain(urls)
+        slots = asyncio.Semaphore(self.concurrency)
+
+        async def probe_one(health: ControllerHealth):
+            async with slots:
+                await self.probe(health)
+
+        await asyncio.gather(*(probe_one(self._get(barrier_id, url)) for barrier_id, url in urls.items()))
+        self.rounds += 1
+        self.last_round_ms = round((time.perf_counter() - started) * 1000, 1)
+
+    async def probe_now(self, barrier_id: str, controller_url: str) -> bool:
+        """Sonda poza rundą (np. na żądanie świeżego stanu). False, gdy bezpiecznik jej nie przepuścił."""
+        health = self._get(barrier_id, controller_url)
+        if health.breaker.state != CircuitBreaker.CLOSED:
+            return False # Nie dokładamy żądań do niedostępnego kontrolera - poczeka na rundę sond
+        await self.probe(health)
+        return True
+
+    async def run_forever(self):
+        """Pętla tła (lifespan): runda sond co `interval` sekund."""
+        while True:
+            try:
+                await self.run_round()
+            except Exception:
+                log.exception("Health: Unexpected error during probe round.")
+            await asyncio.sleep(self.interval)
+
+    # --- Odczyty ---
+
+    def get(self, barrier_id: str) -> Optional[ControllerHealth]:
+        return self._controllers.get(barrier_id)
+
+    def snapshot(self) -> List[Dict]:
+        """Stan wszystkich kontrolerów (dla endpointu admina)."""
+        return [health.to_dict() for _, health in sorted(self._controllers.items())]
+
+    def stats(self) -> Dict:
+        """Zwraca statystyki monitora do monitoringu."""
+        states = [health.breaker.state for health in self._controllers.values()]
+        return {
+            "enabled": config.CONTROLLER_HEALTH_ENABLED,
+            "controllers": len(self._controllers),
+            "reachable": sum(1 for health in self._controllers.values() if health.reachable),
+            "circuits_open": states.count(CircuitBreaker.OPEN),
+            "circuits_half_open": states.count(CircuitBreaker.HALF_OPEN),
+            "rounds": self.rounds,
+            "probes": self.probes,
+            "probe_failures": self.probe_failures,
+            "rejected_commands": self.rejected_commands,
+            "last_round_ms": self.last_round_ms,
+        }
+
+
+# Globalny monitor procesu (pętla sond uruchamiana w lifespan)
+monitor = HealthMonitor(config.CONTROLLER_HEALTH_INTERVAL, config.CONTROLLER_HEALTH_PROBE_TIMEOUT, config.CONTROLLER_HEALTH_CONCURRENCY)
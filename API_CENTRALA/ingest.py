@@ -0,0 +1,327 @@
+# ingest.py
+# -*- coding: utf-8 -*-
+
+import asyncio
+import logging
+import sqlite3
+import time
+from collections import deque
+from typing import Callable, Deque, Iterable, List, Optional, Tuple
+
+import config
+import models
+import db_async
+
+log = logging.getLogger(__name__)
+
+# Pojedyncze zgłoszenie do zapisu: (zdarzenia, czas odebrania, future z listą ID albo None - już potwierdzone
+# (write-behind), liczba nieudanych prób zapisu)
+_Submission = Tuple[List[models.BarrierEventDBInput], str, Optional[asyncio.Future], int]
+# Zapisane zdarzenie przekazywane do callbacków po commicie: (zdarzenie, czas odebrania, ID wiersza)
+CommittedEvent = Tuple[models.BarrierEventDBInput, str, int]
+# Błędy wynikające z treści wierszy (nie z zajętej bazy) - ponawianie nic nie da
+_DATA_ERRORS = (sqlite3.IntegrityError, sqlite3.DataError, sqlite3.InterfaceError, ValueError, TypeError, OverflowError)
+
+
+class IngestQueueFull(Exception):
+    """Kolejka zapisu przekroczyła górny próg - zdarzenie należy odrzucić (503), nadawca ponowi po `retry_after`."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Ingest queue full, retry after {retry_after:.0f}s.")
+        self.retry_after = retry_after
+
+
+class GroupCommitWriter:
+    """Zbiera zdarzenia z równoległych żądań i zapisuje je wspólną transakcją.
+
+    Pierwsze zgłoszenie otwiera okno o długości `max_delay`; wszystko, co
+    przyjdzie w tym czasie (maksymalnie `max_rows` wierszy), trafia do jednego
+    `executemany` i jednego commita. `submit` oddaje wynik dopiero po commicie
+    (odpowiedź HTTP potwierdza trwały zapis); `enqueue` (write-behind) wraca od razu
+    po przyjęciu do kolejki, a nieudany zapis takich zdarzeń jest ponawiany
+    (INGEST_WRITE_RETRIES), zanim zostaną porzucone i policzone w `dropped_rows`.
+    Gdy paczkę odrzuca błąd danych (nie blokada), jest dzielona na pół aż do pojedynczych
+    zgłoszeń - odrzucane są tylko wadliwe, reszta trafia do bazy.
+
+    Kolejka jest ograniczona: po przekroczeniu `high_water` wierszy nowe zgłoszenia
+    dostają IngestQueueFull, aż writer zejdzie poniżej `low_water` (histereza - bez
+    przełączania przy każdym zdarzeniu). Przy zatrzymaniu writer zapisuje wszystko, co czeka.
+
+    Po każdym udanym zapisie (także bezpośrednim, bez działającego writera) wywoływane są
+    zarejestrowane callbacki z zapisanymi zdarzeniami - np. aktualizacja stanu szlabanów.
+    """
+
+    def __init__(self, max_rows: int, max_delay: float, high_water: int, low_water: int):
+        self.max_rows = max(1, int(max_rows))
+        self.max_delay = max_delay
+        self.high_water = max(1, int(high_water))
+        self.low_water = min(max(0, int(low_water)), self.high_water)
+        self._pending: Deque[_Submission] = deque()
+        self._pending_rows = 0
+        self._has_items = asyncio.Event()
+        self._batch_full = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self._commit_callbacks: List[Callable[[List[CommittedEvent]], None]] = []
+        self._shedding = False # Powyżej high_water, do zejścia poniżej low_water
+        self._drained: Deque[Tuple[float, int]] = deque() # (monotonic, wiersze) commitów z okna INGEST_DRAIN_RATE_WINDOW
+
+        # Statystyki
+        self.batches_committed = 0
+        self.rows_committed = 0
+        self.batches_failed = 0
+        self.batches_split = 0 # Podziały paczek po błędzie danych
+        self.rows_queued = 0 # Przyjęte przez enqueue (potwierdzone przed zapisem)
+        self.rows_rejected = 0 # Odrzucone przez przepełnienie kolejki (503)
+        self.dropped_rows = 0 # Potwierdzone, ale niezapisane po wyczerpaniu ponowień
+        self.retries = 0
+        self.peak_pending_rows = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self):
+        """Uruchamia zadanie zapisujące (wywoływane w lifespan)."""
+        if self.running:
+            return
+        self._stopping = False
+        self._has_items = asyncio.Event()
+        self._batch_full = asyncio.Event()
+        self._task = asyncio.create_task(self._run(), name="event-group-commit-writer")
+        log.info(f"Ingest: Group-commit writer started (max_rows={self.max_rows}, max_delay={self.max_delay * 1000:.1f}ms).")
+
+    async def stop(self):
+        """Zapisuje oczekujące zdarzenia i zatrzymuje zadanie zapisujące."""
+        if not self.running:
+            return
+        if self._pending_rows:
+            log.info(f"Ingest: Flushing {self._pending_rows} queued events before shutdown.")
+        self._stopping = True
+        self._has_items.set()
+        self._batch_full.set()
+        await self._task
+        self._task = None
+        log.info(f"Ingest: Group-commit writer stopped ({self.rows_committed} rows in {self.batches_committed} batches).")
+
+    def add_commit_callback(self, callback: Callable[[List[CommittedEvent]], None]):
+        """Rejestruje funkcję wywoływaną (w pętli zdarzeń) z listą zdarzeń po każdym commicie."""
+        if callback not in self._commit_callbacks: # Lifespan może startować wielokrotnie (testy)
+            self._commit_callbacks.append(callback)
+
+    def _notify_committed(self, rows: Iterable[Tuple[models.BarrierEventDBInput, str]], ids: List[int]):
+        committed = [(event, received_at, event_id) for (event, received_at), event_id in zip(rows, ids)]
+        for callback in self._commit_callbacks:
+            try:
+                callback(committed)
+            except Exception:
+                log.exception("Ingest: Commit callback failed.")
+
+    # --- Przyjmowanie zdarzeń ---
+
+    def drain_rate(self) -> float:
+        """Zapisane wiersze na sekundę w ostatnich INGEST_DRAIN_RATE_WINDOW sekundach."""
+        window = config.INGEST_DRAIN_RATE_WINDOW
+        horizon = time.monotonic() - window
+        while self._drained and self._drained[0][0] < horizon:
+            self._drained.popleft()
+        return sum(rows for _, rows in self._drained) / window
+
+    def retry_after(self) -> float:
+        """Sekundy do zejścia kolejki poniżej low_water przy bieżącym tempie zapisu (do Retry-After)."""
+        rate = self.drain_rate()
+        if rate <= 0:
+            return config.INGEST_RETRY_AFTER_MAX
+        return min(config.INGEST_RETRY_AFTER_MAX, max(1.0, (self._pending_rows - self.low_water) / rate))
+
+    def _check_low_water(self):
+        if self._shedding and self._pending_rows < self.low_water:
+            self._shedding = False
+            log.info(f"Ingest: Queue drained below low-water mark ({self._pending_rows} rows) - accepting events again.")
+
+    def _admit(self, count: int):
+        """Sprawdza miejsce w kolejce dla `count` wierszy; IngestQueueFull powyżej progu."""
+        self._check_low_water()
+        if not self._shedding and self._pending_rows + count > self.high_water:
+            self._shedding = True
+            log.warning(f"Ingest: Queue above high-water mark ({self._pending_rows} rows pending) - rejecting events with 503.")
+        if self._shedding:
+            self.rows_rejected += count
+            raise IngestQueueFull(self.retry_after())
+
+    def _queue(self, events: List[models.BarrierEventDBInput], received_at: str, future: Optional[asyncio.Future]):
+        self._pending.append((events, received_at, future, 0))
+        self._pending_rows += len(events)
+        self.peak_pending_rows = max(self.peak_pending_rows, self._pending_rows)
+        self._has_items.set()
+        if self._pending_rows >= self.max_rows:
+            self._batch_full.set()
+
+    def enqueue(self, events: List[models.BarrierEventDBInput], received_at: str) -> bool:
+        """Write-behind: przyjmuje zdarzenia do zapisu w tle bez czekania na commit.
+
+        False, gdy writer nie działa (wtedy należy użyć `submit`); IngestQueueFull przy przepełnieniu.
+        """
+        if not self.running or self._stopping:
+            return False
+        self._admit(len(events))
+        self._queue(events, received_at, None)
+        self.rows_queued += len(events)
+        return True
+
+    async def submit(self, events: List[models.BarrierEventDBInput], received_at: str) -> Optional[List[int]]:
+        """Kolejkuje zdarzenia do zapisu i czeka na commit. Zwraca ID wierszy lub None przy błędzie DB.
+
+        IngestQueueFull, gdy kolejka jest przepełniona (zdarzenia nie zostały przyjęte).
+        """
+        if not events:
+            return []
+        if not self.running or self._stopping:
+            # Writer nie działa (np. poza lifespan) - zapis bezpośredni
+            rows = [(event, received_at) for event in events]
+            ids = await db_async.add_events_to_db(rows)
+            if ids is not None:
+                self._notify_committed(rows, ids)
+            return ids
+
+        self._admit(len(events))
+        future = asyncio.get_running_loop().create_future()
+        self._queue(events, received_at, future)
+        return await future
+
+    # --- Zapis ---
+
+    def _take_batch(self) -> List[_Submission]:
+        """Zdejmuje z kolejki zgłoszenia mieszczące się w limicie wierszy (zawsze co najmniej jedno)."""
+        batch: List[_Submission] = []
+        rows = 0
+        while self._pending:
+            size = len(self._pending[0][0])
+            if batch and rows + size > self.max_rows:
+                break
+            batch.append(self._pending.popleft())
+            rows += size
+        self._pending_rows -= rows
+        if not self._pending and not self._stopping: # Przy zatrzymaniu sygnał musi zostać - _run kończy na pustej kolejce
+            self._has_items.clear()
+        if self._pending_rows < self.max_rows:
+            self._batch_full.clear()
+        self._check_low_water()
+        return batch
+
+    async def _run(self):
+        while True:
+            await self._has_items.wait()
+            if not self._pending:
+                if self._stopping:
+                    return
+                self._has_items.clear()
+                continue
+            if self._pending_rows < self.max_rows and not self._stopping:
+                # Okno grupowania: czekamy na kolejne zgłoszenia lub zapełnienie paczki
+                try:
+                    await asyncio.wait_for(self._batch_full.wait(), timeout=self.max_delay)
+                except asyncio.TimeoutError:
+                    pass
+            if not await self._commit(self._take_batch()):
+                await asyncio.sleep(config.INGEST_RETRY_DELAY) # Baza zajęta / błąd - nie ponawiaj od razu
+
+    async def _commit(self, batch: List[_Submission]) -> bool:
+        """Zapisuje paczkę; False, gdy część zgłoszeń wróciła do kolejki (baza zajęta / błąd)."""
+        retry = await self._write(batch)
+        if retry:
+            self.batches_failed += 1
+            self._requeue_failed(retry)
+            return False
+        return True
+
+    async def _write(self, batch: List[_Submission]) -> List[_Submission]:
+        """Zapisuje paczkę, przy błędzie danych dzieląc ją na pół. Zwraca zgłoszenia do ponowienia."""
+        rows = [(event, received_at) for events, received_at, _, _ in batch for event in events]
+        try:
+            ids = await db_async.insert_events(rows)
+        except _DATA_ERRORS as e:
+            if len(batch) == 1:
+                self._reject(batch[0], e)
+                return []
+            self.batches_split += 1
+            middle = len(batch) // 2
+            retry = await self._write(batch[:middle])
+            if retry: # Po drodze baza przestała przyjmować zapisy - druga połowa czeka razem z resztą
+                return retry + batch[middle:]
+            return await self._write(batch[middle:])
+        except sqlite3.Error as e:
+            log.error(f"Ingest: Failed to commit batch of {len(rows)} events: {e}")
+            return batch
+        except Exception as e:
+            log.exception(f"Ingest: Unexpected error committing batch of {len(rows)} events: {e}")
+            return batch
+
+        self.batches_committed += 1
+        self.rows_committed += len(rows)
+        self._drained.append((time.monotonic(), len(rows)))
+        self._notify_committed(rows, ids)
+
+        offset = 0
+        for events, _, future, _ in batch:
+            if future is not None and not future.done(): # Klient mógł się rozłączyć (anulowany future)
+                future.set_result(ids[offset:offset + len(events)])
+            offset += len(events)
+        return []
+
+    def _reject(self, submission: _Submission, error: Exception):
+        """Zgłoszenie, którego nie da się zapisać: czekający dostaje None (500), potwierdzone jest porzucane."""
+        events, _, future, _ = submission
+        if future is not None:
+            if not future.done():
+                future.set_result(None)
+            log.error(f"Ingest: Rejected {len(events)} events that cannot be stored: {error}")
+            return
+        self.dropped_rows += len(events)
+        log.error(f"Ingest: Dropping {len(events)} acknowledged events that cannot be stored: {error}")
+
+    def _requeue_failed(self, batch: List[_Submission]):
+        """Po nieudanym commicie: czekający dostają None (500), potwierdzone zdarzenia wracają na początek kolejki."""
+        retry: List[_Submission] = []
+        for events, received_at, future, attempts in batch:
+            if future is not None:
+                if not future.done():
+                    future.set_result(None)
+            elif attempts + 1 < config.INGEST_WRITE_RETRIES:
+                retry.append((events, received_at, None, attempts + 1))
+            else:
+                self.dropped_rows += len(events)
+                log.error(f"Ingest: Dropping {len(events)} acknowledged events after {attempts + 1} failed write attempts.")
+        if retry:
+            self.retries += 1
+            self._pending.extendleft(reversed(retry))
+            self._pending_rows += sum(len(events) for events, _, _, _ in retry)
+            self._has_items.set()
+
+    def stats(self) -> dict:
+        """Zwraca statystyki writera do monitoringu."""
+        return {
+            "running": self.running,
+            "write_behind": config.INGEST_WRITE_BEHIND,
+            "pending_submissions": len(self._pending),
+            "pending_rows": self._pending_rows,
+            "peak_pending_rows": self.peak_pending_rows,
+            "high_water": self.high_water,
+            "low_water": self.low_water,
+            "shedding": self._shedding,
+            "drain_rate_rows_per_s": round(self.drain_rate(), 1),
+            "batches_committed": self.batches_committed,
+            "rows_committed": self.rows_committed,
+            "batches_failed": self.batches_failed,
+            "batches_split": self.batches_split,
+            "retries": self.retries,
+            "rows_queued": self.rows_queued,
+            "rows_rejected": self.rows_rejected,
+            "dropped_rows": self.dropped_rows,
+            "avg_batch_rows": round(self.rows_committed / self.batches_committed, 2) if self.batches_committed else 0.0,
+        }
+
+
+# Globalny writer procesu (uruchamiany i zatrzymywany w lifespan)
+event_writer = GroupCommitWriter(config.INGEST_BATCH_MAX_ROWS, config.INGEST_BATCH_MAX_DELAY,
+                                 config.INGEST_QUEUE_HIGH_WATER, config.INGEST_QUEUE_LOW_WATER)
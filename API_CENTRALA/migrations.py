@@ -0,0 +1,243 @@
+# migrations.py
+# -*- coding: utf-8 -*-
+
+import sqlite3
+import logging
+import time
+from typing import Callable, List, Tuple, Union
+
+import config
+import timestamps
+
+log = logging.getLogger(__name__)
+
+# Krok migracji: instrukcja SQL albo funkcja przyjmująca połączenie (np. backfill danych)
+MigrationStep = Union[str, Callable[[sqlite3.Connection], None]]
+
+# --- Pomocnicy Migracji ---
+
+def _authz_generation_triggers() -> List[str]:
+    """Triggery zwiększające licznik generacji przy każdej zmianie użytkowników, szlabanów i uprawnień."""
+    statements = []
+    watched = ((config.TABLE_USERS, ("UPDATE", "DELETE")),
+               (config.TABLE_BARRIERS, ("INSERT", "UPDATE", "DELETE")),
+               (config.TABLE_PERMISSIONS, ("INSERT", "UPDATE", "DELETE")))
+    for table, operations in watched:
+        for operation in operations:
+            statements.append(
+                f"""CREATE TRIGGER IF NOT EXISTS trg_authz_{table}_{operation.lower()}
+                    AFTER {operation} ON {table}
+                    BEGIN
+                        UPDATE {config.TABLE_AUTHZ_GENERATION} SET generation = generation + 1 WHERE id = 1;
+                    END""")
+    return statements
+
+def _token_state_generation_triggers() -> List[str]:
+    """Triggery zwiększające licznik stanu tokenów: odwołania, nowi i usunięci użytkownicy, zmiany generacji tokenów."""
+    watched = ((config.TABLE_TOKEN_REVOCATIONS, "revocations_insert", "INSERT"),
+               (config.TABLE_USERS, "users_insert", "INSERT"),
+               (config.TABLE_USERS, "users_delete", "DELETE"),
+               (config.TABLE_USERS, "users_generation", "UPDATE OF token_generation"))
+    return [f"""CREATE TRIGGER IF NOT EXISTS trg_token_state_{name}
+                AFTER {operation} ON {table}
+                BEGIN
+                    UPDATE {config.TABLE_TOKEN_STATE_GENERATION} SET generation = generation + 1 WHERE id = 1;
+                END""" for table, name, operation in watched]
+
+def _warn_if_stats_need_backfill(conn: sqlite3.Connection):
+    """Agregaty liczone są od momentu migracji - starsze zdarzenia wymagają jednorazowego backfillu."""
+    if conn.execute(f"SELECT EXISTS (SELECT 1 FROM {config.TABLE_BARRIER_EVENTS})").fetchone()[0]:
+        log.warning("DB Migrate: Existing events are not yet counted in statistics. Run 'python stats.py backfill' once.")
+
+def _backfill_event_timestamps(conn: sqlite3.Connection):
+    """Wypełnia event_ts_us/received_ts_us dla istniejących zdarzeń (te same funkcje co przy zapisie)."""
+    def tolerant(func):
+        # Uszkodzony tekst daty w starych wierszach -> NULL zamiast przerwania migracji
+        def wrapper(*args):
+            try:
+                return func(*args)
+            except (TypeError, ValueError):
+                return None
+        return wrapper
+    conn.create_function("event_time_us", 2, tolerant(timestamps.event_time_us), deterministic=True)
+    conn.create_function("iso_to_epoch_us", 1, tolerant(timestamps.iso_to_epoch_us), deterministic=True)
+    updated = conn.execute(f"""UPDATE {config.TABLE_BARRIER_EVENTS}
+                               SET event_ts_us = event_time_us(event_timestamp, received_at),
+                                   received_ts_us = iso_to_epoch_us(received_at)""").rowcount
+    log.info(f"DB Migrate: Backfilled numeric timestamps for {updated} events.")
+
+# --- Lista Migracji ---
+# Wersja schematu przechowywana jest w PRAGMA user_version. Migracje są tylko
+# dopisywane na końcu listy - nigdy nie zmieniamy już wydanych wersji.
+
+MIGRATIONS: List[Tuple[int, str, List[MigrationStep]]] = [
+    (1, "Initial schema (users, barriers, permissions, events)", [
+        # Tabele (kolejność ma znaczenie ze względu na klucze obce).
+        # IF NOT EXISTS: bazy sprzed migracji mają już te tabele przy user_version = 0.
+        f"""CREATE TABLE IF NOT EXISTS {config.TABLE_USERS} (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                username TEXT NOT NULL UNIQUE,
+                hashed_password TEXT NOT NULL
+            )""",
+        f"""CREATE TABLE IF NOT EXISTS {config.TABLE_BARRIERS} (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                barrier_id TEXT NOT NULL UNIQUE,
+                controller_url TEXT NOT NULL UNIQUE
+            )""",
+        f"""CREATE TABLE IF NOT EXISTS {config.TABLE_PERMISSIONS} (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                barrier_id TEXT NOT NULL,
+                permission_level TEXT NOT NULL CHECK(permission_level IN ('operator', 'technician')),
+                FOREIGN KEY (user_id) REFERENCES {config.TABLE_USERS} (id) ON DELETE CASCADE,
+                FOREIGN KEY (barrier_id) REFERENCES {config.TABLE_BARRIERS} (barrier_id) ON DELETE CASCADE,
+                UNIQUE(user_id, barrier_id)
+            )""",
+        f"""CREATE TABLE IF NOT EXISTS {config.TABLE_BARRIER_EVENTS} (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                barrier_id TEXT NOT NULL,
+                event_type TEXT NOT NULL,
+                trigger_method TEXT NOT NULL,
+                event_timestamp TEXT NOT NULL, -- Oryginalny czas zdarzenia
+                user_id TEXT,
+                success INTEGER NOT NULL, -- 0 or 1
+                details TEXT,
+                failed_action TEXT,
+                received_at TEXT NOT NULL -- Czas odebrania przez centralę
+            )""",
+    ]),
+    (2, "Indexes for event feeds and permission lookups", [
+        # Zdarzenia szlabanu od najnowszych: barrier_id IN (...) ORDER BY id DESC
+        f"CREATE INDEX IF NOT EXISTS idx_events_barrier_id ON {config.TABLE_BARRIER_EVENTS} (barrier_id, id DESC)",
+        # Indeks częściowy tylko dla awarii (only_failures=True) - mały, bo awarie są rzadkie
+        f"CREATE INDEX IF NOT EXISTS idx_events_failures ON {config.TABLE_BARRIER_EVENTS} (barrier_id, id DESC) WHERE success = 0",
+        # Uprawnienia po user_id - indeks pokrywający (bez sięgania do tabeli)
+        f"CREATE INDEX IF NOT EXISTS idx_permissions_user ON {config.TABLE_PERMISSIONS} (user_id, barrier_id, permission_level)",
+        # Kaskadowe usuwanie szlabanu (FK) i wyszukiwanie uprawnień po barrier_id
+        f"CREATE INDEX IF NOT EXISTS idx_permissions_barrier ON {config.TABLE_PERMISSIONS} (barrier_id)",
+        "ANALYZE",
+    ]),
+    (3, "Authorization generation counter for cross-process cache invalidation", [
+        f"""CREATE TABLE IF NOT EXISTS {config.TABLE_AUTHZ_GENERATION} (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                generation INTEGER NOT NULL
+            )""",
+        f"INSERT OR IGNORE INTO {config.TABLE_AUTHZ_GENERATION} (id, generation) VALUES (1, 0)",
+        *_authz_generation_triggers(),
+    ]),
+    (4, "Hourly event statistics rollup", [
+        # Klucz główny zaczyna się od (barrier_id, hour), więc zakresy czasu per szlaban to skan fragmentu indeksu
+        f"""CREATE TABLE IF NOT EXISTS {config.TABLE_EVENT_STATS} (
+                barrier_id TEXT NOT NULL,
+                hour TEXT NOT NULL, -- 'RRRR-MM-DDTHH' (czas lokalny)
+                event_type TEXT NOT NULL,
+                trigger_method TEXT NOT NULL,
+                success INTEGER NOT NULL,
+                count INTEGER NOT NULL,
+                PRIMARY KEY (barrier_id, hour, event_type, trigger_method, success)
+            ) WITHOUT ROWID""",
+        _warn_if_stats_need_backfill,
+    ]),
+    (5, "Numeric event timestamps and composite indexes for filtered event queries", [
+        # Mikrosekundy od epoki obok tekstów ISO - porównania zakresów na liczbach zamiast na tekście
+        f"ALTER TABLE {config.TABLE_BARRIER_EVENTS} ADD COLUMN event_ts_us INTEGER",
+        f"ALTER TABLE {config.TABLE_BARRIER_EVENTS} ADD COLUMN received_ts_us INTEGER",
+        _backfill_event_timestamps,
+        # Wąskie zakresy czasu: per szlaban, tylko awarie, bez filtra szlabanów (wybór w db._choose_event_index)
+        f"CREATE INDEX IF NOT EXISTS idx_events_barrier_time ON {config.TABLE_BARRIER_EVENTS} (barrier_id, event_ts_us)",
+        f"CREATE INDEX IF NOT EXISTS idx_events_failures_time ON {config.TABLE_BARRIER_EVENTS} (barrier_id, event_ts_us) WHERE success = 0",
+        f"CREATE INDEX IF NOT EXISTS idx_events_time ON {config.TABLE_BARRIER_EVENTS} (event_ts_us)",
+        # Zdarzenia wywołane przez konkretną osobę (user_id z kontrolera), od najnowszych
+        f"CREATE INDEX IF NOT EXISTS idx_events_user ON {config.TABLE_BARRIER_EVENTS} (user_id, id DESC)",
+        "ANALYZE",
+    ]),
+    (6, "Server secrets (token signing key)", [
+        f"""CREATE TABLE IF NOT EXISTS {config.TABLE_SERVER_SECRETS} (
+                name TEXT PRIMARY KEY,
+                value BLOB NOT NULL
+            )""",
+        # Losowy klucz per baza: tokeny są ważne we wszystkich procesach korzystających z tej bazy
+        f"INSERT OR IGNORE INTO {config.TABLE_SERVER_SECRETS} (name, value) VALUES ('token_signing_key', randomblob(32))",
+    ]),
+    (7, "Failures feed index for multi-barrier event pages", [
+        # Awarie od najnowszych z ID szlabanu w indeksie - skan dla długich list szlabanów (db._use_feed_scan)
+        # sprawdza przynależność bez sięgania do tabeli
+        f"CREATE INDEX IF NOT EXISTS idx_events_failures_feed ON {config.TABLE_BARRIER_EVENTS} (id DESC, barrier_id) WHERE success = 0",
+    ]),
+    (8, "Token revocation shared by all server processes", [
+        # Token zawiera generację użytkownika z chwili wydania; podbicie generacji unieważnia wszystkie jego tokeny
+        f"ALTER TABLE {config.TABLE_USERS} ADD COLUMN token_generation INTEGER NOT NULL DEFAULT 0",
+        f"""CREATE TABLE IF NOT EXISTS {config.TABLE_TOKEN_REVOCATIONS} (
+                jti TEXT PRIMARY KEY,
+                expires_at INTEGER NOT NULL
+            )""",
+        # Zmiana hasła (także poza API) unieważnia wydane tokeny
+        f"""CREATE TRIGGER IF NOT EXISTS trg_users_password_token_generation
+            AFTER UPDATE OF hashed_password ON {config.TABLE_USERS}
+            WHEN NEW.hashed_password IS NOT OLD.hashed_password
+            BEGIN
+                UPDATE {config.TABLE_USERS} SET token_generation = token_generation + 1 WHERE id = NEW.id;
+            END""",
+        # Odwołania i nowi użytkownicy przeładowują obraz tokenów w innych procesach (tokens.TokenManager.load)
+        *[f"""CREATE TRIGGER IF NOT EXISTS trg_authz_{table}_insert
+              AFTER INSERT ON {table}
+              BEGIN
+                  UPDATE {config.TABLE_AUTHZ_GENERATION} SET generation = generation + 1 WHERE id = 1;
+              END""" for table in (config.TABLE_TOKEN_REVOCATIONS, config.TABLE_USERS)],
+    ]),
+    (9, "Token state counter separate from the authorization generation", [
+        # Wylogowanie nie może przeładowywać authz_cache i czyścić cache poświadczeń we wszystkich procesach -
+        # stan tokenów ma własny licznik, obserwowany tylko przez tokens.TokenManager
+        f"DROP TRIGGER IF EXISTS trg_authz_{config.TABLE_TOKEN_REVOCATIONS}_insert",
+        f"DROP TRIGGER IF EXISTS trg_authz_{config.TABLE_USERS}_insert",
+        f"""CREATE TABLE IF NOT EXISTS {config.TABLE_TOKEN_STATE_GENERATION} (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                generation INTEGER NOT NULL
+            )""",
+        f"INSERT OR IGNORE INTO {config.TABLE_TOKEN_STATE_GENERATION} (id, generation) VALUES (1, 0)",
+        *_token_state_generation_triggers(),
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+# --- Wykonywanie Migracji ---
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    """Zwraca bieżącą wersję schematu (PRAGMA user_version)."""
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def migrate(conn: sqlite3.Connection) -> int:
+    """Podnosi schemat do LATEST_VERSION; każda migracja w osobnej transakcji. Zwraca wersję końcową."""
+    current = get_schema_version(conn)
+    if current == LATEST_VERSION:
+        log.info(f"DB Migrate: Schema is current (version {current}), nothing to do.")
+        return current
+    if current > LATEST_VERSION:
+        # Baza z nowszej wersji aplikacji - nie ruszamy jej
+        log.warning(f"DB Migrate: Schema version {current} is newer than supported {LATEST_VERSION}. Skipping migrations.")
+        return current
+
+    total_started = time.perf_counter()
+    for version, description, steps in MIGRATIONS:
+        if version <= current:
+            continue
+        started = time.perf_counter()
+        try:
+            conn.execute("BEGIN")
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(step)
+            conn.execute(f"PRAGMA user_version = {version}")
+            conn.commit()
+        except sqlite3.Error as e:
+            conn.rollback()
+            log.error(f"DB Migrate: Migration {version} ('{description}') failed, rolled back. Error: {e}")
+            raise
+        current = version
+        log.info(f"DB Migrate: Applied migration {version} ('{description}') in {(time.perf_counter() - started) * 1000:.1f} ms.")
+
+    log.info(f"DB Migrate: Schema upgraded to version {current} in {(time.perf_counter() - total_started) * 1000:.1f} ms.")
+    return current
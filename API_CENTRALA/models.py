@@ -1,8 +1,8 @@
 # models.py
 # -*- coding: utf-8 -*-
 
-from pydantic import BaseModel, Field, field_validator
-from typing import Optional, List, Dict
+from pydantic import BaseModel, Field, field_validator, model_validator
+from typing import Any, Optional, List, Dict
 
 # --- Modele Zdarzeń (Events) ---
 
@@ -75,10 +75,129 @@ class PermissionResponse(PermissionBase):
     user_id: int
     permission_level: str
 
+# --- Modele Tokenów ---
+
+class TokenResponse(BaseModel):
+    """Model odpowiedzi /api/auth/token."""
+    access_token: str
+    token_type: str = "bearer"
+    expires_at: int # Czas Unix (sekundy)
+    expires_in: int # Sekundy
+
+# --- Modele Operacji Masowych (provisioning) ---
+
+class UserBulkCreate(UserBase):
+    """Użytkownik w imporcie masowym: hasło jawne albo gotowy hash bcrypt (np. z eksportu innego systemu)."""
+    password: Optional[str] = None
+    password_hash: Optional[str] = None
+
+    @model_validator(mode='after')
+    def v_password(self):
+        if (self.password is None) == (self.password_hash is None):
+            raise ValueError('exactly one of password or password_hash is required')
+        if self.password_hash is not None and not self.password_hash.startswith(('$2a$', '$2b$', '$2y$')):
+            raise ValueError('password_hash must be a bcrypt hash')
+        return self
+
+class BulkItemResult(BaseModel):
+    """Wynik pojedynczego elementu żądania masowego."""
+    index: int
+    status: str # created / conflict / not_found / invalid
+    id: Optional[int] = None
+    detail: Optional[str] = None
+
+class BulkResponse(BaseModel):
+    """Model odpowiedzi endpointów /api/*/bulk."""
+    created: int
+    conflicts: int
+    not_found: int
+    invalid: int
+    results: List[BulkItemResult]
+
+# --- Modele Poleceń dla Szlabanów ---
+
+class BarrierCommand(BaseModel):
+    """Pojedyncze polecenie w POST /api/barriers/commands."""
+    barrier_id: str
+    action: str
+
+    @field_validator('action')
+    def v_action(cls, v):
+        allowed = {'open', 'close', 'service/start', 'service/end'}
+        if v not in allowed:
+            raise ValueError(f'must be one of {allowed}')
+        return v
+
+class BarrierCommandResult(BaseModel):
+    """Wynik polecenia dla jednego szlabanu: status i odpowiedź kontrolera albo błąd centrali (403/429/502/504...)."""
+    barrier_id: str
+    action: str
+    status_code: int
+    detail: Optional[Any] = None
+    duration_ms: float
+
+class BarrierCommandsResponse(BaseModel):
+    """Model odpowiedzi POST /api/barriers/commands."""
+    succeeded: int # Kontroler odpowiedział 2xx
+    failed: int
+    duration_ms: float
+    results: List[BarrierCommandResult]
+
+class CommandJobResponse(BaseModel):
+    """Polecenie asynchroniczne (POST ...?async=true, GET /api/commands/{id})."""
+    command_id: str
+    barrier_id: str
+    action: str
+    state: str # queued / sent / acknowledged / completed / failed / expired
+    created_at: str
+    sent_at: Optional[str] = None
+    acknowledged_at: Optional[str] = None
+    finished_at: Optional[str] = None
+    controller_status: Optional[int] = None # Kod HTTP odpowiedzi kontrolera (albo błędu centrali, np. 502/504)
+    controller_response: Optional[Any] = None
+    completion_event_id: Optional[int] = None # ID zdarzenia, które potwierdziło wykonanie
+    detail: Optional[str] = None
+    status_url: str
+
 # --- Modele Odpowiedzi dla Użytkownika Końcowego ---
 
+class BarrierStatusResponse(BaseModel):
+    """Stan szlabanu z cache centrali (GET /api/barriers/{id}/status) - wartości mogą mieć `age_s` sekund."""
+    barrier_id: str
+    barrier_status: Optional[str] = None # "Otwarty" / "Zamkniety" / "W ruchu" (jak /status kontrolera); None - nieznany
+    service_mode: Optional[bool] = None
+    source: Optional[str] = None # "probe" (sonda /status) albo "event" (zdarzenie od kontrolera)
+    updated_at: Optional[str] = None
+    age_s: Optional[float] = None
+    stale: bool # Brak danych albo starsze niż BARRIER_STATE_MAX_AGE
+    controller_reachable: Optional[bool] = None # Wynik ostatniej sondy (None - jeszcze nie sprawdzany)
+    last_event_id: Optional[int] = None
+    last_event_type: Optional[str] = None
+
 class MyBarrierResponse(BaseModel):
     """Model szlabanu zwracany w /api/my/barriers."""
     barrier_id: str
     controller_url: str
-    permission_level: str
\ No newline at end of file
+    permission_level: str
+    status: Optional[BarrierStatusResponse] = None # Tylko z include_status=true
+
+# --- Modele Statystyk ---
+
+class EventStatsBucket(BaseModel):
+    """Sumy zdarzeń jednego szlabanu w jednym kubełku czasu."""
+    barrier_id: str
+    bucket: str # 'RRRR-MM-DDTHH' / 'RRRR-MM-DD' / 'RRRR-MM' albo 'total'
+    total: int
+    failures: int
+    failure_rate: float
+    by_event_type: Dict[str, int]
+
+class EventStatsResponse(BaseModel):
+    """Model odpowiedzi /api/stats i /api/my/stats."""
+    granularity: str
+    since: Optional[str] = None
+    until: Optional[str] = None
+    total: int
+    failures: int
+    failure_rate: float
+    buckets: List[EventStatsBucket]
@@ -0,0 +1,145 @@
+# passwords.py
+# -*- coding: utf-8 -*-
+
+import asyncio
+import logging
+import math
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, TypeVar
+
+from passlib.context import CryptContext
+
+import config
+
+log = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Moduł celowo lekki (tylko passlib i config) - importują go procesy potomne puli hashującej.
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+def verify_password(plain: str, hashed: str) -> bool:
+    """Weryfikuje hasło jawne z hashem."""
+    return pwd_context.verify(plain, hashed)
+
+def get_password_hash(pwd: str) -> str:
+    """Generuje hash hasła."""
+    return pwd_context.hash(pwd)
+
+def _hash_password_chunk(passwords: List[str]) -> List[str]:
+    """Hashuje paczkę haseł (wykonywane w procesie potomnym)."""
+    return [get_password_hash(pwd) for pwd in passwords]
+
+
+class HasherBusy(Exception):
+    """Kolejka operacji bcrypt jest pełna - żądanie należy odrzucić (503), a nie kolejkować."""
+
+
+class PasswordHasher:
+    """Pula procesów dla bcrypt (weryfikacja przy logowaniu, hashowanie przy tworzeniu użytkowników).
+
+    bcrypt to czysta praca CPU: w procesach potomnych nie konkuruje o GIL z pętlą zdarzeń,
+    więc fala logowań nie opóźnia poleceń dla szlabanów. Liczba operacji oczekujących
+    i wykonywanych naraz jest ograniczona (`max_pending`) - nadmiar jest od razu odrzucany,
+    bo klient i tak nie doczekałby się odpowiedzi z długiej kolejki. Import masowy dzieli
+    hasła na paczki; każda paczka zajmuje jedno miejsce w kolejce, ale nie jest odrzucana.
+
+    Przed start() (np. skrypty i testy bez lifespan) operacje idą do puli wątków.
+    """
+
+    def __init__(self, processes: Optional[int], max_pending: Optional[int]):
+        self.processes = processes or os.cpu_count() or 1
+        self.max_pending = max_pending or self.processes * 8
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._fallback = ThreadPoolExecutor(max_workers=self.processes, thread_name_prefix="auth")
+        self._pending = 0 # Zmieniane tylko w pętli zdarzeń
+
+        # Statystyki
+        self.completed = 0
+        self.rejected = 0
+        self.failed = 0
+        self.peak_pending = 0
+        self._latency_total = 0.0
+        self._latency_max = 0.0
+        self._recent_latencies = deque(maxlen=1000) # Do p95 z ostatnich operacji
+
+    def start(self):
+        """Uruchamia pulę procesów (lifespan). "spawn" - proces serwera ma już wątki, których fork nie kopiuje bezpiecznie."""
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.processes, mp_context=multiprocessing.get_context("spawn"))
+            log.info(f"Password hasher: Started process pool with {self.processes} workers (max {self.max_pending} pending).")
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+            log.info("Password hasher: Process pool shut down.")
+
+    @property
+    def _executor(self) -> Executor:
+        return self._pool or self._fallback
+
+    async def _run(self, func: Callable[..., T], *args, shed: bool = True) -> T:
+        if shed and self._pending >= self.max_pending:
+            self.rejected += 1
+            raise HasherBusy()
+        self._pending += 1
+        self.peak_pending = max(self.peak_pending, self._pending)
+        started = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self._pending -= 1
+            elapsed = time.perf_counter() - started # Czas w kolejce + obliczenie
+            self.completed += 1
+            self._latency_total += elapsed
+            self._latency_max = max(self._latency_max, elapsed)
+            self._recent_latencies.append(elapsed)
+
+    async def verify(self, plain: str, hashed: str) -> bool:
+        """verify_password w puli; HasherBusy, gdy kolejka jest pełna."""
+        return await self._run(verify_password, plain, hashed)
+
+    async def hash(self, pwd: str) -> str:
+        """get_password_hash w puli; HasherBusy, gdy kolejka jest pełna."""
+        return await self._run(get_password_hash, pwd)
+
+    async def hash_many(self, passwords: List[str]) -> List[str]:
+        """Hashuje wiele haseł równolegle; paczki po kilka haseł ograniczają narzut komunikacji między procesami."""
+        if not passwords:
+            return []
+        chunk_size = max(1, math.ceil(len(passwords) / (self.processes * 4)))
+        chunks = await asyncio.gather(*(
+            self._run(_hash_password_chunk, passwords[i:i + chunk_size], shed=False)
+            for i in range(0, len(passwords), chunk_size)
+        ))
+        return [hashed for chunk in chunks for hashed in chunk]
+
+    def stats(self) -> Dict:
+        """Zwraca statystyki puli hashującej do monitoringu."""
+        recent = sorted(self._recent_latencies)
+        return {
+            "mode": "processes" if self._pool is not None else "threads",
+            "workers": self.processes,
+            "pending": self._pending,
+            "queued": max(0, self._pending - self.processes),
+            "max_pending": self.max_pending,
+            "peak_pending": self.peak_pending,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "failed": self.failed,
+            "avg_latency_ms": round(self._latency_total / self.completed * 1000, 1) if self.completed else 0.0,
+            "p95_latency_ms": round(recent[min(len(recent) - 1, int(len(recent) * 0.95))] * 1000, 1) if recent else 0.0,
+            "max_latency_ms": round(self._latency_max * 1000, 1),
+        }
+
+
+# Globalna pula procesu (uruchamiana i zatrzymywana w lifespan)
+hasher = PasswordHasher(config.PASSWORD_HASH_PROCESSES, config.PASSWORD_HASH_MAX_PENDING)
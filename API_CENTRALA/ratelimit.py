@@ -0,0 +1,130 @@
+# ratelimit.py
+# -*- coding: utf-8 -*-
+
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import config
+
+log = logging.getLogger(__name__)
+
+
+class TokenBuckets:
+    """Zbiór kubełków żetonów (token bucket) dla kluczy jednego zakresu, np. nazw użytkowników.
+
+    Kubełek ma pojemność `burst` i napełnia się w tempie `rate` żetonów/s; stan liczony jest
+    leniwie przy odczycie. Kubełki nieużywane najdłużej są usuwane po przekroczeniu `max_keys`
+    (taki kubełek zwykle i tak jest już pełny, więc usunięcie niczego nie zmienia).
+    Wywoływane wyłącznie z pętli zdarzeń - bez blokad.
+    """
+
+    def __init__(self, rate: float, burst: float, max_keys: int):
+        self.rate = rate
+        self.burst = max(1.0, float(burst))
+        self.max_keys = max(1, int(max_keys))
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict() # klucz -> (żetony, czas)
+
+    def _level(self, key: str, now: float) -> float:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            return self.burst
+        tokens, updated = bucket
+        return min(self.burst, tokens + (now - updated) * self.rate)
+
+    def wait_time(self, key: str, now: float, cost: float = 1.0) -> float:
+        """Sekundy do chwili, gdy będzie `cost` żetonów (0 - dostępne od razu)."""
+        # Koszt większy niż pojemność (duża paczka) przechodzi przy pełnym kubełku i zostawia dług
+        missing = min(cost, self.burst) - self._level(key, now)
+        if missing <= 0:
+            return 0.0
+        return missing / self.rate if self.rate > 0 else float("inf")
+
+    def consume(self, key: str, now: float, cost: float = 1.0):
+        self._buckets[key] = (self._level(key, now) - cost, now)
+        self._buckets.move_to_end(key)
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+class CommandRateLimiter:
+    """Limity poleceń dla szlabanów: per adres klienta, globalny, per użytkownik i per szlaban.
+
+    Przed uwierzytelnieniem sprawdzany jest tylko adres klienta (`check_client`), więc zalew
+    złych haseł nie kosztuje bcrypt ani zapytań do bazy, a obcy nie wyczerpie limitu cudzego
+    konta. Pozostałe zakresy (`check`) - dopiero po uwierzytelnieniu i sprawdzeniu uprawnień
+    (szlabany i pula globalna tylko dla dozwolonych poleceń). Żetony pobierane są tylko,
+    gdy wszystkie zakresy mają je dostępne - odrzucone żądanie niczego nie zużywa.
+    """
+
+    SCOPES = ("client", "global", "user", "barrier")
+
+    def __init__(self):
+        max_keys = config.RATE_LIMIT_MAX_KEYS
+        self._clients = TokenBuckets(config.RATE_LIMIT_CLIENT_RATE, config.RATE_LIMIT_CLIENT_BURST, max_keys)
+        self._global = TokenBuckets(config.RATE_LIMIT_GLOBAL_RATE, config.RATE_LIMIT_GLOBAL_BURST, 1)
+        self._users = TokenBuckets(config.RATE_LIMIT_USER_RATE, config.RATE_LIMIT_USER_BURST, max_keys)
+        self._barriers = TokenBuckets(config.RATE_LIMIT_BARRIER_RATE, config.RATE_LIMIT_BARRIER_BURST, max_keys)
+
+        # Statystyki
+        self.allowed = 0
+        self.rejected: Dict[str, int] = {scope: 0 for scope in self.SCOPES}
+
+    def check_client(self, client: str) -> Tuple[float, Optional[str]]:
+        """Limit przed uwierzytelnieniem: 1 żeton od adresu klienta. Wynik jak w `check`."""
+        if not config.RATE_LIMIT_ENABLED:
+            return 0.0, None
+        return self._take([("client", self._clients, client, 1.0)])
+
+    def check(self, username: Optional[str], barrier_ids: Iterable[str]) -> Tuple[float, Optional[str]]:
+        """Pobiera żetony dla jednego (uwierzytelnionego) żądania: 1 od użytkownika, po 1 od każdego szlabanu i tyle samo z puli globalnej.
+
+        `barrier_ids` to tylko polecenia, które przeszły sprawdzenie uprawnień - odmowa (403) obciąża
+        wyłącznie limit użytkownika, więc nikt nie wyczerpie cudzego limitu szlabanu ani puli globalnej.
+        Zwraca (0, None), gdy żądanie może przejść, albo (sekundy do ponowienia, zakres), gdy przekracza limit.
+        """
+        if not config.RATE_LIMIT_ENABLED:
+            return 0.0, None
+        barrier_ids: List[str] = list(dict.fromkeys(barrier_ids))
+        checks = [("global", self._global, "*", float(len(barrier_ids)))] if barrier_ids else []
+        if username is not None:
+            checks.append(("user", self._users, username, 1.0))
+        checks.extend(("barrier", self._barriers, barrier_id, 1.0) for barrier_id in barrier_ids)
+        retry_after, scope = self._take(checks)
+        if scope is None:
+            self.allowed += 1
+        return retry_after, scope
+
+    def _take(self, checks: List[Tuple[str, TokenBuckets, str, float]]) -> Tuple[float, Optional[str]]:
+        now = time.monotonic()
+        worst_wait, worst_scope = 0.0, None
+        for scope, buckets, key, cost in checks:
+            wait = buckets.wait_time(key, now, cost)
+            if wait > worst_wait:
+                worst_wait, worst_scope = wait, scope
+        if worst_scope is not None:
+            self.rejected[worst_scope] += 1
+            return worst_wait, worst_scope
+
+        for _, buckets, key, cost in checks:
+            buckets.consume(key, now, cost)
+        return 0.0, None
+
+    def stats(self) -> Dict:
+        """Zwraca statystyki limitera do monitoringu."""
+        return {
+            "enabled": config.RATE_LIMIT_ENABLED,
+            "allowed": self.allowed,
+            "rejected": dict(self.rejected),
+            "tracked_clients": len(self._clients),
+            "tracked_users": len(self._users),
+            "tracked_barriers": len(self._barriers),
+        }
+
+
+# Globalny limiter procesu
+command_limiter = CommandRateLimiter()
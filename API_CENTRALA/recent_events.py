@@ -0,0 +1,279 @@
+# recent_events.py
+# -*- coding: utf-8 -*-
+
+import asyncio
+import bisect
+import contextlib
+import heapq
+import logging
+import sqlite3
+import sys
+import time
+from collections import deque
+from itertools import islice
+from typing import Deque, Dict, Iterable, List, Optional, Set, Tuple
+
+import config
+import db
+import db_async
+import archive
+import ingest
+
+log = logging.getLogger(__name__)
+
+# Zdarzenie w buforze: krotka w kolejności kluczy odpowiedzi API (jak db._map_event_row_to_dict)
+EVENT_KEYS = ("id", "barrier_id", "event_type", "trigger_method", "user_id", "success", "details", "failed_action",
+              "received_at", "timestamp")
+EventTuple = Tuple
+
+
+def _intern(value: Optional[str]) -> Optional[str]:
+    # Powtarzalne teksty (ID szlabanu, typ zdarzenia...) współdzielone między krotkami
+    return sys.intern(value) if value is not None else None
+
+def _row_to_tuple(row: Iterable) -> EventTuple:
+    """Wiersz RECENT_EVENT_COLUMNS z bazy -> krotka bufora."""
+    event_id, barrier_id, event_type, trigger_method, user_id, success, details, failed_action, received_at, timestamp = row
+    return (event_id, _intern(barrier_id), _intern(event_type), _intern(trigger_method), _intern(user_id), bool(success),
+            details, _intern(failed_action), received_at, timestamp)
+
+
+class _Buffer:
+    """Pierścień ostatnich zdarzeń jednego szlabanu (rosnąco po ID)."""
+
+    __slots__ = ("events", "complete")
+
+    def __init__(self, capacity: int, complete: bool):
+        self.events: Deque[EventTuple] = deque(maxlen=capacity)
+        self.complete = complete # True - bufor zawiera całą historię szlabanu (nic starszego nie ma w bazie ani archiwum)
+
+    def add(self, event: EventTuple):
+        events = self.events
+        if not events or event[0] > events[-1][0]:
+            if len(events) == events.maxlen:
+                self.complete = False # Najstarsze zdarzenie wypada z bufora
+            events.append(event)
+            return
+        position = bisect.bisect_left(events, (event[0],)) # Zaległe zdarzenie (z innego procesu) - wstaw w miejsce
+        if position < len(events) and events[position][0] == event[0]:
+            return # Już jest
+        if len(events) == events.maxlen:
+            if position == 0:
+                self.complete = False
+                return # Starsze niż wszystko w pełnym buforze
+            events.popleft()
+            self.complete = False
+            position -= 1
+        events.insert(position, event)
+
+
+class RecentEventsCache:
+    """Bufory ostatnich zdarzeń per szlaban - odpowiedzi na typowe zapytania dashboardów bez SQLite.
+
+    Wczytywane przy starcie (ostatnie RECENT_EVENTS_PER_BARRIER zdarzeń każdego szlabanu),
+    uzupełniane callbackiem writera zdarzeń po commicie. Zdarzenia zapisane przez inne procesy
+    wykrywa pętla `sync` (jak w authz_cache: PRAGMA data_version na dedykowanym połączeniu,
+    potem zdarzenia o ID większym niż ostatnie znane) oraz luki w ID własnych commitów
+    (AUTOINCREMENT nadaje kolejne ID, więc luka = cudzy zapis). Dopóki luka nie jest
+    uzupełniona, zapytania idą do bazy.
+
+    Zapytanie jest obsługiwane z pamięci tylko wtedy, gdy wynik jest na pewno taki sam jak
+    z bazy: każdy szlaban, którego bufor nie zawiera całej historii, musi sięgać co najmniej
+    do najstarszego zwracanego ID. W przeciwnym razie `query` zwraca None.
+    Wywoływane wyłącznie z pętli zdarzeń (load - przed startem writera) - bez blokad.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = max(1, int(capacity))
+        self._buffers: Dict[str, _Buffer] = {}
+        self._archived: Set[str] = set() # Szlabany z archiwum w chwili wczytania (historia niepełna)
+        self._max_id = 0
+        self._gaps: List[Tuple[int, int]] = [] # Zakresy (po, przed) ID zapisane przez inne procesy, jeszcze niepobrane
+        self._watch_conn: Optional[sqlite3.Connection] = None
+        self._data_version: Optional[int] = None
+        self._wake: Optional[asyncio.Event] = None
+        self.loaded = False
+
+        # Statystyki
+        self.hits = 0
+        self.misses = 0
+        self.synced_events = 0
+        self.last_load_ms = 0.0
+
+    @property
+    def ready(self) -> bool:
+        return self.loaded and not self._gaps
+
+    # --- Wczytywanie i synchronizacja ---
+
+    def load(self) -> bool:
+        """Wczytuje bufory z bazy (synchronicznie - wywoływać w executorze DB przed startem writera)."""
+        started = time.perf_counter()
+        result = db.load_recent_event_rows(self.capacity)
+        if result is None:
+            log.error("Recent Events: Failed to load buffers, serving events from DB only.")
+            return False
+        rows, max_id = result
+        try:
+            archived = set(archive.archived_barrier_ids())
+        except OSError as e:
+            log.error(f"Recent Events: Cannot list archive ({e}), serving events from DB only.")
+            return False
+
+        per_barrier: Dict[str, List[EventTuple]] = {}
+        for row in rows:
+            event = _row_to_tuple(row)
+            per_barrier.setdefault(event[1], []).append(event)
+        buffers: Dict[str, _Buffer] = {}
+        for barrier_id, events in per_barrier.items():
+            buffer = buffers[barrier_id] = _Buffer(self.capacity, len(events) < self.capacity and barrier_id not in archived)
+            buffer.events.extend(reversed(events)) # Z bazy malejąco
+        self._buffers = buffers
+        self._archived = archived
+        self._max_id = max_id
+        self._gaps = []
+        self.loaded = True
+        self.last_load_ms = round((time.perf_counter() - started) * 1000, 1)
+        log.info(f"Recent Events: Loaded {len(rows)} events of {len(buffers)} barriers (up to ID {max_id}) in {self.last_load_ms} ms.")
+        return True
+
+    def _add(self, event: EventTuple):
+        buffer = self._buffers.get(event[1])
+        if buffer is None:
+            # Szlaban bez zdarzeń w tabeli przy wczytaniu: cała jego historia to zdarzenia, które tu trafią
+            buffer = self._buffers[event[1]] = _Buffer(self.capacity, event[1] not in self._archived)
+        buffer.add(event)
+
+    def on_events(self, rows: List[ingest.CommittedEvent]):
+        """Callback writera zdarzeń: dopisuje zapisane zdarzenia (w kolejności ID)."""
+        if not self.loaded:
+            return
+        for event, received_at, event_id in rows:
+            if event_id > self._max_id + 1:
+                self._gaps.append((self._max_id, event_id)) # Między nimi zapisał ktoś inny
+                if self._wake is not None:
+                    self._wake.set()
+            self._max_id = max(self._max_id, event_id)
+            self._add((event_id, _intern(event.barrier_id), _intern(event.event_type), _intern(event.trigger_method),
+                       _intern(event.user_id), event.success, event.details, _intern(event.failed_action),
+                       received_at, event.timestamp))
+
+    def _data_changed(self) -> bool:
+        """Czy ktoś zatwierdził cokolwiek od ostatniego sprawdzenia (synchronicznie, w executorze)."""
+        if self._watch_conn is None:
+            self._watch_conn = db.open_dedicated_connection()
+        data_version = self._watch_conn.execute("PRAGMA data_version").fetchone()[0]
+        changed = data_version != self._data_version
+        self._data_version = data_version
+        return changed
+
+    async def sync(self):
+        """Dociąga zdarzenia zapisane przez inne procesy: luki w ID i wszystko powyżej ostatniego znanego ID."""
+        try:
+            changed = await db_async.run(self._data_changed)
+        except sqlite3.Error as e:
+            log.error(f"Recent Events: data_version check failed: {e}")
+            self.close()
+            return
+        gaps = list(self._gaps)
+        ranges = gaps + ([(self._max_id, None)] if changed else [])
+        for after_id, before_id in ranges:
+            while True:
+                rows = await db_async.get_event_rows_in_id_range(after_id, before_id)
+                if rows is None:
+                    return # Luki zostają - zapytania idą do bazy do następnej próby
+                for row in rows:
+                    event = _row_to_tuple(row)
+                    self._max_id = max(self._max_id, event[0])
+                    self._add(event)
+                self.synced_events += len(rows)
+                if len(rows) < 10000: # Limit get_event_rows_in_id_range
+                    break
+                after_id = rows[-1][0]
+        self._gaps = [gap for gap in self._gaps if gap not in gaps]
+
+    async def watch(self, interval: float):
+        """Pętla tła (lifespan): synchronizacja co `interval` sekund albo od razu po wykryciu luki."""
+        self._wake = asyncio.Event()
+        while True:
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._wake.wait(), timeout=interval)
+            self._wake.clear()
+            if not self.loaded:
+                continue
+            try:
+                await self.sync()
+            except Exception:
+                log.exception("Recent Events: Unexpected error during sync.")
+
+    def close(self):
+        """Zamyka dedykowane połączenie obserwujące (przy zamykaniu serwera)."""
+        if self._watch_conn is not None:
+            with contextlib.suppress(sqlite3.Error):
+                self._watch_conn.close()
+            self._watch_conn = None
+            self._data_version = None
+
+    # --- Odczyty ---
+
+    def query(self, barrier_ids: Optional[List[str]], limit: int, before_id: Optional[int] = None) -> Optional[List[Dict]]:
+        """Najnowsze `limit` zdarzeń (id < before_id) wskazanych szlabanów (None - wszystkich), malejąco po ID.
+
+        Zwraca None, gdy bufory nie gwarantują wyniku identycznego z bazą - wtedy należy zapytać bazę.
+        """
+        if not self.ready:
+            self.misses += 1
+            return None
+        if barrier_ids is None:
+            if self._archived:
+                self.misses += 1 # Szlabany tylko w archiwum nie mają buforów
+                return None
+            barrier_ids = list(self._buffers)
+
+        sources = []
+        incomplete: List[Optional[_Buffer]] = []
+        for barrier_id in set(barrier_ids):
+            buffer = self._buffers.get(barrier_id)
+            if buffer is None:
+                if barrier_id in self._archived:
+                    incomplete.append(None) # Tylko zarchiwizowane zdarzenia - wszystkie starsze niż cokolwiek w buforach
+                continue
+            if not buffer.complete:
+                incomplete.append(buffer)
+            events = reversed(buffer.events)
+            if before_id is not None:
+                events = (event for event in events if event[0] < before_id)
+            sources.append(events)
+        result = list(islice(heapq.merge(*sources, reverse=True), limit))
+
+        if incomplete:
+            if len(result) < limit:
+                self.misses += 1
+                return None
+            oldest_returned = result[-1][0]
+            if any(buffer is not None and buffer.events and buffer.events[0][0] > oldest_returned for buffer in incomplete):
+                self.misses += 1 # Starsze zdarzenia tego szlabanu mogłyby wejść do wyniku
+                return None
+        self.hits += 1
+        return [dict(zip(EVENT_KEYS, event)) for event in result]
+
+    def stats(self) -> Dict:
+        """Zwraca statystyki buforów do monitoringu."""
+        return {
+            "loaded": self.loaded,
+            "ready": self.ready,
+            "barriers": len(self._buffers),
+            "events": sum(len(buffer.events) for buffer in self._buffers.values()),
+            "complete_barriers": sum(1 for buffer in self._buffers.values() if buffer.complete),
+            "capacity_per_barrier": self.capacity,
+            "max_id": self._max_id,
+            "pending_gaps": len(self._gaps),
+            "hits": self.hits,
+            "misses": self.misses,
+            "synced_events": self.synced_events,
+            "last_load_ms": self.last_load_ms,
+        }
+
+
+# Globalny cache procesu (wczytywany w lifespan)
+cache = RecentEventsCache(config.RECENT_EVENTS_PER_BARRIER)
@@ -0,0 +1,139 @@
+# retention.py
+# -*- coding: utf-8 -*-
+
+import asyncio
+import logging
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from itertools import takewhile
+from typing import Dict, Optional, Tuple
+
+import config
+import db
+import db_async
+import archive
+
+log = logging.getLogger(__name__)
+
+_ID = archive.COLUMNS.index("id")
+_BARRIER_ID = archive.COLUMNS.index("barrier_id")
+_RECEIVED_AT = archive.COLUMNS.index("received_at")
+
+
+class RetentionManager:
+    """Przenosi stare zdarzenia z tabeli barrier_events do skompresowanych segmentów archiwum.
+
+    Każda paczka to: odczyt najstarszych wierszy (bez blokady zapisu), dopisanie
+    bloków do archiwum (poza bazą), a na końcu krótka transakcja DELETE. Jeśli
+    proces padnie między zapisem bloku a DELETE, wiersze zostaną zarchiwizowane
+    ponownie w następnym przebiegu - odczyt archiwum pomija takie duplikaty.
+    """
+
+    def __init__(self, max_age_days: float, batch_size: int, batch_pause: float):
+        self.max_age_days = max_age_days
+        self.batch_size = max(1, int(batch_size))
+        self.batch_pause = batch_pause
+
+        # Statystyki
+        self.passes = 0
+        self.rows_archived = 0
+        self.compressed_bytes = 0
+        self.bytes_reclaimed = 0
+        self.last_pass: Optional[Dict] = None
+
+    def cutoff(self) -> str:
+        """Granica wieku (received_at w ISO) - starsze zdarzenia trafiają do archiwum."""
+        return (datetime.now() - timedelta(days=self.max_age_days)).isoformat()
+
+    def archive_batch(self, cutoff: str) -> Optional[Tuple[int, int, int]]:
+        """Archiwizuje jedną paczkę (synchronicznie - w executorze DB).
+
+        Zwraca (wiersze, bloki, bajty skompresowane) albo None, gdy nie ma nic do przeniesienia.
+        """
+        rows = db.get_oldest_events(self.batch_size)
+        # Tylko spójny prefiks po id: id rośnie razem z received_at, a DELETE usuwa wszystko do max id
+        eligible = list(takewhile(lambda row: row[_RECEIVED_AT] < cutoff, rows))
+        if not eligible:
+            return None
+
+        groups = defaultdict(list)
+        for row in eligible:
+            groups[(row[_BARRIER_ID], row[_RECEIVED_AT][:7])].append(row)
+        compressed = 0
+        for (barrier_id, month), group in groups.items():
+            compressed += archive.append_block(barrier_id, month, group)
+
+        deleted = db.delete_events_up_to(eligible[-1][_ID])
+        if deleted != len(eligible):
+            log.warning(f"Retention: Archived {len(eligible)} rows but deleted {deleted} (ids <= {eligible[-1][_ID]}).")
+        return len(eligible), len(groups), compressed
+
+    async def run_pass(self) -> Dict:
+        """Jeden pełny przebieg retencji: paczki aż do wyczerpania starych zdarzeń."""
+        started = time.perf_counter()
+        cutoff = self.cutoff()
+        before = await db_async.run(db.get_storage_stats)
+        rows = blocks = compressed = 0
+        while True:
+            result = await db_async.run(self.archive_batch, cutoff)
+            if result is None:
+                break
+            rows += result[0]
+            blocks += result[1]
+            compressed += result[2]
+            await asyncio.sleep(self.batch_pause) # Oddaj blokadę zapisu ingestowi między paczkami
+
+        if rows and before["auto_vacuum"] == 2: # INCREMENTAL - zwolnione strony wracają do systemu plików
+            await db_async.run(db.incremental_vacuum)
+        after = await db_async.run(db.get_storage_stats)
+
+        # Odzyskane = strony, które przestały być używane (trafiły na freelistę lub zostały obcięte z pliku)
+        used_before = before["page_count"] - before["freelist_count"]
+        used_after = after["page_count"] - after["freelist_count"]
+        reclaimed = max(0, used_before - used_after) * after["page_size"]
+        file_shrunk = max(0, before["page_count"] - after["page_count"]) * after["page_size"]
+
+        self.passes += 1
+        self.rows_archived += rows
+        self.compressed_bytes += compressed
+        self.bytes_reclaimed += reclaimed
+        self.last_pass = {
+            "finished_at": datetime.now().isoformat(),
+            "cutoff": cutoff,
+            "rows_archived": rows,
+            "blocks_written": blocks,
+            "compressed_bytes": compressed,
+            "bytes_reclaimed": reclaimed,
+            "file_bytes_released": file_shrunk,
+            "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+        }
+        if rows:
+            log.info(f"Retention: Archived {rows} events older than {cutoff} into {blocks} blocks ({compressed} bytes compressed), reclaimed {reclaimed} bytes in {self.last_pass['duration_ms']} ms.")
+        return self.last_pass
+
+    async def run_forever(self, interval: float, startup_delay: float):
+        """Pętla tła (lifespan): przebieg retencji co `interval` sekund."""
+        await asyncio.sleep(startup_delay)
+        while True:
+            try:
+                await self.run_pass()
+            except Exception:
+                log.exception("Retention: Unexpected error during retention pass.")
+            await asyncio.sleep(interval)
+
+    def stats(self) -> Dict:
+        """Zwraca statystyki retencji i archiwum do monitoringu."""
+        return {
+            "max_age_days": self.max_age_days,
+            "passes": self.passes,
+            "rows_archived": self.rows_archived,
+            "compressed_bytes": self.compressed_bytes,
+            "bytes_reclaimed": self.bytes_reclaimed,
+            "last_pass": self.last_pass,
+            "archive": archive.stats(),
+        }
+
+
+# Globalny menedżer retencji (uruchamiany w lifespan)
+manager = RetentionManager(config.RETENTION_MAX_AGE_DAYS, config.RETENTION_BATCH_SIZE, config.RETENTION_BATCH_PAUSE)
@@ -0,0 +1,38 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""Narzędzie do agregatów statystyk zdarzeń Centrali ESZP.
+
+Agregaty godzinowe są aktualizowane przy każdym zapisie zdarzenia. Dla bazy,
+która miała zdarzenia przed wprowadzeniem agregatów, trzeba raz przeliczyć je
+od zera (z katalogu API_CENTRALA, najlepiej przy zatrzymanym serwerze):
+
+    python stats.py backfill
+    python stats.py backfill --database /sciezka/do/eszp.db --no-archive
+"""
+
+import argparse
+import logging
+import time
+
+import config
+import db
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Agregaty statystyk zdarzeń Centrali ESZP")
+    parser.add_argument("command", choices=["backfill"], help="backfill - przelicz agregaty od zera z tabeli zdarzeń i archiwum")
+    parser.add_argument("--database", default=config.DATABASE_FILE, help="Plik bazy danych (domyślnie config.DATABASE_FILE)")
+    parser.add_argument("--no-archive", action="store_true", help="Pomiń zdarzenia przeniesione do archiwum przez retencję")
+    args = parser.parse_args()
+
+    config.DATABASE_FILE = args.database # Pula połączeń tworzona jest leniwie, więc podmiana wystarczy
+    logging.basicConfig(level=config.LOG_LEVEL, format='%(asctime)s [%(levelname)s] %(name)s: %(message)s')
+
+    started = time.perf_counter()
+    db.init_db() # Upewnij się, że schemat (z tabelą agregatów) jest aktualny
+    buckets = db.rebuild_event_stats(include_archive=not args.no_archive)
+    db.close_pool()
+    print(f"Rebuilt {buckets} statistics buckets in {time.perf_counter() - started:.1f} s.")
+
+if __name__ == "__main__":
+    main()
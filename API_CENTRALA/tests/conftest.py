@@ -0,0 +1,35 @@
+# conftest.py
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+
+import pytest
+
+# Moduły centrali importowane są płasko (`import config`), jak przy uruchomieniu z katalogu API_CENTRALA
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+import db
+import db_async
+
+
+@pytest.fixture
+def temp_db(tmp_path, monkeypatch):
+    """Pusta baza w katalogu tymczasowym (schemat w bieżącej wersji) zamiast config.DATABASE_FILE."""
+    monkeypatch.setattr(config, "DATABASE_FILE", str(tmp_path / "test.db"))
+    monkeypatch.setattr(config, "ARCHIVE_DIR", str(tmp_path / "archive"))
+    db.close_pool()
+    db.init_db()
+    yield config.DATABASE_FILE
+    db_async.shutdown_executor()
+    db.close_pool()
+
+
+@pytest.fixture
+def empty_db(tmp_path, monkeypatch):
+    """Jak `temp_db`, ale bez migracji (user_version = 0) - do testów migrations.py."""
+    monkeypatch.setattr(config, "DATABASE_FILE", str(tmp_path / "test.db"))
+    db.close_pool()
+    yield config.DATABASE_FILE
+    db.close_pool()
@@ -0,0 +1,102 @@
+# test_command_gate.py
+# -*- coding: utf-8 -*-
+
+import asyncio
+
+import pytest
+
+import config
+from command_gate import CommandGate
+
+
+class FakeController:
+    """Rejestruje wysłane polecenia; każde kończy się dopiero po `release`."""
+
+    def __init__(self):
+        self.sent = []
+        self.release = asyncio.Event()
+
+    def call(self, barrier_id: str, action: str):
+        async def send():
+            self.sent.append((barrier_id, action))
+            await self.release.wait()
+            return f"{action}#{len(self.sent)}"
+        return send
+
+
+@pytest.fixture(autouse=True)
+def coalescing(monkeypatch):
+    monkeypatch.setattr(config, "BARRIER_COMMAND_COALESCING", True)
+
+
+def _run_all(gate: CommandGate, controller: FakeController, commands):
+    async def scenario():
+        tasks = [asyncio.create_task(gate.run(barrier_id, action, controller.call(barrier_id, action)))
+                 for barrier_id, action in commands]
+        await asyncio.sleep(0.01)
+        controller.release.set()
+        return await asyncio.gather(*tasks)
+    return asyncio.run(scenario())
+
+
+def test_identical_commands_share_one_call():
+    gate, controller = CommandGate(), FakeController()
+    results = _run_all(gate, controller, [("b1", "open")] * 3)
+    assert controller.sent == [("b1", "open")]
+    assert results == ["open#1"] * 3
+    stats = gate.stats()
+    assert (stats["commands"], stats["upstream_calls"], stats["coalesced"]) == (3, 1, 2)
+    assert stats["active_barriers"] == 0 and stats["pending"] == 0
+
+
+def test_only_tail_of_queue_is_coalesced():
+    gate, controller = CommandGate(), FakeController()
+    _run_all(gate, controller, [("b1", "open"), ("b1", "close"), ("b1", "open")])
+    assert controller.sent == [("b1", "open"), ("b1", "close"), ("b1", "open")]
+
+    gate, controller = CommandGate(), FakeController()
+    results = _run_all(gate, controller, [("b1", "open"), ("b1", "open"), ("b1", "close")])
+    assert controller.sent == [("b1", "open"), ("b1", "close")]
+    assert results == ["open#1", "open#1", "close#2"]
+    assert gate.stats()["queued"] == 1
+
+
+def test_commands_for_one_barrier_run_sequentially():
+    gate, controller = CommandGate(), FakeController()
+
+    async def scenario():
+        first = asyncio.create_task(gate.run("b1", "open", controller.call("b1", "open")))
+        second = asyncio.create_task(gate.run("b1", "close", controller.call("b1", "close")))
+        other = asyncio.create_task(gate.run("b2", "close", controller.call("b2", "close")))
+        await asyncio.sleep(0.01)
+        assert controller.sent == [("b1", "open"), ("b2", "close")] # "close" dla b1 czeka na "open"
+        assert gate.stats()["peak_queue_depth"] == 2
+        controller.release.set()
+        await asyncio.gather(first, second, other)
+
+    asyncio.run(scenario())
+    assert controller.sent[-1] == ("b1", "close")
+
+
+def test_cancelled_waiter_does_not_cancel_shared_call():
+    gate, controller = CommandGate(), FakeController()
+
+    async def scenario():
+        first = asyncio.create_task(gate.run("b1", "open", controller.call("b1", "open")))
+        second = asyncio.create_task(gate.run("b1", "open", controller.call("b1", "open")))
+        await asyncio.sleep(0.01)
+        first.cancel() # Rozłączony klient
+        await asyncio.sleep(0.01)
+        controller.release.set()
+        return await second
+
+    assert asyncio.run(scenario()) == "open#1"
+    assert controller.sent == [("b1", "open")]
+
+
+def test_disabled_coalescing_sends_every_command(monkeypatch):
+    monkeypatch.setattr(config, "BARRIER_COMMAND_COALESCING", False)
+    gate, controller = CommandGate(), FakeController()
+    _run_all(gate, controller, [("b1", "open")] * 3)
+    assert len(controller.sent) == 3
+    assert gate.stats()["coalesced"] == 0
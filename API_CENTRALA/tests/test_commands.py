@@ -0,0 +1,213 @@
+# test_commands.py
+# -*- coding: utf-8 -*-
+
+import asyncio
+from datetime import datetime
+
+import pytest
+
+import config
+import db_async
+import models
+from commands import CommandDispatcher, CommandJob, CommandQueueFull
+
+START_ID = 100 # Największe ID zdarzenia w "bazie" w chwili wysłania polecenia
+
+
+@pytest.fixture(autouse=True)
+def fake_db(monkeypatch):
+    async def get_max_event_id():
+        return START_ID
+
+    monkeypatch.setattr(db_async, "get_max_event_id", get_max_event_id)
+    monkeypatch.setattr(config, "COMMAND_EVENT_POLL_INTERVAL", 0)
+
+
+def _dispatcher(**overrides) -> CommandDispatcher:
+    settings = dict(workers=2, max_pending=10, completion_timeout=5.0, job_ttl=600.0, max_jobs=100)
+    settings.update(overrides)
+    return CommandDispatcher(**settings)
+
+
+def _controller(status_code: int = 202, delay: float = 0.0, before_reply=None):
+    async def send():
+        if before_reply is not None:
+            before_reply()
+        await asyncio.sleep(delay)
+        return status_code, {"message": "ok"}
+    return send
+
+
+def _committed(event_id: int, barrier_id: str = "b1", event_type: str = "barrier_opened", success: bool = True,
+               failed_action=None):
+    event = models.BarrierEventDBInput(barrier_id=barrier_id, event_type=event_type, trigger_method="api",
+                                       timestamp=datetime.now().isoformat(), success=success, failed_action=failed_action)
+    return [(event, datetime.now().isoformat(), event_id)]
+
+
+# --- Zakończenie poleceń ---
+
+def test_completion_event_completes_acknowledged_command():
+    dispatcher = _dispatcher()
+
+    async def scenario():
+        job = dispatcher.submit("b1", "open", 1, "jan", _controller(202))
+        await asyncio.sleep(0.01)
+        assert job.state == CommandJob.ACKNOWLEDGED
+        dispatcher.on_events(_committed(START_ID + 1, barrier_id="b2")) # Inny szlaban
+        dispatcher.on_events(_committed(START_ID + 2, event_type="barrier_closed")) # Inna akcja
+        assert job.state == CommandJob.ACKNOWLEDGED
+        dispatcher.on_events(_committed(START_ID + 3))
+        return job
+
+    job = asyncio.run(scenario())
+    assert job.state == CommandJob.COMPLETED
+    assert job.completion_event_id == START_ID + 3
+    assert job.done.is_set()
+    assert dispatcher.stats()["finished"][CommandJob.COMPLETED] == 1
+
+
+def test_events_before_command_was_sent_are_ignored():
+    dispatcher = _dispatcher()
+
+    async def scenario():
+        job = dispatcher.submit("b1", "open", 1, "jan", _controller(202))
+        await asyncio.sleep(0.01)
+        dispatcher.on_events(_committed(START_ID)) # Zapisane przed wysłaniem (np. poprzednie otwarcie)
+        return job
+
+    assert asyncio.run(scenario()).state == CommandJob.ACKNOWLEDGED
+
+
+def test_event_arriving_before_controller_reply_completes_after_ack():
+    dispatcher = _dispatcher()
+
+    async def scenario():
+        job = dispatcher.submit("b1", "open", 1, "jan",
+                                _controller(202, before_reply=lambda: dispatcher.on_events(_committed(START_ID + 1))))
+        await asyncio.sleep(0.01)
+        return job
+
+    job = asyncio.run(scenario())
+    assert job.state == CommandJob.COMPLETED
+    assert job.completion_event_id == START_ID + 1
+
+
+def test_failure_event_fails_command():
+    dispatcher = _dispatcher()
+
+    async def scenario():
+        job = dispatcher.submit("b1", "service/end", 1, "jan", _controller(202))
+        await asyncio.sleep(0.01)
+        dispatcher.on_events(_committed(START_ID + 1, event_type="barrier_failure", success=False, failed_action="close"))
+        return job
+
+    job = asyncio.run(scenario())
+    assert job.state == CommandJob.FAILED
+    assert "barrier_failure" in job.detail
+
+
+def test_controller_reply_without_movement_or_with_error():
+    dispatcher = _dispatcher()
+
+    async def scenario():
+        nothing_to_do = dispatcher.submit("b1", "open", 1, "jan", _controller(200))
+        rejected = dispatcher.submit("b2", "open", 1, "jan", _controller(503))
+        await asyncio.sleep(0.01)
+        return nothing_to_do, rejected
+
+    nothing_to_do, rejected = asyncio.run(scenario())
+    assert nothing_to_do.state == CommandJob.COMPLETED
+    assert rejected.state == CommandJob.FAILED
+    assert rejected.controller_status == 503
+
+
+def test_command_expires_without_completion_event():
+    dispatcher = _dispatcher(completion_timeout=0.02)
+
+    async def scenario():
+        job = dispatcher.submit("b1", "open", 1, "jan", _controller(202))
+        await dispatcher.wait(job, 1.0)
+        return job
+
+    job = asyncio.run(scenario())
+    assert job.state == CommandJob.EXPIRED
+    assert dispatcher._awaiting == {}
+
+
+def test_polling_completes_command_with_event_from_other_process(monkeypatch):
+    monkeypatch.setattr(config, "COMMAND_EVENT_POLL_INTERVAL", 0.01)
+    queried = []
+
+    async def get_barrier_events_after(after_ids):
+        queried.append(dict(after_ids))
+        return [(START_ID + 5, "b1", "barrier_opened", 1, None)]
+
+    monkeypatch.setattr(db_async, "get_barrier_events_after", get_barrier_events_after)
+    dispatcher = _dispatcher()
+
+    async def scenario():
+        dispatcher.start()
+        job = dispatcher.submit("b1", "open", 1, "jan", _controller(202))
+        await dispatcher.wait(job, 1.0)
+        await dispatcher.stop()
+        return job
+
+    job = asyncio.run(scenario())
+    assert job.state == CommandJob.COMPLETED
+    assert job.completion_event_id == START_ID + 5
+    assert {"b1": START_ID} in queried
+    assert dispatcher.polled_events >= 1
+
+
+# --- Kolejka i usuwanie zakończonych ---
+
+def test_full_queue_rejects_command():
+    dispatcher = _dispatcher(workers=1, max_pending=1)
+
+    async def scenario():
+        dispatcher.start()
+        dispatcher.submit("b1", "open", 1, "jan", _controller(200, delay=0.1))
+        await asyncio.sleep(0.01) # Wykonawca zajęty pierwszym
+        dispatcher.submit("b2", "open", 1, "jan", _controller(200))
+        with pytest.raises(CommandQueueFull):
+            dispatcher.submit("b3", "open", 1, "jan", _controller(200))
+        await dispatcher.stop()
+
+    asyncio.run(scenario())
+    assert dispatcher.rejected == 1
+    assert dispatcher.finished[CommandJob.FAILED] == 1 # Niewysłane przy zatrzymaniu
+
+
+def test_finished_jobs_evicted_oldest_first_when_store_is_full():
+    dispatcher = _dispatcher(max_jobs=2)
+
+    async def scenario():
+        jobs = []
+        for barrier_id in ("b1", "b2", "b3"):
+            jobs.append(dispatcher.submit(barrier_id, "open", 1, "jan", _controller(200)))
+            await asyncio.sleep(0.01)
+        return jobs
+
+    first, second, third = asyncio.run(scenario())
+    assert dispatcher.get(first.id) is None
+    assert dispatcher.get(second.id) is second
+    assert dispatcher.get(third.id) is third
+
+
+def test_finished_jobs_evicted_after_ttl_but_unfinished_kept():
+    dispatcher = _dispatcher(job_ttl=0.0, max_jobs=1)
+
+    async def scenario():
+        pending = dispatcher.submit("b1", "open", 1, "jan", _controller(202)) # Czeka na zdarzenie wykonania
+        finished = dispatcher.submit("b2", "open", 1, "jan", _controller(200))
+        await asyncio.sleep(0.01)
+        latest = dispatcher.submit("b3", "open", 1, "jan", _controller(202))
+        await asyncio.sleep(0.01)
+        return pending, finished, latest
+
+    pending, finished, latest = asyncio.run(scenario())
+    assert dispatcher.get(finished.id) is None
+    assert dispatcher.get(pending.id) is pending
+    assert dispatcher.get(latest.id) is latest
+    assert dispatcher.stats()["stored_jobs"] == 2
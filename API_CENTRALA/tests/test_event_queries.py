@@ -0,0 +1,187 @@
+# test_event_queries.py
+# -*- coding: utf-8 -*-
+
+import asyncio
+import json
+
+import pytest
+from fastapi import HTTPException
+
+import config
+import core
+import db
+import models
+import timestamps
+
+RECEIVED_AT = "2026-03-05T12:00:00"
+
+
+def _event(barrier_id: str, timestamp: str, event_type: str = "barrier_opened", trigger_method: str = "api",
+           user_id: str = "1", success: bool = True) -> models.BarrierEventDBInput:
+    return models.BarrierEventDBInput(barrier_id=barrier_id, event_type=event_type, trigger_method=trigger_method,
+                                      timestamp=timestamp, user_id=user_id, success=success)
+
+
+def _ids(events):
+    return [event["id"] for event in events]
+
+
+def _us(value: str) -> int:
+    return timestamps.iso_to_epoch_us(value)
+
+
+# --- Filtry (EventFilters) ---
+
+@pytest.fixture
+def events(temp_db):
+    db.insert_events([(event, RECEIVED_AT) for event in (
+        _event("b1", "2026-03-01T09:00:00+00:00"),                                      # 1
+        _event("b1", "2026-03-01T12:00:00+02:00", trigger_method="remote"),             # 2 - 10:00 UTC
+        _event("b2", "2026-03-01T10:30:00+00:00", event_type="barrier_closed"),         # 3
+        _event("b1", "2026-03-01T11:00:00+00:00", user_id="7", success=False),          # 4
+        _event("b2", "2026-03-01T11:30:00+00:00", user_id="7"),                         # 5
+        _event("b1", "2026-03-03T08:00:00+00:00"),                                      # 6
+    )])
+
+
+def test_time_range_compares_instants_not_text(events):
+    # Tekstowo '2026-03-01T12:00:00+02:00' > '...T10:30', ale to 10:00 UTC - przed zakresem
+    filters = db.EventFilters(since_us=_us("2026-03-01T10:30:00+00:00"), until_us=_us("2026-03-01T11:30:00+00:00"))
+    assert _ids(db.get_events_from_db(filters=filters)) == [4, 3]
+    filters = db.EventFilters(since_us=_us("2026-03-01T10:00:00+00:00"), until_us=_us("2026-03-01T10:00:00.000001+00:00"))
+    assert _ids(db.get_events_from_db(filters=filters)) == [2] # since włącznie, until wyłącznie
+
+
+def test_attribute_filters_combine_with_barriers_and_failures(events):
+    assert _ids(db.get_events_from_db(filters=db.EventFilters(event_type="barrier_closed"))) == [3]
+    assert _ids(db.get_events_from_db(["b1"], filters=db.EventFilters(trigger_method="remote"))) == [2]
+    assert _ids(db.get_events_from_db(filters=db.EventFilters(user_id="7"))) == [5, 4]
+    assert _ids(db.get_events_from_db(["b1", "b2"], only_failures=True, filters=db.EventFilters(user_id="7"))) == [4]
+    assert _ids(db.get_events_from_db(["b2"], filters=db.EventFilters(user_id="7", since_us=_us("2026-03-02T00:00:00+00:00")))) == []
+
+
+def test_wide_and_narrow_ranges_give_same_results(events):
+    # Wąski zakres czyta indeks czasu, szeroki - indeks (barrier_id, id); wynik ten sam
+    narrow = db.EventFilters(since_us=_us("2026-03-01T00:00:00+00:00"), until_us=_us("2026-03-02T00:00:00+00:00"))
+    wide = db.EventFilters(since_us=_us("2026-01-01T00:00:00+00:00"), until_us=_us("2026-03-02T00:00:00+00:00"))
+    assert db._choose_event_index(["b1"], False, narrow) == "idx_events_barrier_time"
+    assert db._choose_event_index(["b1"], False, wide) == "idx_events_barrier_id"
+    assert _ids(db.get_events_from_db(["b1"], filters=narrow)) == _ids(db.get_events_from_db(["b1"], filters=wide)) == [4, 2, 1]
+    assert _ids(db.get_events_from_db(["b1"], limit=2, before_id=4, filters=narrow)) == [2, 1]
+
+
+def test_matches_agrees_with_sql_filters(events):
+    filters = db.EventFilters(since_us=_us("2026-03-01T10:00:00+00:00"), until_us=_us("2026-03-02T00:00:00+00:00"), user_id="1")
+    with db.get_db() as conn:
+        rows = [dict(row) for row in conn.execute(f"SELECT {db.EVENT_COLUMNS} FROM {config.TABLE_BARRIER_EVENTS} ORDER BY id DESC")]
+    assert [row["id"] for row in rows if filters.matches(row)] == _ids(db.get_events_from_db(filters=filters)) == [3, 2]
+
+
+def test_event_filters_dependency_parses_iso_bounds():
+    assert asyncio.run(core.event_filters()) is None
+    filters = asyncio.run(core.event_filters(since="2026-03-01T10:00:00+00:00", event_type="barrier_opened"))
+    assert filters == db.EventFilters(since_us=_us("2026-03-01T10:00:00+00:00"), event_type="barrier_opened")
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(core.event_filters(until="jutro"))
+    assert error.value.status_code == 400
+
+
+# --- Plan zapytań wielu szlabanów (IN albo skan najnowszych id) ---
+
+@pytest.fixture
+def feed(temp_db):
+    for number in range(10):
+        db.create_db_barrier(f"b{number}", f"http://controller{number}")
+    rows = [(_event(f"b{i % 9}", "2026-03-01T10:00:00", success=i % 4 != 0), RECEIVED_AT) for i in range(300)]
+    rows[5:5] = [(_event("b9", "2026-03-01T09:00:00", success=False), RECEIVED_AT)] * 3 # Rzadki szlaban - tylko stare zdarzenia
+    db.insert_events(rows)
+
+
+def _page(monkeypatch, plan: str, barrier_ids, **kwargs):
+    monkeypatch.setattr(config, "EVENT_FEED_PLAN", plan)
+    return _ids(db.get_events_from_db(barrier_ids, **kwargs))
+
+
+@pytest.mark.parametrize("barrier_ids", [["b1", "b2"], ["b0", "b3", "b5", "b7", "b8"], ["b1", "b9"], ["b9", "b9"]])
+@pytest.mark.parametrize("kwargs", [{"limit": 20}, {"limit": 50, "before_id": 120}, {"limit": 10, "only_failures": True},
+                                    {"limit": 10, "before_id": 200, "after_id": 150}, {"limit": 10, "after_id": 280}])
+def test_feed_scan_and_index_plans_return_same_page(feed, monkeypatch, barrier_ids, kwargs):
+    expected = _page(monkeypatch, "index", barrier_ids, **kwargs)
+    assert _page(monkeypatch, "scan", barrier_ids, **kwargs) == expected
+    assert _page(monkeypatch, "auto", barrier_ids, **kwargs) == expected
+
+
+def test_feed_scan_window_falls_back_to_index_for_sparse_barriers(feed, monkeypatch):
+    # Zdarzenia b9 leżą daleko poza oknem skanu - resztę strony dobiera plan IN
+    assert _page(monkeypatch, "scan", ["b9", "b9"], limit=5) == [8, 7, 6]
+    assert _page(monkeypatch, "scan", ["b1", "b9"], limit=40)[-4:] == [8, 7, 6, 2]
+
+
+def test_planner_prefers_scan_for_many_barriers(feed, monkeypatch):
+    monkeypatch.setattr(config, "EVENT_FEED_PLAN", "auto")
+    many = [f"b{number}" for number in range(8)]
+    with db.get_db() as conn:
+        assert db._use_feed_scan(conn, many, False, None, None, None, 20)
+        assert not db._use_feed_scan(conn, ["b1", "b2"], False, None, None, None, 20)
+        assert not db._use_feed_scan(conn, many, False, None, 100, None, 20) # Doganianie (rosnąco) zawsze po indeksie
+        assert not db._use_feed_scan(conn, many, False, None, None, db.EventFilters(user_id="1"), 20)
+
+
+# --- Paginacja po kluczu i eksport NDJSON ---
+
+@pytest.fixture
+def many_events(temp_db, monkeypatch):
+    monkeypatch.setattr(config, "RECENT_EVENTS_ENABLED", False)
+    db.insert_events([(_event(f"b{i % 3}", "2026-03-01T10:00:00", success=i % 5 != 0), RECEIVED_AT) for i in range(25)])
+
+
+def _json_page(**kwargs):
+    response = asyncio.run(core.events_response(None, **kwargs))
+    return json.loads(response.body), response.headers.get(core.EVENT_CURSOR_HEADER)
+
+
+def _ndjson(**kwargs):
+    async def collect():
+        response = await core.events_response(None, output_format="ndjson", **kwargs)
+        return "".join([chunk async for chunk in response.body_iterator])
+    return [json.loads(line) for line in asyncio.run(collect()).splitlines()]
+
+
+def test_cursor_pages_through_all_events_without_gaps(many_events):
+    seen, cursor = [], None
+    while True:
+        page, cursor = _json_page(limit=10, cursor=cursor)
+        seen += _ids(page)
+        if cursor is None:
+            break
+    assert seen == list(range(25, 0, -1))
+
+    page, cursor = _json_page(limit=10, after_id=20) # Doganianie: rosnąco, kursor zawsze
+    assert _ids(page) == [21, 22, 23, 24, 25]
+    assert core.decode_event_cursor(cursor) == {"before_id": None, "after_id": 25}
+
+
+def test_bad_cursor_is_rejected(many_events):
+    with pytest.raises(HTTPException) as error:
+        _json_page(cursor="nie-kursor")
+    assert error.value.status_code == 400
+
+
+def test_batches_use_keyset_and_respect_limit(many_events):
+    batches = list(db.iter_event_batches_from_db(batch_size=10))
+    assert [len(batch) for batch in batches] == [10, 10, 5]
+    assert [event["id"] for batch in batches for event in batch] == list(range(25, 0, -1))
+
+    batches = list(db.iter_event_batches_from_db(["b0"], after_id=3, limit=5, batch_size=2))
+    assert [_ids(batch) for batch in batches] == [[4, 7], [10, 13], [16]]
+    failures = [event for batch in db.iter_event_batches_from_db(only_failures=True, before_id=20) for event in batch]
+    assert _ids(failures) == [16, 11, 6, 1]
+    assert list(db.iter_event_batches_from_db([])) == []
+
+
+def test_ndjson_export_is_not_capped_by_max_limit(many_events, monkeypatch):
+    monkeypatch.setattr(config, "MAX_EVENT_LIMIT", 10)
+    events = _ndjson()
+    assert _ids(events) == list(range(25, 0, -1))
+    assert events[0]["success"] is True and "event_ts_us" not in events[0]
+    assert _ids(_ndjson(limit=3, cursor=core.encode_event_cursor(before_id=10))) == [9, 8, 7]
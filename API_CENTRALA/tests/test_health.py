@@ -0,0 +1,64 @@
+# test_health.py
+# -*- coding: utf-8 -*-
+
+from health import CircuitBreaker
+
+
+def test_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(failure_threshold=3, open_seconds=60)
+    assert breaker.record_failure() is False
+    assert breaker.record_failure() is False
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow()
+
+    assert breaker.record_failure() is True # Właśnie się otworzył
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+    assert 0 < breaker.retry_after() <= 60
+    assert breaker.record_failure() is False # Już otwarty
+
+
+def test_success_resets_failure_count():
+    breaker = CircuitBreaker(failure_threshold=2, open_seconds=60)
+    breaker.record_failure()
+    breaker.record_success()
+    assert breaker.record_failure() is False
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.retry_after() == 0.0
+
+
+def test_half_open_allows_single_trial_and_closes_on_success():
+    breaker = CircuitBreaker(failure_threshold=1, open_seconds=0)
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+
+    assert breaker.allow() # Czas otwarcia minął - jedna próba
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow() # Druga czeka na wynik pierwszej
+
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.consecutive_failures == 0
+    assert breaker.allow() and breaker.allow()
+
+
+def test_half_open_failure_reopens():
+    breaker = CircuitBreaker(failure_threshold=5, open_seconds=0)
+    for _ in range(5):
+        breaker.record_failure()
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+
+    breaker.open_seconds = 60
+    assert breaker.record_failure() is True # Jeden błąd w half-open wystarcza
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+
+def test_probe_success_closes_open_breaker():
+    breaker = CircuitBreaker(failure_threshold=1, open_seconds=60)
+    breaker.record_failure()
+    assert not breaker.allow()
+    breaker.record_success() # Udana sonda /status
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow()
@@ -0,0 +1,244 @@
+# test_ingest.py
+# -*- coding: utf-8 -*-
+
+import asyncio
+import sqlite3
+from datetime import datetime
+
+import pytest
+
+import config
+import db
+import db_async
+import ingest
+import models
+
+
+def _event(barrier_id: str = "b1") -> models.BarrierEventDBInput:
+    return models.BarrierEventDBInput(barrier_id=barrier_id, event_type="barrier_opened", trigger_method="api",
+                                      timestamp=datetime.now().isoformat(), success=True)
+
+
+class FakeStore:
+    """Zastępuje db_async.insert_events: nadaje kolejne ID, wcześniej rzuca zaplanowane błędy."""
+
+    def __init__(self, failures=(), reject_barrier=None, permits=None):
+        self.failures = list(failures) # Wyjątki rzucane przez kolejne wywołania
+        self.reject_barrier = reject_barrier # Zdarzenia tego szlabanu odrzucane jak błędne dane
+        self.permits = permits # asyncio.Semaphore - każdy zapis czeka na zezwolenie
+        self.calls = 0
+        self.stored = []
+
+    async def __call__(self, rows):
+        self.calls += 1
+        if self.permits is not None:
+            await self.permits.acquire()
+        if self.failures:
+            raise self.failures.pop(0)
+        if any(event.barrier_id == self.reject_barrier for event, _ in rows):
+            raise sqlite3.IntegrityError("CHECK constraint failed")
+        first = len(self.stored) + 1
+        self.stored.extend(rows)
+        return list(range(first, first + len(rows)))
+
+
+@pytest.fixture
+def store(monkeypatch):
+    monkeypatch.setattr(config, "INGEST_RETRY_DELAY", 0)
+    fake = FakeStore()
+    monkeypatch.setattr(db_async, "insert_events", fake)
+    return fake
+
+
+def _writer(max_rows: int = 100, high_water: int = 1000, low_water: int = 500) -> ingest.GroupCommitWriter:
+    return ingest.GroupCommitWriter(max_rows, 0.001, high_water, low_water)
+
+
+# --- Wspólny commit ---
+
+def test_concurrent_submissions_share_one_commit(store):
+    writer = _writer()
+
+    async def scenario():
+        await writer.start()
+        received_at = datetime.now().isoformat()
+        results = await asyncio.gather(*(writer.submit([_event()] * size, received_at) for size in (1, 3, 2)))
+        await writer.stop()
+        return results
+
+    assert asyncio.run(scenario()) == [[1], [2, 3, 4], [5, 6]] # Każde zgłoszenie dostaje swoje ID
+    assert store.calls == 1
+    assert writer.batches_committed == 1 and writer.rows_committed == 6
+
+
+def test_batch_limited_to_max_rows(store):
+    writer = _writer(max_rows=2)
+
+    async def scenario():
+        await writer.start()
+        received_at = datetime.now().isoformat()
+        await asyncio.gather(*(writer.submit([_event()], received_at) for _ in range(5)))
+        await writer.stop()
+
+    asyncio.run(scenario())
+    assert store.calls == 3
+    assert writer.stats()["avg_batch_rows"] == pytest.approx(5 / 3, abs=0.01)
+
+
+def test_submit_gets_none_on_failure_without_retry(store):
+    store.failures = [sqlite3.OperationalError("disk I/O error")]
+    writer = _writer()
+
+    async def scenario():
+        await writer.start()
+        result = await writer.submit([_event()], datetime.now().isoformat())
+        await writer.stop()
+        return result
+
+    assert asyncio.run(scenario()) is None
+    assert store.calls == 1
+    assert writer.batches_failed == 1
+
+
+def test_acknowledged_commits_are_synced_to_disk(temp_db):
+    # Odpowiedź z ID zdarzeń potwierdza zapis odporny na utratę zasilania (WAL + synchronous=FULL)
+    with db.get_db() as conn:
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        assert conn.execute("PRAGMA synchronous").fetchone()[0] == 2 # FULL
+
+
+# --- Ponawianie ---
+
+def test_write_behind_retries_transient_errors(store):
+    store.failures = [sqlite3.OperationalError("database is locked")] * 2
+    writer = _writer()
+
+    async def scenario():
+        await writer.start()
+        assert writer.enqueue([_event(), _event()], datetime.now().isoformat())
+        await writer.stop()
+
+    asyncio.run(scenario())
+    assert len(store.stored) == 2
+    assert writer.rows_committed == 2
+    assert writer.batches_failed == 2
+    assert writer.retries == 2
+    assert writer.dropped_rows == 0
+
+
+def test_write_behind_drops_after_retry_limit(store, monkeypatch):
+    monkeypatch.setattr(config, "INGEST_WRITE_RETRIES", 3)
+    store.failures = [sqlite3.OperationalError("database is locked")] * 10
+    writer = _writer()
+
+    async def scenario():
+        await writer.start()
+        writer.enqueue([_event()], datetime.now().isoformat())
+        await writer.stop()
+
+    asyncio.run(scenario())
+    assert store.calls == 3
+    assert writer.dropped_rows == 1
+    assert writer.rows_committed == 0
+
+
+def test_data_error_splits_batch_and_rejects_only_bad_submission(store):
+    store.reject_barrier = "bad"
+    writer = _writer()
+
+    async def scenario():
+        await writer.start()
+        received_at = datetime.now().isoformat()
+        results = await asyncio.gather(*(writer.submit([_event(barrier_id)], received_at)
+                                         for barrier_id in ("b1", "b2", "bad", "b3")))
+        await writer.stop()
+        return results
+
+    results = asyncio.run(scenario())
+    assert results[2] is None
+    assert all(result is not None and len(result) == 1 for i, result in enumerate(results) if i != 2)
+    assert sorted(event.barrier_id for event, _ in store.stored) == ["b1", "b2", "b3"]
+    assert writer.batches_split >= 1
+    assert writer.dropped_rows == 0
+
+
+def test_write_behind_data_error_drops_only_bad_rows(store):
+    store.reject_barrier = "bad"
+    writer = _writer()
+
+    async def scenario():
+        await writer.start()
+        received_at = datetime.now().isoformat()
+        for barrier_id in ("b1", "bad", "b2"):
+            writer.enqueue([_event(barrier_id)], received_at)
+        await writer.stop()
+
+    asyncio.run(scenario())
+    assert [event.barrier_id for event, _ in store.stored] == ["b1", "b2"]
+    assert writer.dropped_rows == 1
+    assert writer.retries == 0
+
+
+# --- Przepełnienie kolejki ---
+
+def test_queue_sheds_above_high_water_until_below_low_water(store):
+    store.permits = asyncio.Semaphore(0)
+    writer = _writer(max_rows=4, high_water=10, low_water=5)
+
+    async def scenario():
+        received_at = datetime.now().isoformat()
+        await writer.start()
+        writer.enqueue([_event()], received_at)
+        await asyncio.sleep(0.05) # Writer zabiera pierwsze zdarzenie i czeka na zapis
+        for _ in range(10):
+            writer.enqueue([_event()], received_at)
+        with pytest.raises(ingest.IngestQueueFull) as full:
+            writer.enqueue([_event()], received_at)
+        assert full.value.retry_after == config.INGEST_RETRY_AFTER_MAX # Brak zapisów - nieznane tempo
+        assert writer.stats()["shedding"]
+
+        store.permits.release() # Zapis pierwszego zdarzenia; writer bierze 4 z 10
+        await asyncio.sleep(0.05)
+        assert writer.stats()["pending_rows"] == 6
+        with pytest.raises(ingest.IngestQueueFull): # Histereza: poniżej high_water, ale nie poniżej low_water
+            writer.enqueue([_event()], received_at)
+
+        store.permits.release() # Writer bierze kolejne 4 - zostają 2 < low_water
+        await asyncio.sleep(0.05)
+        assert writer.enqueue([_event()], received_at)
+        assert not writer.stats()["shedding"]
+
+        for _ in range(10):
+            store.permits.release()
+        await writer.stop()
+
+    asyncio.run(scenario())
+    assert writer.rows_rejected == 2
+    assert writer.rows_committed == 12
+    assert writer.dropped_rows == 0
+
+
+def test_submit_rejected_when_queue_full(store):
+    store.permits = asyncio.Semaphore(0)
+    writer = _writer(max_rows=100, high_water=3, low_water=1)
+
+    async def scenario():
+        received_at = datetime.now().isoformat()
+        await writer.start()
+        writer.enqueue([_event()], received_at)
+        await asyncio.sleep(0.05)
+        writer.enqueue([_event(), _event()], received_at)
+        with pytest.raises(ingest.IngestQueueFull):
+            await writer.submit([_event(), _event()], received_at)
+        for _ in range(10):
+            store.permits.release()
+        await writer.stop()
+
+    asyncio.run(scenario())
+    assert writer.rows_rejected == 2
+    assert writer.rows_committed == 3
+
+
+def test_enqueue_refused_when_writer_not_running(store):
+    writer = _writer()
+    assert writer.enqueue([_event()], datetime.now().isoformat()) is False
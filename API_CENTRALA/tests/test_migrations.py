@@ -0,0 +1,102 @@
+# test_migrations.py
+# -*- coding: utf-8 -*-
+
+from datetime import datetime
+
+import pytest
+
+import config
+import db
+import migrations
+
+
+def _migrate_to(version: int, monkeypatch) -> int:
+    """Podnosi schemat tylko do `version` (jak baza wydanej wcześniej wersji aplikacji)."""
+    with monkeypatch.context() as patch:
+        patch.setattr(migrations, "MIGRATIONS", migrations.MIGRATIONS[:version])
+        patch.setattr(migrations, "LATEST_VERSION", version)
+        with db.get_db() as conn:
+            return migrations.migrate(conn)
+
+
+def _migrate() -> int:
+    with db.get_db() as conn:
+        return migrations.migrate(conn)
+
+
+def _schema():
+    with db.get_db() as conn:
+        return sorted(tuple(row) for row in conn.execute("SELECT type, name, tbl_name, sql FROM sqlite_master"))
+
+
+def _add_legacy_rows():
+    """Użytkownik i zdarzenie w kolumnach schematu z wersji 1."""
+    now = datetime.now().isoformat()
+    with db.get_db() as conn:
+        conn.execute(f"INSERT INTO {config.TABLE_USERS} (username, hashed_password) VALUES ('jan', 'x')")
+        conn.execute(f"""INSERT INTO {config.TABLE_BARRIER_EVENTS}
+                         (barrier_id, event_type, trigger_method, event_timestamp, user_id, success, received_at)
+                         VALUES ('b1', 'barrier_opened', 'api', ?, '1', 1, ?)""", (now, now))
+
+
+def _fresh_schema(tmp_path, monkeypatch):
+    """Schemat bazy utworzonej od zera (osobny plik), do porównania z bazą po migracji."""
+    database_file = config.DATABASE_FILE
+    db.close_pool()
+    monkeypatch.setattr(config, "DATABASE_FILE", str(tmp_path / "fresh.db"))
+    _migrate()
+    schema = _schema()
+    db.close_pool()
+    monkeypatch.setattr(config, "DATABASE_FILE", database_file)
+    return schema
+
+
+def test_versions_are_consecutive():
+    assert [version for version, _, _ in migrations.MIGRATIONS] == list(range(1, migrations.LATEST_VERSION + 1))
+
+
+def test_migrate_from_empty_database(empty_db):
+    assert _migrate() == migrations.LATEST_VERSION
+    with db.get_db() as conn:
+        assert migrations.get_schema_version(conn) == migrations.LATEST_VERSION
+        columns = {row["name"] for row in conn.execute(f"PRAGMA table_info({config.TABLE_USERS})")}
+        assert "token_generation" in columns
+        assert conn.execute(f"SELECT generation FROM {config.TABLE_AUTHZ_GENERATION}").fetchone()[0] == 0
+
+
+@pytest.mark.parametrize("start_version", range(1, migrations.LATEST_VERSION))
+def test_migrate_from_intermediate_version(empty_db, tmp_path, monkeypatch, start_version):
+    latest_schema = _fresh_schema(tmp_path, monkeypatch)
+    assert _migrate_to(start_version, monkeypatch) == start_version
+    _add_legacy_rows()
+
+    assert _migrate() == migrations.LATEST_VERSION
+    assert _schema() == latest_schema
+    with db.get_db() as conn:
+        event = conn.execute(f"SELECT barrier_id, received_ts_us FROM {config.TABLE_BARRIER_EVENTS}").fetchone()
+        user = conn.execute(f"SELECT token_generation FROM {config.TABLE_USERS} WHERE username = 'jan'").fetchone()
+    assert event["barrier_id"] == "b1"
+    if start_version < 5:
+        assert event["received_ts_us"] is not None # Backfill w migracji 5
+    assert user["token_generation"] == 0
+
+
+def test_migrate_database_created_before_versioning(empty_db):
+    # Bazy sprzed migrations.py: tabele z wersji 1, ale user_version = 0
+    with db.get_db() as conn:
+        for statement in migrations.MIGRATIONS[0][2]:
+            conn.execute(statement)
+    _add_legacy_rows()
+
+    assert _migrate() == migrations.LATEST_VERSION
+    with db.get_db() as conn:
+        event = conn.execute(f"SELECT event_ts_us, received_ts_us FROM {config.TABLE_BARRIER_EVENTS}").fetchone()
+        assert event["event_ts_us"] is not None and event["received_ts_us"] is not None
+
+
+def test_current_and_newer_schema_left_untouched(empty_db):
+    _migrate()
+    assert _migrate() == migrations.LATEST_VERSION
+    with db.get_db() as conn:
+        conn.execute(f"PRAGMA user_version = {migrations.LATEST_VERSION + 1}")
+    assert _migrate() == migrations.LATEST_VERSION + 1
@@ -0,0 +1,57 @@
+# test_provisioning.py
+# -*- coding: utf-8 -*-
+
+import pytest
+from fastapi import HTTPException
+
+import core
+import db
+
+
+def test_users_bulk_reports_conflicts_in_input_order(temp_db):
+    db.create_db_user("jan", "hash")
+    results = db.create_db_users_bulk([("anna", "h1"), ("jan", "h2"), ("ewa", "h3"), ("anna", "h4")])
+    assert [result_status for result_status, _ in results] == ["created", "conflict", "created", "conflict"]
+    assert results[0][1] == db.get_user_by_username("anna")["id"]
+    assert db.get_user_by_username("anna")["hashed_password"] == "h1" # Duplikat w paczce: wygrywa pierwszy
+    assert db.get_existing_usernames(["jan", "anna", "ola"]) == {"jan", "anna"}
+
+
+def test_bulk_is_not_limited_by_sqlite_parameter_count(temp_db):
+    results = db.create_db_users_bulk([(f"user{number}", "hash") for number in range(1500)])
+    assert all(result_status == "created" for result_status, _ in results)
+    assert len({user_id for _, user_id in results}) == 1500
+
+
+def test_barriers_bulk_conflicts_on_id_or_url(temp_db):
+    db.create_db_barrier("b1", "http://c1")
+    results = db.create_db_barriers_bulk([("b1", "http://new"), ("b2", "http://c1"), ("b3", "http://c3"),
+                                          ("b4", "http://c3"), ("b3", "http://c5")])
+    assert [result_status for result_status, _ in results] == ["conflict", "conflict", "created", "conflict", "conflict"]
+    assert results[2][1] is not None
+
+
+def test_permissions_bulk_statuses(temp_db):
+    db.create_db_users_bulk([("jan", "hash"), ("anna", "hash")])
+    db.create_db_barriers_bulk([("b1", "http://c1"), ("b2", "http://c2")])
+    results, user_ids = db.grant_db_permissions_bulk([("jan", "b1", "operator"), ("jan", "b1", "technician"),
+                                                      ("ola", "b1", "operator"), ("anna", "b9", "operator"),
+                                                      ("anna", "b2", "technician")])
+    assert [result_status for result_status, _ in results] == ["created", "conflict", "user_not_found", "barrier_not_found", "created"]
+    assert set(user_ids) == {"jan", "anna"}
+    assert db.get_db_permission_level(user_ids["jan"], "b1") == "operator"
+    assert db.get_db_permission_level(user_ids["anna"], "b2") == "technician"
+
+
+def test_bulk_response_maps_statuses():
+    response = core.bulk_response({0: ("created", 5), 2: ("user_not_found", None), 3: ("conflict", None)}, 4, {1: "Invalid URL."})
+    assert (response["created"], response["conflicts"], response["not_found"], response["invalid"]) == (1, 1, 1, 1)
+    assert [(item["status"], item["id"]) for item in response["results"]] == [
+        ("created", 5), ("invalid", None), ("not_found", None), ("conflict", None)]
+
+
+@pytest.mark.parametrize("count, expected", [(0, 400), (3, 413)])
+def test_bulk_size_limits(count, expected):
+    with pytest.raises(HTTPException) as error:
+        core.check_bulk_size([object()] * count, max_items=2)
+    assert error.value.status_code == expected
@@ -0,0 +1,147 @@
+# test_ratelimit.py
+# -*- coding: utf-8 -*-
+
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+import config
+import core
+import models
+import ratelimit
+from ratelimit import CommandRateLimiter, TokenBuckets
+
+SLOW = 0.001 # Tempo napełniania pomijalne w czasie trwania testu
+
+
+# --- TokenBuckets ---
+
+def test_bucket_refills_at_rate():
+    buckets = TokenBuckets(rate=1.0, burst=2, max_keys=10)
+    assert buckets.wait_time("a", now=0.0) == 0.0 # Nowy kubełek jest pełny
+    buckets.consume("a", now=0.0)
+    buckets.consume("a", now=0.0)
+    assert buckets.wait_time("a", now=0.0) == pytest.approx(1.0)
+    assert buckets.wait_time("a", now=0.25) == pytest.approx(0.75)
+    assert buckets.wait_time("a", now=1.0) == 0.0
+    buckets.consume("a", now=100.0) # Nie więcej niż pojemność, niezależnie od przerwy
+    buckets.consume("a", now=100.0)
+    assert buckets.wait_time("a", now=100.0) == pytest.approx(1.0)
+
+
+def test_cost_above_burst_passes_when_full_and_leaves_debt():
+    buckets = TokenBuckets(rate=1.0, burst=2, max_keys=10)
+    assert buckets.wait_time("a", now=0.0, cost=5) == 0.0
+    buckets.consume("a", now=0.0, cost=5)
+    assert buckets.wait_time("a", now=0.0) == pytest.approx(4.0) # -3 żetony, potrzebny 1
+
+
+def test_least_recently_used_buckets_are_dropped():
+    buckets = TokenBuckets(rate=SLOW, burst=1, max_keys=2)
+    buckets.consume("a", now=0.0)
+    buckets.consume("b", now=0.0)
+    buckets.consume("a", now=0.0) # "a" używany ostatnio
+    buckets.consume("c", now=0.0)
+    assert len(buckets) == 2
+    assert buckets.wait_time("b", now=0.0) == 0.0 # Usunięty - znów pełny
+    assert buckets.wait_time("a", now=0.0) > 0
+
+
+# --- CommandRateLimiter ---
+
+@pytest.fixture
+def limiter(monkeypatch):
+    monkeypatch.setattr(config, "RATE_LIMIT_ENABLED", True)
+    for scope, burst in (("CLIENT", 2), ("GLOBAL", 4), ("USER", 1), ("BARRIER", 1)):
+        monkeypatch.setattr(config, f"RATE_LIMIT_{scope}_RATE", SLOW)
+        monkeypatch.setattr(config, f"RATE_LIMIT_{scope}_BURST", burst)
+    return CommandRateLimiter()
+
+
+def test_user_and_barrier_limits(limiter):
+    assert limiter.check("jan", ["b1"]) == (0.0, None)
+    retry_after, scope = limiter.check("jan", ["b2"])
+    assert scope == "user" and retry_after > 0
+    retry_after, scope = limiter.check("anna", ["b1"])
+    assert scope == "barrier" and retry_after > 0
+
+
+def test_rejected_request_consumes_nothing(limiter):
+    assert limiter.check("jan", ["b1"])[1] is None
+    assert limiter.check("anna", ["b1"])[1] == "barrier"
+    # Odrzucone żądanie nie pobrało żetonu użytkownika ani puli globalnej
+    assert limiter.check("anna", ["b2"])[1] is None
+    assert limiter.check("ewa", ["b3", "b4"])[1] is None # Pula globalna: 4 - 1 - 1 = 2
+    assert limiter.stats()["allowed"] == 3
+    assert limiter.stats()["rejected"]["barrier"] == 1
+
+
+def test_global_pool_charged_per_barrier(limiter):
+    assert limiter.check("jan", ["b1", "b2", "b3"])[1] is None
+    retry_after, scope = limiter.check("anna", ["b4", "b5"]) # W puli globalnej został 1 żeton
+    assert scope == "global" and retry_after > 0
+    assert limiter.check("anna", ["b4", "b4", "b4"])[1] is None # Powtórzony szlaban liczony raz
+
+
+def test_client_limit_checked_separately(limiter):
+    assert limiter.check_client("10.0.0.1") == (0.0, None)
+    assert limiter.check_client("10.0.0.1") == (0.0, None)
+    assert limiter.check_client("10.0.0.1")[1] == "client"
+    assert limiter.check_client("10.0.0.2") == (0.0, None)
+    assert limiter.check("jan", ["b1"])[1] is None # Limit klienta nie zużywa pozostałych
+    stats = limiter.stats()
+    assert stats["tracked_clients"] == 2
+    assert stats["allowed"] == 1 # Tylko żądania po uwierzytelnieniu
+
+
+def test_disabled_limiter_allows_everything(limiter, monkeypatch):
+    monkeypatch.setattr(config, "RATE_LIMIT_ENABLED", False)
+    for _ in range(10):
+        assert limiter.check("jan", ["b1"]) == (0.0, None)
+        assert limiter.check_client("10.0.0.1") == (0.0, None)
+
+
+# --- Limity na ścieżce poleceń (core) ---
+
+def _status(coroutine) -> int:
+    """Status odpowiedzi - send_command_to_barrier zawsze kończy się HTTPException (także 200 kontrolera)."""
+    with pytest.raises(HTTPException) as response:
+        asyncio.run(coroutine)
+    return response.value.status_code
+
+
+def _authz(user_id: int, username: str, permission_level) -> core.CommandAuthorization:
+    return core.CommandAuthorization({"id": user_id, "username": username}, permission_level, "http://controller")
+
+
+@pytest.fixture
+def command_path(limiter, monkeypatch):
+    async def forward(barrier_id, action, authz):
+        return 200, {"message": "ok"}
+
+    monkeypatch.setattr(ratelimit, "command_limiter", limiter)
+    monkeypatch.setattr(core, "_forward_command", forward)
+    return limiter
+
+
+def test_denied_command_does_not_consume_barrier_allowance(command_path):
+    intruder = _authz(2, "intruz", None)
+    operator = _authz(3, "operator", "operator")
+    assert _status(core.send_command_to_barrier("b1", "open", intruder)) == 403
+    assert _status(core.send_command_to_barrier("b1", "service/start", operator)) == 403 # Za niski poziom
+    assert _status(core.send_command_to_barrier("b1", "open", intruder)) == 429 # Odmowy obciążają limit użytkownika
+
+    owner = _authz(1, "jan", "operator")
+    assert _status(core.send_command_to_barrier("b1", "open", owner)) == 200 # Limit szlabanu (burst 1) nietknięty
+    assert command_path.rejected["barrier"] == 0
+
+
+def test_denied_fanout_commands_do_not_consume_barrier_allowance(command_path):
+    commands = [models.BarrierCommand(barrier_id="b1", action="open"), models.BarrierCommand(barrier_id="b2", action="open")]
+    result = asyncio.run(core.send_commands_to_barriers(commands, {"b1": _authz(2, "ewa", "operator"),
+                                                                   "b2": _authz(2, "ewa", None)}))
+    assert [item["status_code"] for item in result["results"]] == [200, 403]
+
+    assert _status(core.send_command_to_barrier("b2", "open", _authz(1, "jan", "operator"))) == 200
+    assert command_path.rejected["barrier"] == 0
@@ -0,0 +1,110 @@
+# test_recent_events.py
+# -*- coding: utf-8 -*-
+
+import asyncio
+import sqlite3
+from datetime import datetime
+
+import config
+import db
+import models
+from recent_events import RecentEventsCache
+
+
+def _event(barrier_id: str) -> models.BarrierEventDBInput:
+    return models.BarrierEventDBInput(barrier_id=barrier_id, event_type="barrier_opened", trigger_method="api",
+                                      timestamp=datetime.now().isoformat(), user_id="1", success=True)
+
+
+def _store(*barrier_ids: str):
+    """Zapisuje po jednym zdarzeniu dla każdego ID szlabanu; zwraca wiersze jak callback writera."""
+    received_at = datetime.now().isoformat()
+    rows = [(_event(barrier_id), received_at) for barrier_id in barrier_ids]
+    ids = db.insert_events(rows)
+    return [(event, received, event_id) for (event, received), event_id in zip(rows, ids)]
+
+
+def _store_from_other_process(barrier_id: str):
+    conn = sqlite3.connect(config.DATABASE_FILE)
+    now = datetime.now().isoformat()
+    conn.execute(f"""INSERT INTO {config.TABLE_BARRIER_EVENTS}
+                     (barrier_id, event_type, trigger_method, event_timestamp, user_id, success, received_at)
+                     VALUES (?, 'barrier_closed', 'api', ?, '1', 1, ?)""", (barrier_id, now, now))
+    conn.commit()
+    conn.close()
+
+
+def _ids(result):
+    return [event["id"] for event in result]
+
+
+def _loaded_cache(capacity: int) -> RecentEventsCache:
+    cache = RecentEventsCache(capacity)
+    assert cache.load()
+    return cache
+
+
+def test_query_served_from_buffers(temp_db):
+    _store("b1", "b2", "b1", "b2", "b1")
+    cache = _loaded_cache(10)
+    assert _ids(cache.query(None, 10)) == [5, 4, 3, 2, 1]
+    assert _ids(cache.query(["b1"], 2)) == [5, 3]
+    assert _ids(cache.query(["b1", "b2"], 10, before_id=4)) == [3, 2, 1]
+    assert cache.hits == 3 and cache.misses == 0
+
+
+def test_gap_in_own_ids_sends_queries_to_db_until_synced(temp_db):
+    _store("b1", "b2")
+    cache = _loaded_cache(10)
+
+    _store_from_other_process("b2") # ID 3 - zapis innego procesu uvicorn
+    cache.on_events(_store("b1")) # ID 4 - luka między 2 a 4
+    assert not cache.ready
+    assert cache.query(["b1"], 10) is None
+    assert cache.stats()["pending_gaps"] == 1
+
+    try:
+        asyncio.run(cache.sync())
+    finally:
+        cache.close()
+    assert cache.ready
+    assert _ids(cache.query(None, 10)) == [4, 3, 2, 1]
+    assert cache.synced_events >= 1
+
+
+def test_sync_picks_up_events_above_max_id(temp_db):
+    _store("b1")
+    cache = _loaded_cache(10)
+    try:
+        asyncio.run(cache.sync()) # Pierwsze sprawdzenie zapamiętuje data_version
+        _store_from_other_process("b3")
+        assert _ids(cache.query(None, 10)) == [1] # Jeszcze nie wie o cudzym zapisie
+        asyncio.run(cache.sync())
+    finally:
+        cache.close()
+    assert _ids(cache.query(None, 10)) == [2, 1]
+
+
+def test_incomplete_buffer_falls_back_to_db_when_older_events_could_match(temp_db):
+    _store("b1", "b1") # 1, 2 - b1 ma całą historię w buforze
+    _store("b2", "b2", "b2", "b2", "b2") # 3..7 - w buforze tylko 4..7
+    _store("b1") # 8
+    cache = _loaded_cache(4)
+
+    assert _ids(cache.query(["b1", "b2"], 5)) == [8, 7, 6, 5, 4]
+    assert cache.query(["b1", "b2"], 6) is None # Z bazy: 8, 7, 6, 5, 4, 3 - zdarzenia 3 nie ma w buforze
+    assert cache.query(["b2"], 5) is None # Za mało zdarzeń w niepełnym buforze
+    assert _ids(cache.query(["b1"], 10)) == [8, 2, 1] # Pełna historia - krótszy wynik jest kompletny
+
+
+def test_out_of_order_event_is_inserted_in_place(temp_db):
+    _store("b1", "b1")
+    cache = _loaded_cache(10)
+    own = _store("b1", "b1") # 3, 4
+    cache.on_events(own[1:]) # 4 przed 3 (luka 2..4)
+    cache.on_events(own[:1])
+    try:
+        asyncio.run(cache.sync())
+    finally:
+        cache.close()
+    assert _ids(cache.query(["b1"], 10)) == [4, 3, 2, 1]
@@ -0,0 +1,102 @@
+# test_retention.py
+# -*- coding: utf-8 -*-
+
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+import archive
+import config
+import db
+import models
+from retention import RetentionManager
+
+OLD = "2026-01-15T08:00:00"
+
+
+def _event(barrier_id: str, success: bool = True) -> models.BarrierEventDBInput:
+    return models.BarrierEventDBInput(barrier_id=barrier_id, event_type="barrier_opened", trigger_method="api",
+                                      timestamp=OLD, success=success)
+
+
+def _ids(events):
+    return [event["id"] for event in events]
+
+
+@pytest.fixture
+def events(temp_db):
+    """Ids 1..7 - stare (do archiwum), 8..9 - świeże."""
+    recent = datetime.now().isoformat()
+    db.insert_events([(_event(f"b{i % 2}", success=i != 3), OLD) for i in range(7)])
+    db.insert_events([(_event("b0"), recent), (_event("b1"), recent)])
+
+
+def _table_ids():
+    with db.get_db() as conn:
+        return [row[0] for row in conn.execute(f"SELECT id FROM {config.TABLE_BARRIER_EVENTS} ORDER BY id")]
+
+
+def test_append_block_and_iter_events_merge_barriers(temp_db):
+    rows = {barrier_id: [[row_id, barrier_id, "barrier_opened", "api", OLD, None, row_id != 4, None, None, OLD]
+                         for row_id in ids] for barrier_id, ids in (("b1", [1, 4, 5]), ("b/2", [2, 3, 6]))}
+    for barrier_id, block in rows.items():
+        assert archive.append_block(barrier_id, "2026-01", block) > 0
+    assert sorted(archive.archived_barrier_ids()) == ["b/2", "b1"] # ID z '/' bezpieczne jako nazwa katalogu
+    assert _ids(archive.iter_events()) == [6, 5, 4, 3, 2, 1]
+    assert _ids(archive.iter_events(["b1"], before_id=5, descending=False)) == [1, 4]
+    assert _ids(archive.iter_events(after_id=2, only_failures=True)) == [4]
+    assert archive.max_archived_id() == 6
+    assert archive.stats()["rows"] == 6
+
+
+def test_retention_moves_old_events_to_archive(events):
+    manager = RetentionManager(max_age_days=30, batch_size=3, batch_pause=0)
+    result = asyncio.run(manager.run_pass())
+    assert result["rows_archived"] == 7
+    assert _table_ids() == [8, 9]
+    assert _ids(archive.iter_events()) == [7, 6, 5, 4, 3, 2, 1]
+    assert asyncio.run(manager.run_pass())["rows_archived"] == 0 # Nic więcej do przeniesienia
+    assert manager.stats()["rows_archived"] == 7
+
+
+def test_queries_continue_into_archive(events):
+    asyncio.run(RetentionManager(30, 100, 0).run_pass())
+    assert _ids(db.get_events_from_db(limit=5)) == [9, 8, 7, 6, 5]
+    assert _ids(db.get_events_from_db(["b1"], limit=10)) == [9, 6, 4, 2]
+    assert _ids(db.get_events_from_db(limit=10, after_id=5)) == [6, 7, 8, 9]
+    assert _ids(db.get_events_from_db(limit=10, only_failures=True)) == [4]
+    exported = [event for batch in db.iter_event_batches_from_db(batch_size=4) for event in batch]
+    assert _ids(exported) == list(range(9, 0, -1))
+    assert exported[-1]["success"] is True
+
+
+def test_interrupted_pass_does_not_duplicate_archived_events(events, monkeypatch):
+    manager = RetentionManager(30, 100, 0)
+    delete = db.delete_events_up_to
+
+    def crash(max_id):
+        raise OSError("process killed")
+
+    monkeypatch.setattr(db, "delete_events_up_to", crash)
+    with pytest.raises(OSError):
+        manager.archive_batch(manager.cutoff()) # Bloki zapisane, wiersze zostały w tabeli
+    monkeypatch.setattr(db, "delete_events_up_to", delete)
+    assert manager.archive_batch(manager.cutoff())[0] == 7 # Ponowna archiwizacja tych samych wierszy
+
+    assert _ids(archive.iter_events()) == [7, 6, 5, 4, 3, 2, 1]
+    assert _ids(db.get_events_from_db(limit=20)) == list(range(9, 0, -1))
+
+
+def test_stats_survive_retention_and_rebuild(events):
+    before = db.get_event_stats_from_db(granularity="total")
+    asyncio.run(RetentionManager(30, 100, 0).run_pass())
+    assert [tuple(row) for row in db.get_event_stats_from_db(granularity="total")] == [tuple(row) for row in before]
+    db.rebuild_event_stats(include_archive=True) # Zdarzenia z archiwum liczone ponownie
+    assert [tuple(row) for row in db.get_event_stats_from_db(granularity="total")] == [tuple(row) for row in before]
+
+
+def test_cutoff_uses_max_age():
+    manager = RetentionManager(max_age_days=2, batch_size=10, batch_pause=0)
+    expected = datetime.now() - timedelta(days=2)
+    assert abs(datetime.fromisoformat(manager.cutoff()) - expected) < timedelta(seconds=5)
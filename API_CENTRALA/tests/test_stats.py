@@ -0,0 +1,85 @@
+# test_stats.py
+# -*- coding: utf-8 -*-
+
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+import config
+import core
+import db
+import models
+
+RECEIVED_AT = "2026-03-05T12:00:00"
+
+
+def _event(barrier_id: str, timestamp: str, success: bool = True, event_type: str = "barrier_opened") -> models.BarrierEventDBInput:
+    return models.BarrierEventDBInput(barrier_id=barrier_id, event_type=event_type, trigger_method="api",
+                                      timestamp=timestamp, success=success)
+
+
+@pytest.fixture
+def events(temp_db):
+    db.insert_events([(_event("b1", "2026-03-01T10:15:00"), RECEIVED_AT),
+                      (_event("b1", "2026-03-01T10:45:00", success=False), RECEIVED_AT),
+                      (_event("b1", "2026-03-01T11:05:00"), RECEIVED_AT),
+                      (_event("b1", "2026-03-02T09:00:00"), RECEIVED_AT),
+                      (_event("b2", "2026-03-01T10:30:00", event_type="barrier_closed"), RECEIVED_AT)])
+    db.insert_events([(_event("b1", "2026-03-01T10:50:00"), RECEIVED_AT)]) # Druga paczka dolicza się do kubełka
+
+
+def _totals(rows):
+    return {(row["barrier_id"], row["bucket"], row["event_type"]): (row["total"], row["failures"]) for row in rows}
+
+
+def _all_stats():
+    with db.get_db() as conn:
+        return sorted(tuple(row) for row in conn.execute(f"SELECT barrier_id, hour, event_type, trigger_method, success, count FROM {config.TABLE_EVENT_STATS}"))
+
+
+def test_stats_hour_uses_event_time_or_received_at():
+    assert db.stats_hour("2026-03-01T10:59:59", RECEIVED_AT) == "2026-03-01T10"
+    assert db.stats_hour("wczoraj", RECEIVED_AT) == "2026-03-05T12" # Niepoprawny czas kontrolera
+    assert db.stats_hour(None, RECEIVED_AT) == "2026-03-05T12"
+
+
+def test_inserted_events_are_rolled_up_per_hour(events):
+    assert _totals(db.get_event_stats_from_db()) == {
+        ("b1", "2026-03-01T10", "barrier_opened"): (3, 1),
+        ("b1", "2026-03-01T11", "barrier_opened"): (1, 0),
+        ("b1", "2026-03-02T09", "barrier_opened"): (1, 0),
+        ("b2", "2026-03-01T10", "barrier_closed"): (1, 0),
+    }
+
+
+def test_granularities_and_filters(events):
+    assert _totals(db.get_event_stats_from_db(["b1"], granularity="day")) == {
+        ("b1", "2026-03-01", "barrier_opened"): (4, 1),
+        ("b1", "2026-03-02", "barrier_opened"): (1, 0),
+    }
+    assert _totals(db.get_event_stats_from_db(granularity="total", event_type="barrier_closed")) == {
+        ("b2", "total", "barrier_closed"): (1, 0),
+    }
+    # since włącznie, until wyłącznie
+    assert _totals(db.get_event_stats_from_db(["b1"], since_hour="2026-03-01T11", until_hour="2026-03-02T09")) == {
+        ("b1", "2026-03-01T11", "barrier_opened"): (1, 0),
+    }
+    assert db.get_event_stats_from_db([]) == []
+
+
+def test_rebuild_matches_incremental_rollup(events):
+    incremental = _all_stats()
+    assert db.rebuild_event_stats() == len(incremental)
+    assert _all_stats() == incremental
+
+
+def test_stats_response_merges_event_types(events):
+    result = asyncio.run(core.stats_response(["b1", "b2"], since="2026-03-01T10:00:00", until="2026-03-01T11:00:00"))
+    assert result["total"] == 4 and result["failures"] == 1
+    assert [(bucket["barrier_id"], bucket["total"], bucket["failure_rate"]) for bucket in result["buckets"]] == [
+        ("b1", 3, round(1 / 3, 4)), ("b2", 1, 0.0)]
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(core.stats_response(None, granularity="week"))
+    assert error.value.status_code == 400
@@ -0,0 +1,175 @@
+# test_tokens.py
+# -*- coding: utf-8 -*-
+
+import sqlite3
+
+import pytest
+
+import config
+import db
+from authz_cache import AuthorizationCache
+from tokens import TokenManager
+
+
+def _counters():
+    with db.get_db() as conn:
+        return db.get_authz_generation(conn), db.get_token_state_generation(conn)
+
+
+def _manager() -> TokenManager:
+    """Menedżer jak w jednym procesie serwera: klucz i stan tokenów z bazy."""
+    manager = TokenManager(ttl=3600)
+    manager.set_key(db.get_server_secret("token_signing_key"))
+    assert manager.load()
+    return manager
+
+
+@pytest.fixture
+def user(temp_db):
+    db.create_db_user("jan", "hash")
+    return db.get_user_by_username("jan")
+
+
+# --- Stan tokenów między procesami ---
+
+def test_revocation_bumps_token_state_not_authz_generation(user):
+    manager = _manager()
+    token, _ = manager.issue(user['id'], user['username'], user['token_generation'])
+    authz_before, tokens_before = _counters()
+    assert manager.revoke(token) is True
+    authz_after, tokens_after = _counters()
+    assert authz_after == authz_before # Wylogowanie nie przeładowuje uprawnień ani nie czyści cache poświadczeń
+    assert tokens_after == tokens_before + 1
+
+
+def test_user_changes_bump_token_state(user):
+    _, tokens_before = _counters()
+    db.create_db_user("anna", "hash")
+    assert _counters()[1] == tokens_before + 1 # Nowy użytkownik - generacja znana innym procesom
+
+    authz_before, tokens_before = _counters()
+    with db.get_db() as conn:
+        conn.execute(f"UPDATE {config.TABLE_USERS} SET hashed_password = 'nowe' WHERE id = ?", (user['id'],))
+    authz_after, tokens_after = _counters()
+    assert authz_after > authz_before # Zmiana hasła nadal unieważnia cache poświadczeń
+    assert tokens_after > tokens_before
+
+
+def test_other_process_sees_revocation_without_authz_reload(user):
+    issuer, other = _manager(), _manager()
+    authz = AuthorizationCache()
+    assert authz.load()
+    try:
+        assert not other.check_consistency() and not authz.check_consistency() # Zapamiętują data_version
+        token, _ = issuer.issue(user['id'], user['username'], user['token_generation'])
+        assert other.verify(token) is not None
+
+        issuer.revoke(token)
+        assert other.check_consistency()
+        assert other.verify(token) is None
+        assert not authz.check_consistency() # Bez przeładowania authz i callbacków (credential_cache.clear)
+        assert authz.reloads == 1
+    finally:
+        other.close()
+        authz.close()
+
+
+def test_other_process_sees_revoke_user_and_new_users(user):
+    issuer, other = _manager(), _manager()
+    try:
+        other.check_consistency()
+        new_id = db.create_db_user("anna", "hash")
+        new_user = db.get_user_by_username("anna")
+        token, _ = issuer.issue(new_id, "anna", new_user['token_generation'])
+        assert other.verify(token) is None # Jeszcze nie zna tego użytkownika
+        assert other.check_consistency()
+        assert other.verify(token) is not None
+
+        assert issuer.revoke_user(new_id)
+        assert other.check_consistency()
+        assert other.verify(token) is None
+    finally:
+        other.close()
+
+
+def test_consistency_check_survives_database_errors(user, monkeypatch):
+    manager = _manager()
+
+    def broken():
+        raise sqlite3.OperationalError("unable to open database file")
+
+    monkeypatch.setattr(db, "open_dedicated_connection", broken)
+    assert manager.check_consistency() is False
+    assert manager.loaded
+
+
+# --- Wydawanie i odwoływanie ---
+
+def test_issued_token_verifies_until_tampered_or_expired(user):
+    manager = _manager()
+    token, _ = manager.issue(user['id'], user['username'], user['token_generation'])
+    assert manager.verify(token) == {"id": user['id'], "username": "jan"}
+
+    payload, signature = token.split(".")
+    assert manager.verify(payload + "." + signature[::-1]) is None
+    assert manager.verify("not-a-token") is None
+
+    short_lived = TokenManager(ttl=-1)
+    short_lived.set_key(db.get_server_secret("token_signing_key"))
+    short_lived.load()
+    expired, _ = short_lived.issue(user['id'], user['username'], user['token_generation'])
+    assert short_lived.verify(expired) is None
+    assert manager.stats()["rejected"] == 2
+
+
+def test_manager_without_key_or_state_rejects_tokens(user):
+    manager = TokenManager(ttl=3600)
+    assert not manager.ready
+    with pytest.raises(RuntimeError):
+        manager.issue(user['id'], user['username'], 0)
+
+    token, _ = _manager().issue(user['id'], user['username'], user['token_generation'])
+    unloaded = TokenManager(ttl=3600)
+    unloaded.set_key(db.get_server_secret("token_signing_key"))
+    assert unloaded.verify(token) is None # Stan odwołań niewczytany - nie ufamy tokenom
+
+
+def test_revoked_token_is_rejected_after_restart(user):
+    manager = _manager()
+    token, _ = manager.issue(user['id'], user['username'], user['token_generation'])
+    other, _ = manager.issue(user['id'], user['username'], user['token_generation'])
+    assert manager.revoke(token) is True
+    assert manager.revoke("garbage") is False
+    assert manager.verify(token) is None
+    assert manager.verify(other) is not None
+
+    restarted = _manager() # Odwołanie jest w bazie
+    assert restarted.verify(token) is None
+    assert restarted.verify(other) is not None
+
+
+def test_revoke_user_invalidates_all_issued_tokens(user):
+    manager = _manager()
+    tokens = [manager.issue(user['id'], user['username'], user['token_generation'])[0] for _ in range(3)]
+    assert manager.revoke_user(user['id'])
+    assert all(manager.verify(token) is None for token in tokens)
+
+    fresh = db.get_user_by_username("jan")
+    token, _ = manager.issue(fresh['id'], fresh['username'], fresh['token_generation'])
+    assert manager.verify(token) is not None
+
+
+def test_password_change_and_deletion_invalidate_tokens(user):
+    manager = _manager()
+    token, _ = manager.issue(user['id'], user['username'], user['token_generation'])
+    with db.get_db() as conn:
+        conn.execute(f"UPDATE {config.TABLE_USERS} SET hashed_password = 'nowe' WHERE id = ?", (user['id'],))
+    assert manager.load()
+    assert manager.verify(token) is None
+
+    fresh = db.get_user_by_username("jan")
+    token, _ = manager.issue(fresh['id'], fresh['username'], fresh['token_generation'])
+    with db.get_db() as conn:
+        conn.execute(f"DELETE FROM {config.TABLE_USERS} WHERE id = ?", (user['id'],))
+    assert manager.load()
+    assert manager.verify(token) is None
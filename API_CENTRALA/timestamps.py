@@ -0,0 +1,38 @@
+# timestamps.py
+# -*- coding: utf-8 -*-
+
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+# Znaczniki czasu zdarzeń są w bazie tekstem ISO 8601 (jak je przysłał kontroler) oraz,
+# do filtrowania zakresami, liczbą mikrosekund od epoki Unix (kolumny *_ts_us).
+# Czas bez strefy traktujemy jako lokalny czas serwera - tak zapisywane jest received_at.
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_MICROSECOND = timedelta(microseconds=1)
+
+
+def parse_event_time(event_timestamp: Optional[str], received_at: str) -> datetime:
+    """Czas zdarzenia z kontrolera, a gdy nie jest poprawnym ISO 8601 - czas odebrania przez centralę."""
+    try:
+        return datetime.fromisoformat(event_timestamp)
+    except (TypeError, ValueError):
+        return datetime.fromisoformat(received_at)
+
+def to_local_naive(moment: datetime) -> datetime:
+    """Sprowadza czas ze strefą do lokalnego czasu serwera bez strefy (jak received_at)."""
+    if moment.tzinfo is not None:
+        return moment.astimezone().replace(tzinfo=None)
+    return moment
+
+def to_epoch_us(moment: datetime) -> int:
+    """Mikrosekundy od epoki Unix (dokładnie, bez zaokrągleń float)."""
+    return (moment.astimezone(timezone.utc) - _EPOCH) // _MICROSECOND
+
+def iso_to_epoch_us(value: str) -> int:
+    """ISO 8601 -> mikrosekundy od epoki; ValueError dla niepoprawnego tekstu."""
+    return to_epoch_us(datetime.fromisoformat(value))
+
+def event_time_us(event_timestamp: Optional[str], received_at: str) -> int:
+    """Wartość kolumny event_ts_us dla zdarzenia."""
+    return to_epoch_us(parse_event_time(event_timestamp, received_at))
@@ -0,0 +1,219 @@
+# tokens.py
+# -*- coding: utf-8 -*-
+
+import asyncio
+import base64
+import binascii
+import hashlib
+import hmac
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+import config
+import db
+import db_async
+
+log = logging.getLogger(__name__)
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+def _b64decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+class TokenManager:
+    """Podpisane tokeny dostępu (bearer) - bcrypt tylko przy logowaniu, potem sam HMAC.
+
+    Token to `base64url(JSON) + "." + base64url(HMAC-SHA256)`; JSON zawiera id i nazwę
+    użytkownika, czas wygaśnięcia ("exp"), losowy identyfikator ("jti") i generację tokenów
+    użytkownika z chwili wydania ("g"). Klucz podpisu jest przechowywany w bazie (wspólny
+    dla wszystkich procesów serwera).
+
+    Odwołania też są w bazie: pojedyncze tokeny w tabeli odwołań (do wygaśnięcia), a wszystkie
+    tokeny użytkownika - przez podbicie jego generacji (również triggerem przy zmianie hasła).
+    Token usuniętego użytkownika nie ma generacji, więc jest nieważny. `verify` sprawdza obraz
+    tych danych w pamięci; przeładowuje go `load` - w lifespan i gdy `watch` zobaczy zmianę
+    licznika stanu tokenów (jak w authz_cache: PRAGMA data_version, potem licznik utrzymywany
+    triggerami). Licznik jest osobny od generacji authz, więc wylogowanie nie przeładowuje
+    uprawnień ani nie czyści cache poświadczeń; zmiany z innych procesów działają po najwyżej
+    AUTHZ_CACHE_CHECK_INTERVAL.
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._key: Optional[bytes] = None
+        self._lock = threading.Lock()
+        self._revoked: Dict[int, int] = {} # jti -> exp
+        self._generations: Dict[int, int] = {} # user_id -> generacja tokenów
+        self._state_generation: Optional[int] = None # Licznik stanu tokenów z chwili wczytania
+        self._watch_conn: Optional[sqlite3.Connection] = None
+        self._data_version: Optional[int] = None
+        self.loaded = False
+
+        # Statystyki
+        self.issued = 0
+        self.verified = 0
+        self.rejected = 0
+        self.revocations = 0
+        self.reloads = 0
+
+    @property
+    def ready(self) -> bool:
+        return self._key is not None and self.loaded
+
+    def set_key(self, key: bytes):
+        """Ustawia klucz podpisu (wczytany z bazy w lifespan)."""
+        self._key = key
+
+    def load(self) -> bool:
+        """Wczytuje generacje użytkowników i odwołane tokeny z bazy (synchronicznie - w executorze DB)."""
+        state = db.load_token_state(int(time.time()))
+        if state is None:
+            log.error("Tokens: Failed to load revocation state, bearer auth unavailable until the next reload.")
+            return False
+        generations, revoked, state_generation = state
+        with self._lock:
+            self._generations = generations
+            self._revoked = revoked
+            self._state_generation = state_generation
+            self.loaded = True
+            self.reloads += 1
+        log.debug(f"Tokens: Loaded {len(generations)} users and {len(revoked)} revoked tokens.")
+        return True
+
+    def check_consistency(self) -> bool:
+        """Przeładowuje stan, jeśli odwołania lub generacje zmieniły się w bazie. Zwraca True po przeładowaniu."""
+        try:
+            if self._watch_conn is None:
+                self._watch_conn = db.open_dedicated_connection()
+            data_version = self._watch_conn.execute("PRAGMA data_version").fetchone()[0]
+            if data_version == self._data_version:
+                return False # Nikt nic nie zatwierdził od ostatniego sprawdzenia
+            self._data_version = data_version
+            state_generation = db.get_token_state_generation(self._watch_conn)
+        except sqlite3.Error as e:
+            log.error(f"Tokens: Consistency check failed: {e}")
+            self.close()
+            return False
+        if state_generation == self._state_generation:
+            return False # Zmieniły się tylko inne tabele
+        return self.load()
+
+    async def watch(self, interval: float):
+        """Pętla tła (lifespan): okresowo sprawdza, czy inny proces odwołał tokeny."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await db_async.run(self.check_consistency)
+            except Exception:
+                log.exception("Tokens: Unexpected error in watcher.")
+
+    def close(self):
+        """Zamyka dedykowane połączenie obserwujące (przy zamykaniu serwera)."""
+        if self._watch_conn is not None:
+            try:
+                self._watch_conn.close()
+            except sqlite3.Error:
+                pass
+            self._watch_conn = None
+            self._data_version = None
+
+    def _sign(self, payload: bytes) -> bytes:
+        return hmac.new(self._key, payload, hashlib.sha256).digest()
+
+    def issue(self, user_id: int, username: str, generation: int) -> Tuple[str, int]:
+        """Wydaje token dla użytkownika (`generation` - token_generation z jego wiersza). Zwraca (token, exp jako czas Unix)."""
+        if self._key is None:
+            raise RuntimeError("Token signing key not loaded.")
+        with self._lock:
+            # Użytkownik dodany po ostatnim przeładowaniu - wiersz właśnie przeczytany z bazy jest aktualny
+            generation = self._generations.setdefault(user_id, generation)
+        now = time.time()
+        expires_at = int(now + self.ttl)
+        claims = {"u": user_id, "n": username, "iat": now, "exp": expires_at,
+                  "jti": int.from_bytes(os.urandom(8), "big"), "g": generation}
+        payload = json.dumps(claims, separators=(",", ":")).encode()
+        self.issued += 1
+        return f"{_b64encode(payload)}.{_b64encode(self._sign(payload))}", expires_at
+
+    def _decode(self, token: str) -> Optional[Dict]:
+        """Sprawdza podpis i zwraca claims (bez sprawdzania wygaśnięcia i odwołań) albo None."""
+        if self._key is None:
+            return None
+        try:
+            payload_part, signature_part = token.split(".")
+            payload = _b64decode(payload_part)
+            if not hmac.compare_digest(_b64decode(signature_part), self._sign(payload)):
+                return None
+            claims = json.loads(payload)
+        except (ValueError, binascii.Error):
+            return None
+        if not isinstance(claims, dict) or not all(isinstance(claims.get(name), int) for name in ("u", "exp", "jti", "g")):
+            return None
+        return claims
+
+    def verify(self, token: str) -> Optional[Dict]:
+        """Zwraca użytkownika {"id", "username"} dla ważnego tokenu albo None (bez dostępu do bazy)."""
+        claims = self._decode(token)
+        if (claims is None or not self.loaded or claims["exp"] <= time.time() or claims["jti"] in self._revoked
+                or self._generations.get(claims["u"]) != claims["g"]):
+            self.rejected += 1
+            return None
+        self.verified += 1
+        return {"id": claims["u"], "username": claims.get("n")}
+
+    def revoke(self, token: str) -> Optional[bool]:
+        """Odwołuje pojedynczy token (np. wylogowanie) - synchronicznie, w executorze DB.
+
+        Zwraca False dla niepoprawnego tokenu, None przy błędzie bazy.
+        """
+        claims = self._decode(token)
+        if claims is None:
+            return False
+        now = int(time.time())
+        if claims["exp"] > now:
+            if not db.add_token_revocation(claims["jti"], claims["exp"], now):
+                return None
+            with self._lock:
+                # Przy okazji usuń wpisy tokenów, które i tak już wygasły
+                for jti in [jti for jti, exp in self._revoked.items() if exp <= now]:
+                    del self._revoked[jti]
+                self._revoked[claims["jti"]] = claims["exp"]
+        self.revocations += 1
+        return True
+
+    def revoke_user(self, user_id: int) -> bool:
+        """Unieważnia wszystkie dotychczas wydane tokeny użytkownika - synchronicznie, w executorze DB."""
+        generation = db.bump_token_generation(user_id)
+        if generation is None:
+            return False
+        with self._lock:
+            self._generations[user_id] = generation
+            self.revocations += 1
+        log.info(f"Tokens: Revoked all tokens of user ID {user_id} issued so far (generation {generation}).")
+        return True
+
+    def stats(self) -> Dict:
+        """Zwraca statystyki tokenów do monitoringu."""
+        return {
+            "ready": self.ready,
+            "reloads": self.reloads,
+            "state_generation": self._state_generation,
+            "ttl_s": self.ttl,
+            "issued": self.issued,
+            "verified": self.verified,
+            "rejected": self.rejected,
+            "revocations": self.revocations,
+            "denylist_size": len(self._revoked),
+        }
+
+
+# Globalny menedżer tokenów (klucz wczytywany w lifespan)
+manager = TokenManager(config.TOKEN_TTL)
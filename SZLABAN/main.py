@@ -30,6 +30,9 @@ class AppConfig:
     LOG_LEVEL = "INFO"
     # Adres URL endpointu centrali do wysyłania zdarzeń
     CENTRAL_ENDPOINT_URL = 'http://192.168.1.101:5002/barrier/event' # URL lub None, jak jwst none to sie nie wysla wiadomosci do centrali po prostu
+    # Ponowienia, gdy centrala jest przeciążona (503 z Retry-After)
+    CENTRAL_MAX_RETRIES = 3
+    CENTRAL_MAX_RETRY_DELAY = 30.0
     # Unikalne ID tego szlabanu
     BARRIER_ID = "szlaban_juliuszka"
 
@@ -63,7 +66,17 @@ def send_notification_async(payload):
         return
     log.debug(f"Wysyłanie powiadomienia do {AppConfig.CENTRAL_ENDPOINT_URL}: {payload}")
     try:
-        response = requests.post(AppConfig.CENTRAL_ENDPOINT_URL, json=payload, timeout=10)
+        for attempt in range(AppConfig.CENTRAL_MAX_RETRIES + 1):
+            response = requests.post(AppConfig.CENTRAL_ENDPOINT_URL, json=payload, timeout=10)
+            if response.status_code != 503 or attempt == AppConfig.CENTRAL_MAX_RETRIES:
+                break
+            # Centrala przeciążona - ponów po czasie, który sama podała
+            try:
+                delay = min(float(response.headers.get("Retry-After", 1)), AppConfig.CENTRAL_MAX_RETRY_DELAY)
+            except ValueError:
+                delay = 1.0
+            log.warning(f"Centrala przeciążona (503), ponowienie za {delay:.0f} s.")
+            time.sleep(delay)
         response.raise_for_status()
         log.info(f"Powiadomienie wysłane pomyślnie (status: {response.status_code}).")
     except requests.exceptions.RequestException as e: